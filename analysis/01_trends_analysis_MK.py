@@ -1,89 +1,106 @@
+import json
+import shutil
+
 import numpy as np
 import pymannkendall as mk
 import os
 import fnmatch
 import rasterio as ras
 from tqdm import tqdm
+from my_utils import FileUtils
+from my_utils import PixelMatrix
+from my_utils import PixelStore
+from my_utils import RasterStack
+from my_utils import RunReport
+from my_utils import ResultWriter
+from my_utils import TrendUtils
 
 """
 Theil-Sen Median趋势分析 + Mann-Kendall检验法
 """
 
+band_Des = ['slope', 'trend', 'p_value', 'score', 'tau', 'z_value']
+save_names = ['slope.tif', 'Trend.tif', 'p.tif', 's.tif', 'tau.tif', 'z.tif']
+state_names = ['idx', 'values', 's', 'tie_sum']
 
-def sen_mk_test(image_path, result_path):
-    # image_path:影像的存储路径
-    # result_path:结果输出路径
 
-    filepaths = fnmatch.filter(os.listdir(image_path), '*.tif')
-    _filepaths = []
-    for fn in filepaths:
-        _filepaths.append(os.path.join(image_path, fn))
-    filepaths = _filepaths
+class MKStateWriter:
+    """
+    逐块收集增量更新（sen_mk_append）所需的状态，结束时合并写入 {state_dir}：
+        meta.json       网格信息以及参与计算的影像列表
+        idx.npy         (n,) 有效像元在整景中的一维下标
+        values.npy      (n, T) 有效像元的时间序列
+        s.npy           (n,) Mann-Kendall S
+        tie_sum.npy     (n,) 结值修正项 sum(tp * (tp - 1) * (2 * tp + 5))
+    每块先单独存盘，合并时逐块拷贝，内存占用只与块大小有关
+    """
 
-    # 获取影像数量
-    num_images = len(filepaths)
-    # 读取影像数据
-    img1 = ras.open(filepaths[0])
-    # 获取影像的投影，高度和宽度
-    crs1 = img1.crs
-    transform1 = img1.transform
-    height1 = img1.height
-    width1 = img1.width
-    array1 = img1.read()
-    nodata = img1.nodata
-    img1.close()
-
-    # 读取所有影像
-    print('-----读取影像------')
-    for path1 in tqdm(filepaths[1:]):
-        if path1[-3:] == 'tif':
-            img2 = ras.open(path1)
-            array2 = img2.read()
-            array1 = np.vstack((array1, array2))
-            img2.close()
-
-    nums, width, height = array1.shape
-
-    # 写影像
-    def writeImage(image_save_path, height1, width1, para_array, bandDes, crs1, transform1, nodata):
-        with ras.open(
-                image_save_path,
-                'w',
-                driver='GTiff',
-                height=height1,
-                width=width1,
-                count=1,
-                dtype=para_array.dtype,
-                crs=crs1,
-                transform=transform1,
-                nodata=nodata
-        ) as dst:
-            dst.write_band(1, para_array)
-            dst.set_band_description(1, bandDes)
-        del dst
-
-    # 输出矩阵，无值区用-9999填充
-    slope_array = np.full([width, height], np.nan)
-    z_array = np.full([width, height], np.nan)
-    Trend_array = np.full([width, height], np.nan)
-    Tau_array = np.full([width, height], np.nan)
-    s_array = np.full([width, height], np.nan)
-    p_array = np.full([width, height], np.nan)
-    # 只有有值的区域才进行mk检验
-    c1 = np.isnan(array1)
-    sum_array1 = np.sum(c1, axis=0)
-    nan_positions = np.where(sum_array1 == num_images)
+    def __init__(self, state_dir, meta):
+        self.state_dir = state_dir
+        self.tmp_dir = state_dir + '.tmp'
+        self.meta = meta
+        self.n_parts = 0
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        FileUtils.mkdirs(self.tmp_dir)
 
-    positions = np.where(sum_array1 != num_images)
+    def add(self, idx, block, s, tie_sum=None):
+        if tie_sum is None:
+            tie_sum = TrendUtils.tie_sum(block)
+        for name, arr in zip(state_names, [idx, block, s, tie_sum]):
+            np.save(os.path.join(self.tmp_dir, 'part_%05d_%s.npy' % (self.n_parts, name)), arr)
+        self.n_parts += 1
 
-    # mk test
-    print('-----mk-test------')
-    for i in tqdm(range(len(positions[0]))):
-        x = positions[0][i]
-        y = positions[1][i]
-        mk_list1 = array1[:, x, y]
+    def close(self):
+        for name in state_names:
+            part_paths = [os.path.join(self.tmp_dir, 'part_%05d_%s.npy' % (i, name)) for i in range(self.n_parts)]
+            parts = [np.load(pp, mmap_mode='r') for pp in part_paths]
+            dtype = parts[0].dtype if parts else np.float64
+            shape = (sum(len(pa) for pa in parts),) + (parts[0].shape[1:] if parts else ())
+            out = np.lib.format.open_memmap(os.path.join(self.tmp_dir, name + '.npy'), mode='w+', dtype=dtype,
+                                            shape=shape)
+            start = 0
+            for pa in parts:
+                out[start:start + len(pa)] = pa
+                start += len(pa)
+            out.flush()
+            del out, parts
+            for pp in part_paths:
+                os.remove(pp)
+
+        with open(os.path.join(self.tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        if os.path.exists(self.state_dir):
+            shutil.rmtree(self.state_dir)
+        os.rename(self.tmp_dir, self.state_dir)
+
+
+def _state_meta(paths, height, width, crs, transform, nodata):
+    return {
+        'paths': [os.path.abspath(p) for p in paths],
+        'height': height,
+        'width': width,
+        'crs': crs.to_wkt() if crs else None,
+        'transform': list(transform)[:6],
+        'nodata': nodata,
+    }
+
+
+def _sen_mk_block(block, engine='batch'):
+    """
+    对一个 (N, T) 的像元块做 Theil-Sen + MK 检验，返回 [slope, Trend, p, s, tau, z] 六个 (N,) 数组，
+    以及结值修正项 (N,)（pymannkendall 不提供，为 None）
+    """
+    if engine == 'batch':
+        result = TrendUtils.sen_mk_batch(block)
+        return [result['slope'], result['trend'], result['p'], result['s'], result['Tau'], result['z']], \
+            result['tie_sum']
+
+    out = np.full((len(save_names), block.shape[0]), np.nan)
+    for i in range(block.shape[0]):
+        mk_list1 = block[i]
         trend, h, p, z, Tau, s, var_s, slope, intercept = mk.original_test(mk_list1)
-        '''        
+        '''
         trend: tells the trend (increasing, decreasing or no trend)
                 h: True (if trend is present) or False (if trend is absence)
                 p: p-value of the significance test
@@ -101,41 +118,310 @@ def sen_mk_test(image_path, result_path):
             trend_value = 1
         else:
             trend_value = 0
-        slope_array[x, y] = slope  # senslope
-        s_array[x, y] = s
-        z_array[x, y] = z
-        Trend_array[x, y] = trend_value
-        p_array[x, y] = p
-        Tau_array[x, y] = Tau
-
-    all_array = [slope_array, Trend_array, p_array, s_array, Tau_array, z_array]
-
-    slope_save_path = os.path.join(result_path, "slope.tif")
-    Trend_save_path = os.path.join(result_path, "Trend.tif")
-    p_save_path = os.path.join(result_path, "p.tif")
-    s_save_path = os.path.join(result_path, "s.tif")
-    tau_save_path = os.path.join(result_path, "tau.tif")
-    z_save_path = os.path.join(result_path, "z.tif")
-    image_save_paths = [slope_save_path, Trend_save_path, p_save_path, s_save_path, tau_save_path, z_save_path]
-    band_Des = ['slope', 'trend', 'p_value', 'score', 'tau', 'z_value']
-
-    if not os.path.exists(result_path):
-        os.makedirs(result_path)
+        out[:, i] = [slope, trend_value, p, s, Tau, z]
+    return list(out), None
+
+
+def _sen_mk_pixels(pixels, engine='batch', block_size=20000, show_progress=True, state_writer=None, idx_offset=0):
+    """
+    对 PixelMatrix 中的有效像元做 Theil-Sen + MK 检验，返回 [slope, Trend, p, s, tau, z] 六个 (n_valid,) 数组。
+    state_writer 不为 None 时同时保存增量更新状态，idx_offset 为像元下标到整景一维下标的偏移
+    """
+    all_array = [np.full(pixels.n_valid, np.nan) for _ in save_names]
+
+    # pymannkendall 逐像元计算时分块只用于更新进度条
+    for sl in tqdm(pixels.block_slices(block_size), disable=not show_progress):
+        block = pixels.values[sl]
+        results, tie_sum = _sen_mk_block(block, engine)
+        for out_array, result in zip(all_array, results):
+            out_array[sl] = result
+        if state_writer is not None:
+            # batch 模式已算出结值修正项，直接保存，不再排序重算
+            state_writer.add(pixels.idx[sl] + idx_offset, block, results[3], tie_sum)
+
+    return all_array
+
+
+def _sen_mk_arrays(array1, engine='batch', block_size=20000, show_progress=True, state_writer=None, row_off=0,
+                   full_width=None):
+    """
+    对一个 (T, H, W) 的数组逐像元做 Theil-Sen + MK 检验，返回 [slope, Trend, p, s, tau, z] 六个 (H, W) 数组，无值区为 nan。
+    state_writer 不为 None 时同时保存增量更新状态，row_off、full_width 为该数组在整景中的起始行和整景宽度
+    """
+    # 只有有值的区域才进行mk检验
+    pixels = PixelMatrix.from_array(np.moveaxis(array1, 0, -1))
+    all_array = _sen_mk_pixels(pixels, engine, block_size, show_progress, state_writer,
+                               idx_offset=row_off * (full_width or pixels.width))
+    return [pixels.scatter(result) for result in all_array]
+
+
+# 写影像
+def result_writer(result_path, height1, width1, crs1, transform1, multiband=False, cog=False, overviews=None):
+    """
+    结果输出：multiband 为 True 时六个结果写入 {result_path}/sen_mk.tif 的六个波段，否则分别写入 save_names 中的六个文件。
+    均为分块压缩的 float32，nodata 为 nan。overviews 不为 None 时生成金字塔，趋势类别（trend）用众数，其余用均值
+    """
+    resampling = {'trend': 'mode'}
+    if multiband:
+        return ResultWriter(os.path.join(result_path, 'sen_mk.tif'), height1, width1, crs1, transform1, band_Des,
+                            cog=cog, overviews=overviews, overview_resampling=resampling)
+    return ResultWriter(result_path, height1, width1, crs1, transform1, band_Des, multiband=False,
+                        file_names=save_names, cog=cog, overviews=overviews, overview_resampling=resampling)
+
+
+def sen_mk_test(image_path, result_path, engine='batch', block_size=20000, mem_budget_mb=None, cache_dir=None,
+                state_dir=None, multiband=False, cog=False, overviews=None, report_name='run_report.json'):
+    # image_path:影像的存储路径
+    # result_path:结果输出路径
+    # engine:'batch' 按像元块向量化计算（默认）；'pymannkendall' 逐像元调用 mk.original_test
+    #        batch 模式在安装了 numba 时自动使用多核编译内核计算 S、结值修正项和 Sen 斜率
+    # block_size:batch 模式下每次计算的像元数
+    # mem_budget_mb:不为None时按窗口分块读取、计算和写出，峰值内存约束在该预算（MB）以内
+    # cache_dir:不为None时从像元优先的缓存（PixelStore）中读取时间序列，缓存不存在时先生成
+    # state_dir:不为None时保存增量更新状态，之后新增一年数据时可用 sen_mk_append 只读取新影像更新结果
+    # multiband:为True时六个结果写入 sen_mk.tif 一个多波段文件，否则每个结果一个文件
+    # cog:为True时结果输出为 Cloud-Optimized GeoTIFF
+    # overviews:不为None时生成金字塔，降采样倍数列表如 [2, 4, 8]，或 'auto'
+    # report_name:运行报告（各阶段耗时、读写字节数、每秒像元数、峰值内存）在 result_path 下的 JSON 文件名，为None时不输出
+
+    report_path = os.path.join(result_path, report_name) if report_name else None
+    with RunReport('sen_mk_test', report_path, image_path=image_path, result_path=result_path, engine=engine,
+                   block_size=block_size, mem_budget_mb=mem_budget_mb, cache_dir=cache_dir, state_dir=state_dir,
+                   multiband=multiband, cog=cog, overviews=overviews) as report:
+        with report.stage('discover'):
+            # 按文件名（年份）排序，时间序列和增量更新状态中的影像顺序即时间顺序，与目录的枚举顺序无关
+            filepaths = sorted(fnmatch.filter(os.listdir(image_path), '*.tif'))
+            _filepaths = []
+            for fn in filepaths:
+                _filepaths.append(os.path.join(image_path, fn))
+            filepaths = _filepaths
+
+        if cache_dir is not None:
+            _sen_mk_test_cached(filepaths, result_path, engine, block_size, cache_dir, state_dir, multiband, cog,
+                                overviews, report)
+        elif mem_budget_mb is not None:
+            _sen_mk_test_windowed(filepaths, result_path, engine, block_size, mem_budget_mb, state_dir, multiband,
+                                  cog, overviews, report)
+        else:
+            _sen_mk_test_in_memory(filepaths, result_path, engine, block_size, state_dir, multiband, cog, overviews,
+                                   report)
+    print(report.summary())
+
+
+def _sen_mk_test_in_memory(filepaths, result_path, engine, block_size, state_dir=None, multiband=False, cog=False,
+                           overviews=None, report=None):
+    """
+    一次读取全部有效像元的时间序列计算
+    """
+    report = report or RunReport('sen_mk_test')
+    # 读取影像数据
+    stack = RasterStack(filepaths)
+    # 获取影像的投影，高度和宽度
+    crs1 = stack.crs
+    transform1 = stack.transform
+    height1 = stack.height
+    width1 = stack.width
+    nodata = stack.profile['nodata']
+
+    # 逐窗口读取所有影像，只保留有效像元的 (n_valid, T) 时间序列
+    print('-----读取影像------')
+    with report.stage('read'), stack:
+        pixels = PixelMatrix.from_stack(stack)
+    report.count(scenes=len(filepaths), pixels=height1 * width1, valid_pixels=pixels.n_valid,
+                 bytes_read=RunReport.path_bytes(filepaths))
 
+    # mk test
+    print('-----mk-test------')
+    with report.stage('compute'):
+        state_writer = None
+        if state_dir is not None:
+            state_writer = MKStateWriter(state_dir, _state_meta(filepaths, height1, width1, crs1, transform1, nodata))
+        all_array = _sen_mk_pixels(pixels, engine, block_size, state_writer=state_writer)
+        if state_writer is not None:
+            state_writer.close()
+
+    # 结果只在写出时按行条带放回整景
     print('-----输出结果------')
-    for i in tqdm(range(len(all_array))):
-        writeImage(image_save_paths[i], height1, width1, all_array[i], band_Des[i], crs1, transform1, nodata)
+    with report.stage('write'):
+        with result_writer(result_path, height1, width1, crs1, transform1, multiband, cog, overviews) as writer:
+            writer.write_pixels(pixels.idx, all_array)
+    report.count(bytes_written=RunReport.path_bytes(writer.paths))
 
 
-# 调用
+def _sen_mk_test_windowed(filepaths, result_path, engine, block_size, mem_budget_mb, state_dir=None,
+                          multiband=False, cog=False, overviews=None, report=None):
+    """
+    按行条带窗口处理：每个窗口只从每一年的影像中读取对应的切片，计算后交给后台线程写入结果影像，
+    读取（后台线程预取下一个窗口）、计算和写盘三者重叠。峰值内存由 mem_budget_mb 决定，与影像大小以及年份数无关
+    """
+    report = report or RunReport('sen_mk_test')
+    stack = RasterStack(filepaths)
+    num_images = len(stack)
+    report.count(scenes=num_images, pixels=stack.height * stack.width, bytes_read=RunReport.path_bytes(filepaths))
+
+    # 一半预算留给两两斜率计算，另一半留给窗口数据
+    budget = mem_budget_mb * 1024 * 1024
+    pair_bytes = max(1, num_images * (num_images - 1) // 2) * 8 * 3
+    block_size = int(max(1, min(block_size, budget / 2 // pair_bytes)))
+    # 每行的字节数：两份 float32 窗口数据（当前窗口和预取的窗口）+ 计算时转为 float64 的副本 + 六个 float64 结果
+    row_bytes = stack.width * (num_images * (2 * stack.dtype.itemsize + 8) + len(save_names) * 8)
+    max_rows = int(max(1, budget / 2 // row_bytes))
+
+    writer = result_writer(result_path, stack.height, stack.width, stack.crs, stack.transform, multiband, cog,
+                           overviews)
+
+    state_writer = None
+    if state_dir is not None:
+        state_writer = MKStateWriter(state_dir, _state_meta(filepaths, stack.height, stack.width, stack.crs,
+                                                            stack.transform, stack.profile['nodata']))
+
+    print('-----分块mk-test------')
+    try:
+        windows = stack.iter_windows(max_rows=max_rows, prefetch=1)
+        for window, arr in tqdm(windows, total=len(windows)):
+            all_array = _sen_mk_arrays(np.moveaxis(arr, -1, 0), engine, block_size, show_progress=False,
+                                       state_writer=state_writer, row_off=int(window.row_off),
+                                       full_width=stack.width)
+            writer.write_window(window, all_array)
+        print(windows.summary())
+        # 读取在后台线程中进行，compute 为主线程处理各窗口（含交给写盘线程）的耗时
+        report.add_prefetcher(windows)
+        if state_writer is not None:
+            state_writer.close()
+    finally:
+        stack.close()
+        with report.stage('write'):
+            writer.close()
+    report.count(bytes_written=RunReport.path_bytes(writer.paths))
+
+
+def _sen_mk_test_cached(filepaths, result_path, engine, block_size, cache_dir, state_dir=None, multiband=False,
+                        cog=False, overviews=None, report=None):
+    """
+    从 PixelStore 缓存中逐块读取有效像元的时间序列计算，只在写出时把结果放回整景
+    """
+    report = report or RunReport('sen_mk_test')
+    print('-----读取缓存------')
+    with report.stage('read'):
+        store = PixelStore.open_or_build(filepaths, cache_dir)
+    report.count(scenes=len(filepaths), pixels=store.height * store.width, valid_pixels=store.n_valid,
+                 bytes_read=RunReport.path_bytes(store.store_dir))
+
+    state_writer = None
+    if state_dir is not None:
+        state_writer = MKStateWriter(state_dir, _state_meta(filepaths, store.height, store.width, store.crs,
+                                                            store.transform, store.nodata))
+
+    print('-----mk-test------')
+    idx_parts = []
+    result_parts = []
+    # 缓存分块是内存映射的，分块数据在计算时才从磁盘读入
+    with report.stage('compute'):
+        for idx, values in tqdm(store.iter_chunks(), total=store.n_chunks):
+            pixels = PixelMatrix(idx, values, store.height, store.width)
+            idx_parts.append(pixels.idx)
+            result_parts.append(_sen_mk_pixels(pixels, engine, block_size, show_progress=False,
+                                               state_writer=state_writer))
+        if state_writer is not None:
+            state_writer.close()
+
+    # 结果只在写出时按行条带放回整景
+    print('-----输出结果------')
+    with report.stage('write'):
+        with result_writer(result_path, store.height, store.width, store.crs, store.transform, multiband, cog,
+                           overviews) as writer:
+            writer.write_pixels(np.concatenate(idx_parts),
+                                [np.concatenate([part[i] for part in result_parts]) for i in range(len(save_names))])
+    report.count(bytes_written=RunReport.path_bytes(writer.paths))
 
-base_dir = r'D:\project\wrr\data_npp\QFY'
-category_arr = ['npp_extra_tif']
 
-for c in category_arr:
-    input_dir = os.path.join(base_dir, c)
-    output_dir = os.path.join(base_dir, 'trend_mk_' + c)
-    sen_mk_test(input_dir, output_dir)
-    print('################ \n')
+def sen_mk_append(new_image, state_dir, result_path, block_size=20000, multiband=False, cog=False, overviews=None):
+    # new_image:新增一年的影像路径，时间顺序排在已有序列之后，网格（大小、仿射变换、坐标系）需与状态一致，且不能已在状态中
+    # state_dir:上一次 sen_mk_test / sen_mk_append 保存的状态目录，更新后原地替换
+    # result_path:结果输出路径
+    # multiband、cog、overviews:输出方式，同 sen_mk_test
+    # 只读取新影像和状态：S 和结值修正项增量更新，Sen 斜率由状态中保存的时间序列重新计算
+
+    with open(os.path.join(state_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    height1 = meta['height']
+    width1 = meta['width']
+    crs1 = ras.crs.CRS.from_wkt(meta['crs']) if meta['crs'] else None
+    transform1 = ras.Affine(*meta['transform'])
+    new_path = os.path.abspath(new_image)
+    if os.path.normcase(new_path) in [os.path.normcase(p) for p in meta['paths']]:
+        raise Exception('new image %s is already in state %s!' % (new_path, state_dir))
+
+    print('-----读取新影像------')
+    with RasterStack([new_image]) as stack:
+        if (stack.height, stack.width) != (height1, width1):
+            raise Exception('new image size (%d, %d) != state size (%d, %d)!' % (
+                stack.height, stack.width, height1, width1))
+        if not stack.transform.almost_equals(transform1):
+            raise Exception('new image transform %s != state transform %s!' % (tuple(stack.transform)[:6],
+                                                                               tuple(transform1)[:6]))
+        if stack.crs != crs1:
+            raise Exception('new image crs %s != state crs %s!' % (stack.crs, crs1))
+        new_flat = stack.read_window()[0].ravel()
+
+    state = {name: np.load(os.path.join(state_dir, name + '.npy'), mmap_mode='r') for name in state_names}
+    num_images = len(meta['paths'])
+
+    # 之前全部为 nodata、新一年有值的像元，历史序列为全 nan
+    extra_idx = np.setdiff1d(np.flatnonzero(~np.isnan(new_flat)), state['idx'])
+
+    new_meta = dict(meta, paths=meta['paths'] + [new_path])
+    state_writer = MKStateWriter(state_dir, new_meta)
+    n_state = len(state['idx'])
+    # 结果按 [状态中的像元, 新增像元] 的顺序紧凑存放，写出时再放回整景
+    pixels = PixelMatrix(np.concatenate([state['idx'], extra_idx]), None, height1, width1)
+    all_array = [np.full(pixels.n_valid, np.nan) for _ in save_names]
+
+    print('-----mk-test------')
+    blocks = [('state', i) for i in range(0, n_state, block_size)]
+    blocks += [('extra', i) for i in range(0, len(extra_idx), block_size)]
+    for source, start in tqdm(blocks):
+        if source == 'state':
+            # 显式复制到内存，循环结束后留下的变量不会再引用旧状态文件的内存映射
+            block_idx = np.array(state['idx'][start:start + block_size], copy=True)
+            block = np.array(state['values'][start:start + block_size], copy=True)
+            s = np.array(state['s'][start:start + block_size], copy=True)
+            tie_sum = np.array(state['tie_sum'][start:start + block_size], copy=True)
+            out_start = start
+        else:
+            block_idx = extra_idx[start:start + block_size]
+            block = np.full((len(block_idx), num_images), np.nan, dtype=state['values'].dtype)
+            s, tie_sum = np.zeros(len(block_idx)), np.zeros(len(block_idx))
+            out_start = n_state + start
+
+        x_new = new_flat[block_idx]
+        s, tie_sum = TrendUtils.mk_append(block, s, tie_sum, x_new)
+        block = np.concatenate([block, x_new[:, None].astype(block.dtype)], axis=1)
+        result = TrendUtils.sen_mk_batch(block, s=s, tie_sum=tie_sum)
+        results = [result['slope'], result['trend'], result['p'], result['s'], result['Tau'], result['z']]
+        for out_array, res in zip(all_array, results):
+            out_array[out_start:out_start + len(block_idx)] = res
+        state_writer.add(block_idx, block, s, tie_sum)
+
+    # 释放对旧状态文件的全部内存映射后再替换，Windows 上仍被映射的文件不能删除
+    state.clear()
+    del state
+    state_writer.close()
+
+    print('-----输出结果------')
+    with result_writer(result_path, height1, width1, crs1, transform1, multiband, cog, overviews) as writer:
+        writer.write_pixels(pixels.idx, all_array)
+
+
+# 调用
+if __name__ == '__main__':
+    base_dir = r'D:\project\wrr\data_npp\QFY'
+    category_arr = ['npp_extra_tif']
+
+    for c in category_arr:
+        input_dir = os.path.join(base_dir, c)
+        output_dir = os.path.join(base_dir, 'trend_mk_' + c)
+        sen_mk_test(input_dir, output_dir)
+        print('################ \n')
 
-print("------------------end----------------------")
+    print("------------------end----------------------")
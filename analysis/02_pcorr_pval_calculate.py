@@ -1,4 +1,8 @@
 import os.path
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
 
 import pingouin as pg
 import rasterio
@@ -6,6 +10,12 @@ import numpy as np
 from tqdm import tqdm
 from my_utils import FileUtils
 from my_utils import BaseUtils
+from my_utils import CorrUtils
+from my_utils import PixelMatrix
+from my_utils import PixelStore
+from my_utils import RasterStack
+from my_utils import ResultWriter
+from my_utils import RunReport
 
 """
 多变量偏相关分析计算,连带输出检验p值
@@ -17,26 +27,39 @@ out_dir = r'D:\project\wrr\data_npp\基础数据_对齐_贵州\08_pcorr_pval'
 y_name = 'npp'
 element_names = ['降水量', '平均气温', '平均相对湿度', '日照时数']
 template_raster = r'D:\project\wrr\data_npp\基础数据_对齐_贵州\01_npp\2000.tif'
+# 'batch' 按行块向量化计算（默认）；'pingouin' 逐像素调用 pg.partial_corr
+pcorr_engine = 'batch'
+# 每个任务计算的像元数为 block_rows * 影像宽度
+block_rows = 64
+# 进程数，1 表示在当前进程中串行计算
+workers = 1
+# 读取影像时同时解码不同景的线程数
+read_workers = 4
+# 不为 None 时从像元优先的缓存（PixelStore）中读取各变量的时间序列，缓存不存在时先生成
+cache_dir = None
+# True 时全部结果写入 pcorr_pval.tif 一个多波段文件，否则每个结果一个文件
+multiband_output = False
+# True 时结果输出为 Cloud-Optimized GeoTIFF
+cog_output = False
+# 不为 None 时为结果生成金字塔（均值降采样），降采样倍数列表如 [2, 4, 8]，或 'auto'
+overviews = None
+# 运行报告（各阶段耗时、读写字节数、每秒像元数、峰值内存）在 out_dir 下的 JSON 文件名，为 None 时不输出
+report_name = 'run_report.json'
 
-r = rasterio.open(template_raster)
-template_transform = r.transform
-template_crs = r.crs
-template_height = r.height
-template_width = r.width
-r.close()
+df_colum_names = [n for n in element_names]
+df_colum_names.insert(0, y_name)
 
+# 子进程中通过共享内存访问的 (1 + 因子数, n_valid, T) 数组，第 0 个为 y
+_shared_stack = None
+_shared_mem = None
 
-def stack_imgs(img_paths: list[str]):
-    arr_list = []
-    for img_p in img_paths:
-        img = rasterio.open(img_p)
-        arr = img.read()
-        arr = np.squeeze(arr)
-        arr[arr == img.nodata] = np.nan
-        img.close()
-        arr_list.append(arr)
 
-    return np.stack(arr_list, axis=2)
+def read_pixels(img_paths: list[str], idx=None):
+    """
+    逐窗口读取影像（后台预取下一个窗口，多线程解码各景），只保留有效像元（或 idx 指定像元）的 (n_valid, T) 时间序列
+    """
+    with RasterStack(img_paths, workers=read_workers) as stack:
+        return PixelMatrix.from_stack(stack, idx=idx)
 
 
 def _p_corr(df):
@@ -48,62 +71,24 @@ def _p_corr(df):
     return multi_p_corr_result
 
 
-def _save_img(image_save_path, img_arr):
-    with rasterio.open(
-            image_save_path,
-            'w',
-            driver='GTiff',
-            height=template_height,
-            width=template_width,
-            count=1,
-            dtype=img_arr.dtype,
-            crs=template_crs,
-            nodata=np.nan,
-            transform=template_transform,
-    ) as dst:
-        dst.write_band(1, img_arr)
-        dst.set_band_description(1, '')
-    del dst
-
-
-y_file_list = FileUtils.list_full_dir(y_root_dir, '*.tif')
-x_file_2d_list = []
-
-for element_name in element_names:
-    x_file_list = FileUtils.list_full_dir(os.path.join(x_root_dir, element_name), '*.tif')
-    x_file_2d_list.append(x_file_list)
-
-y_imgs = stack_imgs(y_file_list)
-x_2d_imgs = []
-
-for x_file_list in x_file_2d_list:
-    x_2d_imgs.append(stack_imgs(x_file_list))
+def _p_corr_block(y, x_list, engine):
+    """
+    计算 N 个像素各个因子的偏相关系数和p值
+    :param y: (N, T)
+    :param x_list: 因子数个 (N, T)
+    :return: 两个 (N, 因子数) 数组
+    """
+    if engine == 'batch':
+        # 与 pingouin 结果一样保留4位小数
+        r_block, p_block = CorrUtils.partial_corr_batch(y, x_list)
+        return r_block.round(4), p_block.round(4)
 
-df_colum_names = [n for n in element_names]
-df_colum_names.insert(0, y_name)
-
-# 偏相关系数容器
-_p_corr_out_frame_list = []
-# 检验p值容器
-_p_corr_pval_out_frame_list = []
-for i in range(len(element_names)):
-    out_frame = np.full((y_imgs.shape[0], y_imgs.shape[1]), np.nan)
-    _p_corr_out_frame_list.append(out_frame)
-
-    out_frame_pval = np.full((y_imgs.shape[0], y_imgs.shape[1]), np.nan)
-    _p_corr_pval_out_frame_list.append(out_frame_pval)
-
-# 逐像素计算各个因子的偏相关值
-pbar = tqdm(total=y_imgs.shape[0] * y_imgs.shape[1])
-for i in range(y_imgs.shape[0]):
-    for j in range(y_imgs.shape[1]):
-        df_colum_data_arr = []
-        y = y_imgs[i, j, :]
-        df_colum_data_arr.append(y)
-
-        for x_imgs in x_2d_imgs:
-            x = x_imgs[i, j, :]
-            df_colum_data_arr.append(x)
+    r_block = np.full((y.shape[0], len(element_names)), np.nan)
+    p_block = np.full((y.shape[0], len(element_names)), np.nan)
+    for i in range(y.shape[0]):
+        df_colum_data_arr = [y[i]]
+        for x in x_list:
+            df_colum_data_arr.append(x[i])
 
         # 到这里一个像素位置的值都准备好了,生成pandas中的dataframe
         df = BaseUtils.build_pandas_df(df_colum_names, df_colum_data_arr)
@@ -114,20 +99,161 @@ for i in range(y_imgs.shape[0]):
             # 根据df计算出各个因子与y的偏相关
             p_corr_result_list = _p_corr(df)
             for k in range(len(p_corr_result_list)):
-                _p_corr_out_frame_list[k][i, j] = p_corr_result_list[k].iloc[:, 1].values[0]
-                _p_corr_pval_out_frame_list[k][i, j] = p_corr_result_list[k].iloc[:, 3].values[0]
+                r_block[i, k] = p_corr_result_list[k].iloc[:, 1].values[0]
+                p_block[i, k] = p_corr_result_list[k].iloc[:, 3].values[0]
+    return r_block, p_block
+
+
+def _p_corr_chunk(store_dirs, chunk_id, engine):
+    """
+    计算 y 缓存中第 {chunk_id} 个分块内像素的偏相关系数和p值，因子的时间序列按一维下标从各自的缓存中取出。
+    各进程自行内存映射缓存文件，不需要传输数据
+    :return: 一维下标 (n,), 两个 (n, 因子数) 数组
+    """
+    y_store = PixelStore(store_dirs[0])
+    idx, y = y_store.load_chunk(chunk_id)
+    x_list = [PixelStore(d).take(idx) for d in store_dirs[1:]]
+    r_block, p_block = _p_corr_block(y, x_list, engine)
+    return np.asarray(idx), r_block, p_block
+
+
+def _init_worker(shm_name, shape, dtype):
+    global _shared_stack, _shared_mem
+    _shared_mem = shared_memory.SharedMemory(name=shm_name)
+    _shared_stack = np.ndarray(shape, dtype=dtype, buffer=_shared_mem.buf)
+
+
+def _p_corr_range_worker(start, stop, engine):
+    r_block, p_block = _p_corr_block(_shared_stack[0, start:stop], list(_shared_stack[1:, start:stop]), engine)
+    return start, stop, r_block, p_block
+
+
+def main():
+    """
+    按文件开头的配置计算偏相关系数和检验p值并写出结果
+    """
+    report = RunReport('pcorr_pval', os.path.join(out_dir, report_name) if report_name else None,
+                       y_root_dir=y_root_dir, x_root_dir=x_root_dir, element_names=element_names,
+                       pcorr_engine=pcorr_engine, block_rows=block_rows, workers=workers, read_workers=read_workers,
+                       cache_dir=cache_dir, multiband_output=multiband_output, cog_output=cog_output,
+                       overviews=overviews)
+    r = rasterio.open(template_raster)
+    template_transform = r.transform
+    template_crs = r.crs
+    template_height = r.height
+    template_width = r.width
+    r.close()
+
+    with report.stage('discover'):
+        y_file_list = FileUtils.list_full_dir(y_root_dir, '*.tif')
+        x_file_2d_list = []
+
+        for element_name in element_names:
+            x_file_list = FileUtils.list_full_dir(os.path.join(x_root_dir, element_name), '*.tif')
+            x_file_2d_list.append(x_file_list)
+    report.count(scenes=len(y_file_list), pixels=template_height * template_width)
+
+    if cache_dir is not None:
+        # 每个变量各自生成/打开缓存，以 y 缓存的分块为任务单位，子进程自行内存映射读取
+        with report.stage('read'):
+            store_dirs = [PixelStore.open_or_build(y_file_list, cache_dir).store_dir]
+            for x_file_list in x_file_2d_list:
+                store_dirs.append(PixelStore.open_or_build(x_file_list, cache_dir).store_dir)
+        n_chunks = PixelStore(store_dirs[0]).n_chunks
+        report.count(bytes_read=RunReport.path_bytes(store_dirs))
+
+        compute_start = time.perf_counter()
+        idx_parts, r_parts, p_parts = [], [], []
+        pbar = tqdm(total=PixelStore(store_dirs[0]).n_valid)
+        with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+            if executor is None:
+                results = (_p_corr_chunk(store_dirs, c, pcorr_engine) for c in range(n_chunks))
+            else:
+                futures = [executor.submit(_p_corr_chunk, store_dirs, c, pcorr_engine) for c in range(n_chunks)]
+                results = (future.result() for future in as_completed(futures))
+            for idx, r_block, p_block in results:
+                idx_parts.append(idx)
+                r_parts.append(r_block)
+                p_parts.append(p_block)
+                pbar.update(len(idx))
+        pbar.close()
+        pixels = PixelMatrix(np.concatenate(idx_parts), None, template_height, template_width)
+        r_all = np.concatenate(r_parts)
+        p_all = np.concatenate(p_parts)
+        report.add_stage('compute', time.perf_counter() - compute_start)
+    else:
+        # y 的有效像元为计算范围，各因子按同样的像元下标读取
+        with report.stage('read'):
+            pixels = read_pixels(y_file_list)
+            x_values = [read_pixels(x_file_list, pixels.idx).values for x_file_list in x_file_2d_list]
+        report.count(bytes_read=RunReport.path_bytes(y_file_list + sum(x_file_2d_list, [])))
+        block_slices = pixels.block_slices(block_rows * template_width)
+
+        compute_start = time.perf_counter()
+
+        # 偏相关系数和检验p值，(n_valid, 因子数)
+        r_all = np.full((pixels.n_valid, len(element_names)), np.nan)
+        p_all = np.full((pixels.n_valid, len(element_names)), np.nan)
+
+        # 逐像素计算各个因子的偏相关值
+        pbar = tqdm(total=pixels.n_valid)
+        if workers > 1:
+            # 把 y 和各因子的数据放入共享内存，子进程直接映射，不再逐任务序列化传输
+            stack_shape = (len(element_names) + 1,) + pixels.values.shape
+            dtype = pixels.values.dtype
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(stack_shape)) * dtype.itemsize))
+            try:
+                shared_stack = np.ndarray(stack_shape, dtype=dtype, buffer=shm.buf)
+                shared_stack[0] = pixels.values
+                for k, values in enumerate(x_values):
+                    shared_stack[k + 1] = values
+                del x_values
+                pixels.values = None
+
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(shm.name, stack_shape, dtype)) as executor:
+                    futures = [executor.submit(_p_corr_range_worker, sl.start, sl.stop, pcorr_engine)
+                               for sl in block_slices]
+                    for future in as_completed(futures):
+                        start, stop, r_block, p_block = future.result()
+                        r_all[start:stop] = r_block
+                        p_all[start:stop] = p_block
+                        pbar.update(stop - start)
+                del shared_stack
+            finally:
+                shm.close()
+                shm.unlink()
+        else:
+            for sl in block_slices:
+                r_all[sl], p_all[sl] = _p_corr_block(pixels.values[sl], [values[sl] for values in x_values],
+                                                     pcorr_engine)
+                pbar.update(sl.stop - sl.start)
+        pbar.close()
+        report.add_stage('compute', time.perf_counter() - compute_start)
+    report.count(valid_pixels=pixels.n_valid)
+
+    # 结果只在写出时按行条带放回整景，每个因子依次为偏相关系数和检验p值
+    band_names = []
+    band_values = []
+    for i in range(len(element_names)):
+        ele_name = element_names[i]
+        band_names += ['pcorr_' + ele_name, 'pcorr_pval_' + ele_name]
+        band_values += [r_all[:, i], p_all[:, i]]
 
-        pbar.update(1)
-pbar.close()
+    if multiband_output:
+        writer = ResultWriter(os.path.join(out_dir, 'pcorr_pval.tif'), template_height, template_width, template_crs,
+                              template_transform, band_names, cog=cog_output, overviews=overviews)
+    else:
+        writer = ResultWriter(out_dir, template_height, template_width, template_crs, template_transform, band_names,
+                              multiband=False, cog=cog_output, overviews=overviews)
+    with report.stage('write'), writer:
+        writer.write_pixels(pixels.idx, band_values)
+    report.count(bytes_written=RunReport.path_bytes(writer.paths))
 
-for i in range(len(_p_corr_out_frame_list)):
-    out_img_arr = _p_corr_out_frame_list[i]
-    ele_name = element_names[i]
-    out_target = os.path.join(out_dir, 'pcorr_' + ele_name + '.tif')
-    _save_img(out_target, out_img_arr)
+    report.finish()
+    print(report.summary())
+    print('----------end-------------')
 
-    out_img_pval_arr = _p_corr_pval_out_frame_list[i]
-    pval_out_target = os.path.join(out_dir, 'pcorr_pval_' + ele_name + '.tif')
-    _save_img(pval_out_target, out_img_pval_arr)
 
-print('----------end-------------')
+if __name__ == '__main__':
+    main()
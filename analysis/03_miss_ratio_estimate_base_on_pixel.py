@@ -4,6 +4,12 @@ import os
 import numpy as np
 import rasterio
 
+from my_utils import BaseUtils
+from my_utils import PixelStore
+from my_utils import Prefetcher
+from my_utils import RasterStack
+from my_utils import RunReport
+
 """
 基于像元的长时序数据缺失率计算
 
@@ -26,15 +32,106 @@ def read_tif(abs_path):
     return ras_data
 
 
-def read_tifs(path):
+def read_tifs(path, workers=4):
+    # workers:同时解码不同景的线程数
     tif_names = listdir(path, '*.tif')
+    with RasterStack([os.path.join(path, n) for n in tif_names], workers=workers) as stack:
+        return stack.read()
 
-    list_data = []
-    for tifname in tif_names:
-        a = read_tif(os.path.join(path, tifname))
-        list_data.append(a)
 
-    return np.stack(list_data, axis=-1)
+def read_miss_ratio_from_cache(path, cache_dir):
+    """
+    从像元优先的缓存（PixelStore）中计算缺失率，缓存不存在时先生成；不在缓存中的像元全部缺失，缺失率为 1
+    """
+    tif_names = listdir(path, '*.tif')
+    store = PixelStore.open_or_build([os.path.join(path, n) for n in tif_names], cache_dir)
+    missing_ratio = np.ones(store.height * store.width)
+    for idx, values in store.iter_chunks():
+        missing_ratio[idx] = np.mean(np.isnan(values), axis=-1)
+    return missing_ratio.reshape(store.height, store.width)
+
+
+class MissRatioAccumulator:
+    """
+    单次遍历的缺失率累加器：逐景（或逐景的逐个窗口）更新整数计数网格，内存只与影像大小有关，与景数无关。
+    同时统计每一景的缺失比例以及每个像元最长的连续缺失景数
+
+    注意：同一个像元必须按时间顺序更新，即先处理完一景的所有窗口再处理下一景
+    """
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.missing_count = np.zeros((height, width), dtype=np.int32)
+        # 当前连续缺失的景数以及历史最长连续缺失的景数
+        self.current_gap = np.zeros((height, width), dtype=np.int32)
+        self.longest_gap = np.zeros((height, width), dtype=np.int32)
+        self.scene_missing = []
+        self.scene_pixels = []
+
+    @property
+    def n_scenes(self):
+        return len(self.scene_missing)
+
+    def update(self, scene_idx, data, window=None):
+        """
+        :param scene_idx: 景的序号，从 0 开始按时间顺序递增
+        :param data: 该景（或窗口）的二维数组，nan 表示缺失
+        :param window: data 所在的 rasterio.windows.Window，为 None 时表示整景
+        """
+        if scene_idx == self.n_scenes:
+            self.scene_missing.append(0)
+            self.scene_pixels.append(0)
+
+        if window is None:
+            index = (slice(None), slice(None))
+        else:
+            index = window.toslices()
+
+        missing = np.isnan(data)
+        self.missing_count[index] += missing
+        current_gap = self.current_gap[index]
+        current_gap += 1
+        current_gap[~missing] = 0
+        np.maximum(self.longest_gap[index], current_gap, out=self.longest_gap[index])
+
+        self.scene_missing[scene_idx] += int(np.count_nonzero(missing))
+        self.scene_pixels[scene_idx] += missing.size
+
+    def missing_ratio(self):
+        return (self.missing_count / max(self.n_scenes, 1)).astype(np.float32)
+
+    def scene_missing_fraction(self):
+        return np.asarray(self.scene_missing) / np.maximum(np.asarray(self.scene_pixels), 1)
+
+
+def estimate_miss_ratio_streaming(path, max_rows=None, prefetch=2, report=None):
+    """
+    逐景、逐窗口读取 {path} 下的 tif 计算缺失率。连续缺失的统计需要时间顺序，按文件名排序。
+    后台线程按同样的顺序预取后面的景（窗口），解码与累加重叠
+    :param path: 影像目录
+    :param max_rows: 每次读取的最多行数，为 None 时一次读取整景
+    :param prefetch: 预取的景（窗口）数，0 时不预取
+    :param report: 可选的 RunReport，记录读取和计算的耗时以及读取的字节数
+    :return: MissRatioAccumulator, 排序后的文件名列表
+    """
+    tif_names = sorted(listdir(path, '*.tif'))
+    with RasterStack([os.path.join(path, n) for n in tif_names]) as stack:
+        acc = MissRatioAccumulator(stack.height, stack.width)
+        items = [(t, window) for t in range(len(stack)) for window in stack.list_windows(max_rows=max_rows)]
+
+        def load(item):
+            return stack.read_window(item[1], time_idx=[item[0]])[0]
+
+        prefetcher = Prefetcher(items, load, depth=prefetch)
+        for (t, window), data in prefetcher:
+            acc.update(t, data, window)
+    print(prefetcher.summary())
+    if report is not None:
+        report.add_prefetcher(prefetcher)
+        report.count(scenes=len(tif_names), pixels=acc.height * acc.width,
+                     bytes_read=RunReport.path_bytes(stack.paths))
+    return acc, tif_names
 
 
 def write_result(output_path, data, template, dtype):
@@ -45,10 +142,33 @@ def write_result(output_path, data, template, dtype):
 
 if __name__ == '__main__':
     template_ras = rasterio.open(r'C:\Users\wrr\Documents\Tencent Files\1148200541\FileRecv\SG\SG_001.tif')
-    raster_data = read_tifs(r"C:\Users\wrr\Documents\Tencent Files\1148200541\FileRecv\SG")
+    input_dir = r"C:\Users\wrr\Documents\Tencent Files\1148200541\FileRecv\SG"
     output_path = r'C:\Users\wrr\Desktop\222100090356\sg.tif'
-
-    missing_pixels = np.isnan(raster_data)
-    missing_ratio = np.mean(missing_pixels, axis=-1)
-    write_result(output_path, missing_ratio, template_ras, 'float32')
+    # 最长连续缺失景数以及每一景缺失比例的输出路径
+    gap_output_path = r'C:\Users\wrr\Desktop\222100090356\sg_longest_gap.tif'
+    scene_csv_path = r'C:\Users\wrr\Desktop\222100090356\sg_scene_missing.csv'
+    # 不为 None 时从像元优先的缓存中读取
+    cache_dir = None
+    # 运行报告（各阶段耗时、读写字节数、每秒像元数、峰值内存）的输出路径，为 None 时不输出
+    report_path = os.path.splitext(output_path)[0] + '_run_report.json'
+
+    with RunReport('miss_ratio_pixel', report_path, input_dir=input_dir, cache_dir=cache_dir) as report:
+        if cache_dir is not None:
+            with report.stage('compute'):
+                missing_ratio = read_miss_ratio_from_cache(input_dir, cache_dir)
+            report.count(pixels=missing_ratio.size)
+            output_paths = [output_path]
+        else:
+            # 逐景流式统计，不再把全部影像堆叠到内存中
+            acc, tif_names = estimate_miss_ratio_streaming(input_dir, report=report)
+            missing_ratio = acc.missing_ratio()
+            with report.stage('write'):
+                write_result(gap_output_path, acc.longest_gap, template_ras, 'int32')
+                BaseUtils.save2csv_columns(scene_csv_path, ['name', 'missing_fraction'],
+                                           [tif_names, acc.scene_missing_fraction()])
+            output_paths = [output_path, gap_output_path, scene_csv_path]
+        with report.stage('write'):
+            write_result(output_path, missing_ratio, template_ras, 'float32')
+        report.count(bytes_written=RunReport.path_bytes(output_paths))
+    print(report.summary())
     print('------------end------------')
@@ -1,12 +1,18 @@
+import os
+
 import numpy as np
 import rasterio
 
+from my_utils import RunReport
+
 """
 计算一景图像的缺失率
 """
 
 mask_raster_file = r'C:\Users\wrr\Documents\WeChat Files\wxid_bsczvtwojnmv22\FileStorage\File\2023-07\temp\wuqueshi.tif'
 wait_estimate_raster_file = r'C:\Users\wrr\Documents\WeChat Files\wxid_bsczvtwojnmv22\FileStorage\File\2023-07\temp\queshi.tif'
+# 运行报告（各阶段耗时、读取字节数、每秒像元数、峰值内存）的输出路径，为 None 时不输出
+report_path = os.path.splitext(wait_estimate_raster_file)[0] + '_miss_ratio_run_report.json'
 
 
 def read_tif(abs_path):
@@ -39,12 +45,29 @@ def read_tif2mask(abs_path):
     return ras_data
 
 
-arr = read_tif(wait_estimate_raster_file)
-mask = read_tif2mask(mask_raster_file)
+def estimate_miss_ratio(raster_file, mask_file, report_path=None):
+    """
+    计算 {raster_file} 在 {mask_file} 有效范围内的缺失率
+    :param report_path: 运行报告的输出路径，为 None 时不输出
+    :return: 缺失率, RunReport
+    """
+    with RunReport('miss_ratio_raster', report_path, mask_raster_file=mask_file,
+                   wait_estimate_raster_file=raster_file) as report:
+        with report.stage('read'):
+            arr = read_tif(raster_file)
+            mask = read_tif2mask(mask_file)
+        report.count(pixels=arr.size, bytes_read=RunReport.path_bytes([raster_file, mask_file]))
+
+        with report.stage('compute'):
+            extracted_values = arr[mask.astype(bool)]
+            output_array = extracted_values.flatten()
+
+            missing_pixels = np.isnan(output_array)
+            missing_ratio = np.mean(missing_pixels, axis=-1)
+    return missing_ratio, report
 
-extracted_values = arr[mask.astype(bool)]
-output_array = extracted_values.flatten()
 
-missing_pixels = np.isnan(output_array)
-missing_ratio = np.mean(missing_pixels, axis=-1)
-print(f'The miss ratio is: {missing_ratio}')
+if __name__ == '__main__':
+    missing_ratio, report = estimate_miss_ratio(wait_estimate_raster_file, mask_raster_file, report_path)
+    print(f'The miss ratio is: {missing_ratio}')
+    print(report.summary())
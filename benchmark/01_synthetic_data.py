@@ -0,0 +1,283 @@
+import os
+import shutil
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+
+"""
+生成基准测试用的确定性合成数据，参数和随机种子相同时生成的数据完全相同：
+    长时序单波段栅格（每年一景，大小、景数、数据类型、nodata 比例、压缩方式可配置）
+    偏相关分析用的 y 与多个因子的长时序栅格
+    天地图经纬度瓦片目录（PNG，含纯色瓦片和内容重复的瓦片）
+    大幅多波段 GeoTIFF
+数据逐条带生成和写出，内存占用只与条带大小有关
+"""
+
+# 每次生成和写出的行数
+strip_rows = 1024
+# 长时序栅格的仿射变换，约 1km 分辨率，位于贵州附近
+stack_transform = from_origin(103.5, 29.3, 0.01, 0.01)
+
+
+def default_nodata(dtype):
+    """
+    各数据类型默认的 nodata：无符号整型为 0，其余为 -9999
+    """
+    return 0 if np.issubdtype(np.dtype(dtype), np.unsignedinteger) else -9999
+
+
+def _strips(height):
+    for row_off in range(0, height, strip_rows):
+        yield row_off, min(strip_rows, height - row_off)
+
+
+def _corner_mask(row_off, rows, height, width, fraction):
+    """
+    左上角三角形区域（面积占 {fraction}）为 True，模拟研究区以外、每一景都没有数据的范围
+    """
+    leg = np.sqrt(2 * fraction * height * width)
+    r = np.arange(row_off, row_off + rows)[:, None]
+    c = np.arange(width)[None, :]
+    return r + c < leg
+
+
+def _base_field(row_off, rows, height, width, seed):
+    """
+    平滑的空间场，值域约为 [-1, 1]
+    """
+    rng = np.random.default_rng([seed, 0])
+    fy, fx, py, px = rng.uniform(1, 4), rng.uniform(1, 4), rng.uniform(0, 2 * np.pi), rng.uniform(0, 2 * np.pi)
+    y = (np.arange(row_off, row_off + rows)[:, None] + 0.5) / height
+    x = (np.arange(width)[None, :] + 0.5) / width
+    return 0.5 * np.sin(2 * np.pi * fy * y + py) + 0.5 * np.cos(2 * np.pi * fx * x + px)
+
+
+def _to_dtype(values, dtype):
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        # 保留一位小数，时间序列中会出现相同的值（MK 检验的结值）
+        return np.round(values, 1).astype(dtype)
+    info = np.iinfo(dtype)
+    # 留出 nodata 的位置
+    return np.clip(np.round(values), info.min + 1, info.max - 1).astype(dtype)
+
+
+def _scene_profile(height, width, dtype, nodata, compress, blocksize, transform, crs='EPSG:4326'):
+    profile = {
+        'driver': 'GTiff',
+        'height': height,
+        'width': width,
+        'count': 1,
+        'dtype': dtype,
+        'nodata': nodata,
+        'crs': crs,
+        'transform': transform,
+        'tiled': True,
+        'blockxsize': blocksize,
+        'blockysize': blocksize,
+        'BIGTIFF': 'IF_SAFER',
+    }
+    if compress is not None:
+        profile['compress'] = compress
+    return profile
+
+
+def _scene_values(row_off, rows, height, width, t, seed, offset=500., scale=200., trend_scale=5., noise=20.):
+    """
+    第 {t} 景某一条带的值：空间场 + 逐像元的线性趋势 * t + 噪声
+    """
+    base = _base_field(row_off, rows, height, width, seed)
+    trend = _base_field(row_off, rows, height, width, seed + 1) * trend_scale
+    rng = np.random.default_rng([seed, 1, t, row_off])
+    return offset + scale * base + trend * t + noise * rng.standard_normal((rows, width))
+
+
+def _missing(row_off, rows, height, width, t, seed, nodata_fraction, outside_fraction):
+    """
+    第 {t} 景某一条带的缺失位置：研究区以外的固定区域 + 随机缺失
+    """
+    rng = np.random.default_rng([seed, 2, t, row_off])
+    missing = rng.random((rows, width)) < nodata_fraction
+    if outside_fraction:
+        missing |= _corner_mask(row_off, rows, height, width, outside_fraction)
+    return missing
+
+
+def _new_dir(out_dir):
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+
+def make_stack(out_dir, height, width, n_scenes, dtype='float32', nodata_fraction=0.1, compress='deflate', seed=0,
+               nodata=None, outside_fraction=0.1, start_year=2000, blocksize=256):
+    """
+    生成 {n_scenes} 景单波段长时序栅格 {out_dir}/{start_year + t}.tif，已存在的目录会被清空。
+    各像元的值为平滑的空间场 + 空间上变化的线性趋势（有增加、减少和无趋势的像元）+ 噪声
+
+    :param height: 行数
+    :param width: 列数
+    :param n_scenes: 景数（年份数）
+    :param dtype: 数据类型，整型时四舍五入
+    :param nodata_fraction: 每一景随机缺失的像元比例
+    :param compress: 压缩方式，为 None 时不压缩
+    :param seed: 随机种子
+    :param nodata: nodata 值，为 None 时使用 default_nodata(dtype)
+    :param outside_fraction: 研究区以外（所有景都缺失）的像元比例
+    :param start_year: 第一景的年份，用作文件名
+    :param blocksize: 内部块大小
+    :return: 按时间排序的影像路径列表
+    """
+    nodata = default_nodata(dtype) if nodata is None else nodata
+    _new_dir(out_dir)
+    profile = _scene_profile(height, width, dtype, nodata, compress, blocksize, stack_transform)
+    paths = []
+    for t in range(n_scenes):
+        path = os.path.join(out_dir, '%d.tif' % (start_year + t))
+        with rasterio.open(path, 'w', **profile) as dst:
+            for row_off, rows in _strips(height):
+                values = _to_dtype(_scene_values(row_off, rows, height, width, t, seed), dtype)
+                values[_missing(row_off, rows, height, width, t, seed, nodata_fraction, outside_fraction)] = nodata
+                dst.write(values, 1, window=rasterio.windows.Window(0, row_off, width, rows))
+        paths.append(path)
+    return paths
+
+
+def make_pcorr_dataset(root_dir, height, width, n_scenes, element_names, y_name='npp', dtype='float32',
+                       nodata_fraction=0.1, compress='deflate', seed=0, outside_fraction=0.1, start_year=2000):
+    """
+    生成偏相关分析的数据：{root_dir}/{y_name}/{year}.tif 和 {root_dir}/x/{因子名}/{year}.tif。
+    各因子为相互独立的长时序栅格，y 为各因子的加权和（权重在空间上变化）+ 噪声，缺失位置与 y 相同
+
+    :return: y 目录, 各因子所在的上级目录
+    """
+    nodata = default_nodata(dtype)
+    y_dir = os.path.join(root_dir, y_name)
+    x_root = os.path.join(root_dir, 'x')
+    x_dirs = [os.path.join(x_root, name) for name in element_names]
+    for d in [y_dir] + x_dirs:
+        _new_dir(d)
+
+    profile = _scene_profile(height, width, dtype, nodata, compress, 256, stack_transform)
+    for t in range(n_scenes):
+        name = '%d.tif' % (start_year + t)
+        dsts = [rasterio.open(os.path.join(d, name), 'w', **profile) for d in [y_dir] + x_dirs]
+        try:
+            for row_off, rows in _strips(height):
+                window = rasterio.windows.Window(0, row_off, width, rows)
+                missing = _missing(row_off, rows, height, width, t, seed, nodata_fraction, outside_fraction)
+                y = np.random.default_rng([seed, 3, t, row_off]).standard_normal((rows, width))
+                for k, dst in enumerate(dsts[1:]):
+                    x = _scene_values(row_off, rows, height, width, t, seed + 10 * (k + 1), offset=0., scale=1.,
+                                      trend_scale=0.05, noise=1.)
+                    y += _base_field(row_off, rows, height, width, seed + 10 * (k + 1) + 5) * x
+                    x = _to_dtype(x * 100, dtype)
+                    x[missing] = nodata
+                    dst.write(x, 1, window=window)
+                y = _to_dtype(y * 100 + 500, dtype)
+                y[missing] = nodata
+                dsts[0].write(y, 1, window=window)
+        finally:
+            for dst in dsts:
+                dst.close()
+    return y_dir, x_root
+
+
+def make_tile_dir(out_dir, n_rows, n_cols, zoom=12, row0=500, col0=1000, tile_size=256, empty_fraction=0.1,
+                  duplicate_fraction=0.1, seed=0, prefix='201812'):
+    """
+    生成 {n_rows} * {n_cols} 个天地图经纬度瓦片 {out_dir}/{prefix}-{col}-{row}-{zoom}.png，
+    与 TiandituLonLatTile2TifConverter.get_idx_row_col_z 默认的文件名规则一致。
+    一部分瓦片为纯色（海面、无数据区），一部分与之前某个瓦片的内容完全相同
+
+    :param empty_fraction: 纯色瓦片的比例
+    :param duplicate_fraction: 内容重复瓦片的比例
+    :return: 瓦片路径列表
+    """
+    _new_dir(out_dir)
+    rng = np.random.default_rng([seed, 4])
+    yy, xx = np.mgrid[0:tile_size, 0:tile_size] / tile_size
+    paths = []
+    payloads = []
+    for r in range(n_rows):
+        for c in range(n_cols):
+            path = os.path.join(out_dir, '%s-%d-%d-%d.png' % (prefix, col0 + c, row0 + r, zoom))
+            u = rng.random()
+            if u < empty_fraction:
+                data = np.empty((tile_size, tile_size, 3), dtype=np.uint8)
+                data[:] = (170, 210, 255) if rng.random() < 0.5 else (255, 255, 255)
+                payload = None
+            elif u < empty_fraction + duplicate_fraction and payloads:
+                payload = payloads[rng.integers(len(payloads))]
+                data = None
+            else:
+                # 平滑的地物色块 + 轻微噪声，PNG 压缩率与真实影像瓦片相近
+                phase = rng.uniform(0, 2 * np.pi, 3)
+                field = np.stack([np.sin(2 * np.pi * (xx + c) * 1.3 + p) * np.cos(2 * np.pi * (yy + r) + p)
+                                  for p in phase], axis=-1)
+                noise = rng.integers(-6, 7, (tile_size, tile_size, 3))
+                data = np.clip(120 + 80 * field + noise, 0, 255).astype(np.uint8)
+                payload = None
+
+            if payload is None:
+                Image.fromarray(data).save(path)
+                with open(path, 'rb') as f:
+                    payloads.append(f.read())
+            else:
+                with open(path, 'wb') as f:
+                    f.write(payload)
+            paths.append(path)
+    return paths
+
+
+def make_large_tif(path, height, width, count=3, dtype='uint16', nodata_fraction=0.05, compress='deflate',
+                   tiled=True, blocksize=512, seed=0, nodata=None):
+    """
+    生成一景大幅多波段 GeoTIFF，左上角 {nodata_fraction} 比例的三角形区域为 nodata（模拟景的边缘）
+
+    :param tiled: 为 False 时按条带存储
+    :return: {path}
+    """
+    nodata = default_nodata(dtype) if nodata is None else nodata
+    profile = {
+        'driver': 'GTiff',
+        'height': height,
+        'width': width,
+        'count': count,
+        'dtype': dtype,
+        'nodata': nodata,
+        'crs': 'EPSG:32648',
+        'transform': from_origin(400000, 3000000, 10, 10),
+        'BIGTIFF': 'IF_SAFER',
+    }
+    if tiled:
+        profile.update(tiled=True, blockxsize=blocksize, blockysize=blocksize)
+    if compress is not None:
+        profile['compress'] = compress
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with rasterio.open(path, 'w', **profile) as dst:
+        for row_off, rows in _strips(height):
+            missing = _corner_mask(row_off, rows, height, width, nodata_fraction)
+            bands = []
+            for b in range(count):
+                values = _scene_values(row_off, rows, height, width, b, seed + b, offset=2000., scale=1500.,
+                                       trend_scale=0., noise=30.)
+                values = _to_dtype(values, dtype)
+                values[missing] = nodata
+                bands.append(values)
+            dst.write(np.stack(bands), window=rasterio.windows.Window(0, row_off, width, rows))
+    return path
+
+
+if __name__ == '__main__':
+    data_dir = 'benchmark_data'
+    make_stack(os.path.join(data_dir, 'stack'), 512, 512, 20)
+    make_pcorr_dataset(os.path.join(data_dir, 'pcorr'), 256, 256, 20, ['降水量', '平均气温', '平均相对湿度', '日照时数'])
+    make_tile_dir(os.path.join(data_dir, 'tiles'), 16, 16)
+    make_large_tif(os.path.join(data_dir, 'large.tif'), 4096, 4096)
+    print('------------end------------')
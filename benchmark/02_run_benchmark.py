@@ -0,0 +1,530 @@
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import rasterio
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(benchmark_dir)
+# 带编号的脚本不能直接 import，把所在目录加入搜索路径后用 importlib 按文件名导入（并行时子进程同样能找到）
+for _d in [root_dir, os.path.join(root_dir, 'analysis'), os.path.join(root_dir, 'process'), benchmark_dir]:
+    if _d not in sys.path:
+        sys.path.insert(0, _d)
+
+from my_utils import FileUtils  # noqa: E402
+from my_utils import RunReport  # noqa: E402
+from my_utils import TrendUtils  # noqa: E402
+
+synthetic = importlib.import_module('01_synthetic_data')
+trends_mk = importlib.import_module('01_trends_analysis_MK')
+pcorr = importlib.import_module('02_pcorr_pval_calculate')
+miss_pixel = importlib.import_module('03_miss_ratio_estimate_base_on_pixel')
+miss_raster = importlib.import_module('03_miss_ratio_estimate_base_on_raster')
+tianditu = importlib.import_module('01_TiandituUtils')
+tif_crop = importlib.import_module('02_TifCrop')
+
+"""
+基于合成数据的性能基准测试：在不同数据规模下对各分析和处理入口计时，并把各优化版本的结果与参考实现对比
+
+    sen_mk          逐像元 pymannkendall（参考）/ batch 一次读入 / 按窗口分块 / 像元优先缓存
+    pcorr           逐像元 pingouin（参考）/ batch 串行 / 多进程 / 像元优先缓存
+    miss_ratio      逐景读入后堆叠（参考）/ 流式统计（预取、不预取、按窗口）/ 像元优先缓存，以及单景缺失率脚本
+    batch_convert   逐瓦片 convert_single_image（参考）/ batch_convert（去重、多进程）/ mosaic_convert
+    crop            逐块读取、填充、写出（参考）/ crop_and_pad_tif（单线程、多线程、只写归档）/ iter_crops
+
+逐像元的参考实现很慢，数据规模超过 *_reference_max_pixels 时不运行，各版本改为与第一个优化版本对比。
+每个版本在新的子进程中运行，记录的峰值内存只属于该版本。
+结果输出到 {work_dir}/results.csv 和 results.json（含各入口写出的运行报告），有结果不一致时以非零状态码退出
+"""
+
+# 合成数据和各次运行结果的根目录
+work_dir = os.path.join(tempfile.gettempdir(), 'gis_benchmark')
+# 要运行的测试项
+cases = ['sen_mk', 'pcorr', 'miss_ratio', 'batch_convert', 'crop']
+# 长时序栅格的规模 (H, W, T)，sen_mk 和 miss_ratio 使用
+stack_sizes = [(64, 64, 12), (512, 512, 24), (1024, 1024, 24)]
+# 偏相关分析数据的规模 (H, W, T)
+pcorr_sizes = [(32, 32, 12), (256, 256, 20), (512, 512, 20)]
+# 长时序栅格的数据类型、每景随机缺失的像元比例和压缩方式
+stack_dtype = 'float32'
+nodata_fraction = 0.1
+compress = 'deflate'
+# 天地图瓦片目录的行列数
+tile_grids = [(8, 8), (16, 16), (32, 32)]
+# 裁剪用的大幅影像大小 (H, W)，3 波段 uint16
+large_tif_sizes = [(2048, 2048), (4096, 4096), (8192, 8192)]
+crop_size = (256, 256)
+# 并行版本的进程/线程数
+workers = max(2, os.cpu_count() or 1)
+# sen_mk 按窗口分块版本的内存预算（MB）
+mem_budget_mb = 64
+# 逐像元参考实现运行的最大像元数
+mk_reference_max_pixels = 64 * 64
+pcorr_reference_max_pixels = 32 * 32
+# 重复运行时复用已生成的合成数据
+reuse_data = True
+seed = 0
+
+# 各版本的结果 [dict]
+results = []
+
+
+def _data(name, make, *args, **kwargs):
+    """
+    合成数据的路径 {work_dir}/data/{name}，不存在（或 reuse_data 为 False）时调用 make(路径, *args, **kwargs) 生成
+    """
+    path = os.path.join(work_dir, 'data', name)
+    if reuse_data and os.path.exists(path):
+        return path
+    print('生成合成数据 %s' % name)
+    tmp_path = path + '.tmp'
+    FileUtils.mkdirs(os.path.dirname(path))
+    make(tmp_path, *args, **kwargs)
+    _remove(path)
+    os.rename(tmp_path, path)
+    return path
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _run_dir(*names):
+    """
+    一个版本的输出目录，已存在时清空
+    """
+    path = os.path.join(work_dir, 'runs', *names)
+    _remove(path)
+    os.makedirs(path)
+    return path
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, RunReport.peak_rss_mb(), RunReport.peak_rss_mb(children=True), result
+
+
+def _call(func, *args):
+    """
+    在新启动（spawn）的子进程中执行一个版本，返回 (耗时, 峰值内存, 子进程峰值内存, 返回值)。
+    各版本的峰值内存互不影响；主进程也不会运行 numba 多线程内核，之后 fork 进程池时不会在退出时卡住
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_timed, func, *args).result()
+
+
+def _warm_up():
+    TrendUtils.sen_mk_batch(np.arange(24, dtype=np.float64).reshape(2, 12))
+
+
+def _load_report(result):
+    """
+    入口函数在输出目录中写出的运行报告，没有时为 None
+    """
+    if isinstance(result, str) and os.path.isfile(os.path.join(result, 'run_report.json')):
+        with open(os.path.join(result, 'run_report.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return None
+
+
+def _run_variants(case, size_name, variants, compare, items, unit, input_bytes):
+    """
+    依次运行各版本，第一个版本为参考，其余版本的结果用 compare(参考结果, 结果) -> (是否一致, 最大差异) 与之对比
+
+    :param variants: [(版本名, 函数, 参数元组)]，函数在子进程中执行，返回值（结果或输出目录）需要能序列化
+    :param items: 处理的数量（像元数、瓦片数等），用于计算吞吐量
+    :param unit: {items} 的单位
+    :param input_bytes: 输入数据的字节数
+    """
+    ref_name, ref_result, ref_seconds = None, None, None
+    for name, func, args in variants:
+        print('[%s %s] %s ...' % (case, size_name, name))
+        seconds, peak, peak_children, result = _call(func, *args)
+        if ref_name is None:
+            ref_name, ref_result, ref_seconds = name, result, seconds
+            ok, max_diff = None, None
+        else:
+            ok, max_diff = compare(ref_result, result)
+        report = _load_report(result)
+        row = {
+            'case': case,
+            'size': size_name,
+            'variant': name,
+            'seconds': round(seconds, 4),
+            'speedup': round(ref_seconds / seconds, 2) if seconds > 0 else None,
+            'items': items,
+            'unit': unit,
+            'items_per_sec': round(items / seconds, 1) if seconds > 0 else None,
+            'mb_per_sec': round(input_bytes / 1024 / 1024 / seconds, 2) if seconds > 0 else None,
+            'peak_rss_mb': round(peak, 1) if peak is not None else None,
+            'peak_rss_children_mb': round(peak_children, 1) if peak_children is not None else None,
+            'compared_to': ref_name if ok is not None else None,
+            'ok': ok,
+            'max_diff': max_diff,
+            'stages': report['stages'] if report else None,
+        }
+        results.append(row)
+        print('    %.3fs，%.1f %s/s，峰值内存 %s MB%s' % (
+            seconds, row['items_per_sec'] or 0, unit, row['peak_rss_mb'],
+            '' if ok is None else '，与 %s %s（最大差异 %s）' % (ref_name, '一致' if ok else '不一致', max_diff)))
+
+
+def _max_diff(a, b, rtol, atol):
+    """
+    两个数组是否一致（nan 位置相同、其余值在容差内）以及有效值的最大绝对差异
+    """
+    if a.shape != b.shape:
+        return False, 'shape %s != %s' % (a.shape, b.shape)
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    both = ~np.isnan(a) & ~np.isnan(b)
+    diff = float(np.abs(a[both] - b[both]).max()) if both.any() else 0.
+    return bool(np.allclose(a, b, rtol=rtol, atol=atol, equal_nan=True)), diff
+
+
+def _compare_tif_dirs(ref_dir, out_dir, rtol=0., atol=0.):
+    """
+    对比两个目录中同名的 tif（参考目录中的每一个都必须存在），包括形状、仿射变换和全部波段的值
+    """
+    ok, max_diff = True, 0.
+    for name in sorted(FileUtils.listdir(ref_dir, '*.tif')):
+        path = os.path.join(out_dir, name)
+        if not os.path.exists(path):
+            return False, '缺少 ' + name
+        with rasterio.open(os.path.join(ref_dir, name)) as a, rasterio.open(path) as b:
+            if not a.transform.almost_equals(b.transform):
+                return False, '%s 仿射变换不同' % name
+            same, diff = _max_diff(a.read(), b.read(), rtol, atol)
+        if isinstance(diff, str):
+            return False, '%s %s' % (name, diff)
+        ok, max_diff = ok and same, max(max_diff, diff)
+    return ok, max_diff
+
+
+def _compare_arrays(ref, result, rtol=0., atol=0.):
+    return _max_diff(np.asarray(ref), np.asarray(result), rtol, atol)
+
+
+def _run_sen_mk(image_dir, out_dir, kwargs):
+    trends_mk.sen_mk_test(image_dir, out_dir, **kwargs)
+    return out_dir
+
+
+def bench_sen_mk(size):
+    height, width, n_scenes = size
+    size_name = '%dx%dx%d' % size
+    image_dir = _data('stack_%s_%s' % (size_name, stack_dtype), synthetic.make_stack, height, width, n_scenes,
+                      dtype=stack_dtype, nodata_fraction=nodata_fraction, compress=compress, seed=seed)
+    cache_dir = _run_dir('sen_mk', size_name, 'cache')
+
+    variants = []
+    if height * width <= mk_reference_max_pixels:
+        variants.append(('pymannkendall', dict(engine='pymannkendall')))
+    variants += [
+        ('batch', {}),
+        ('windowed', dict(mem_budget_mb=mem_budget_mb)),
+        # 第一次运行时生成缓存，第二次直接读取
+        ('cached_build', dict(cache_dir=cache_dir)),
+        ('cached', dict(cache_dir=cache_dir)),
+    ]
+    _run_variants('sen_mk', size_name,
+                  [(name, _run_sen_mk, (image_dir, _run_dir('sen_mk', size_name, name), kwargs))
+                   for name, kwargs in variants],
+                  partial(_compare_tif_dirs, rtol=1e-5, atol=1e-6), height * width, 'pixel',
+                  RunReport.path_bytes(image_dir))
+
+
+def _run_pcorr(y_dir, x_root, out_dir, engine, n_workers, cache_dir):
+    # 按脚本开头的配置运行，只替换数据路径和计算方式
+    pcorr.y_root_dir = y_dir
+    pcorr.x_root_dir = x_root
+    pcorr.out_dir = out_dir
+    pcorr.template_raster = FileUtils.list_full_dir(y_dir, '*.tif')[0]
+    pcorr.pcorr_engine = engine
+    pcorr.workers = n_workers
+    pcorr.cache_dir = cache_dir
+    pcorr.main()
+    return out_dir
+
+
+def bench_pcorr(size):
+    height, width, n_scenes = size
+    size_name = '%dx%dx%d' % size
+    data_dir = _data('pcorr_%s_%s' % (size_name, stack_dtype), synthetic.make_pcorr_dataset, height, width,
+                     n_scenes, pcorr.element_names, y_name=pcorr.y_name, dtype=stack_dtype,
+                     nodata_fraction=nodata_fraction, compress=compress, seed=seed)
+    y_dir, x_root = os.path.join(data_dir, pcorr.y_name), os.path.join(data_dir, 'x')
+    cache_dir = _run_dir('pcorr', size_name, 'cache')
+
+    variants = []
+    if height * width <= pcorr_reference_max_pixels:
+        variants.append(('pingouin', ('pingouin', 1, None)))
+    variants += [
+        ('batch', ('batch', 1, None)),
+        ('batch_workers_%d' % workers, ('batch', workers, None)),
+        ('cached_build', ('batch', 1, cache_dir)),
+        ('cached', ('batch', 1, cache_dir)),
+    ]
+    # 两者的结果都保留 4 位小数，舍入边界上的值可能相差 1e-4
+    _run_variants('pcorr', size_name,
+                  [(name, _run_pcorr, (y_dir, x_root, _run_dir('pcorr', size_name, name)) + args)
+                   for name, args in variants],
+                  partial(_compare_tif_dirs, atol=1.5e-4), height * width, 'pixel', RunReport.path_bytes(data_dir))
+
+
+def _miss_ratio_reference(image_dir):
+    # 原始做法：逐景读入后堆叠为 (H, W, T) 再统计
+    stack = np.stack([miss_pixel.read_tif(p) for p in FileUtils.list_full_dir(image_dir, '*.tif')], axis=-1)
+    return np.mean(np.isnan(stack), axis=-1)
+
+
+def _miss_ratio_streaming(image_dir, max_rows, prefetch):
+    acc, _ = miss_pixel.estimate_miss_ratio_streaming(image_dir, max_rows=max_rows, prefetch=prefetch)
+    return acc.missing_ratio()
+
+
+def _miss_ratio_cached(image_dir, cache_dir):
+    return miss_pixel.read_miss_ratio_from_cache(image_dir, cache_dir)
+
+
+def _miss_ratio_raster_reference(raster_file, mask_file):
+    with rasterio.open(raster_file) as a, rasterio.open(mask_file) as m:
+        data, mask = a.read(1), m.read(1) != m.nodata
+        return np.mean(data[mask] == a.nodata)
+
+
+def _miss_ratio_raster(raster_file, mask_file):
+    missing_ratio, _ = miss_raster.estimate_miss_ratio(raster_file, mask_file)
+    return missing_ratio
+
+
+def bench_miss_ratio(size):
+    height, width, n_scenes = size
+    size_name = '%dx%dx%d' % size
+    image_dir = _data('stack_%s_%s' % (size_name, stack_dtype), synthetic.make_stack, height, width, n_scenes,
+                      dtype=stack_dtype, nodata_fraction=nodata_fraction, compress=compress, seed=seed)
+    cache_dir = _run_dir('miss_ratio', size_name, 'cache')
+
+    _run_variants('miss_ratio', size_name, [
+        ('stack_reference', _miss_ratio_reference, (image_dir,)),
+        ('streaming', _miss_ratio_streaming, (image_dir, None, 2)),
+        ('streaming_no_prefetch', _miss_ratio_streaming, (image_dir, None, 0)),
+        ('streaming_windows', _miss_ratio_streaming, (image_dir, 256, 2)),
+        ('cached_build', _miss_ratio_cached, (image_dir, cache_dir)),
+        ('cached', _miss_ratio_cached, (image_dir, cache_dir)),
+    ], partial(_compare_arrays, atol=1e-6), height * width * n_scenes, 'pixel', RunReport.path_bytes(image_dir))
+
+    # 单景缺失率：研究区范围（只有研究区以外为 nodata 的一景）作为掩膜
+    mask_dir = _data('mask_%dx%d_%s' % (height, width, stack_dtype), synthetic.make_stack, height, width, 1,
+                     dtype=stack_dtype, nodata_fraction=0., compress=compress, seed=seed)
+    raster_file = FileUtils.list_full_dir(image_dir, '*.tif')[0]
+    mask_file = FileUtils.list_full_dir(mask_dir, '*.tif')[0]
+    _run_variants('miss_ratio_raster', '%dx%d' % (height, width), [
+        ('reference', _miss_ratio_raster_reference, (raster_file, mask_file)),
+        ('raster_script', _miss_ratio_raster, (raster_file, mask_file)),
+    ], partial(_compare_arrays, atol=1e-9), height * width, 'pixel', RunReport.path_bytes([raster_file, mask_file]))
+
+
+def _convert_reference(tile_dir, out_dir):
+    # 原始做法：逐个瓦片读取、转换、写出
+    converter = tianditu.TiandituLonLatTile2TifConverter()
+    for name in sorted(FileUtils.listdir(tile_dir, '*.png')):
+        row_idx, col_idx, zoom = converter.get_idx_row_col_z(name)
+        out_path = os.path.join(out_dir, name.replace('.png', '.tif'))
+        converter.convert_single_image(os.path.join(tile_dir, name), out_path, zoom, col_idx, row_idx)
+    return out_dir
+
+
+def _batch_convert(tile_dir, out_dir, n_workers, dedup):
+    tianditu.TiandituLonLatTile2TifConverter().batch_convert(tile_dir, out_dir, workers=n_workers, dedup=dedup)
+    return out_dir
+
+
+def _mosaic_convert(tile_dir, out_dir, n_workers):
+    tianditu.TiandituLonLatTile2TifConverter().mosaic_convert(tile_dir, os.path.join(out_dir, 'mosaic.tif'),
+                                                              workers=n_workers)
+    return out_dir
+
+
+def _compare_mosaic(ref_dir, out_dir):
+    """
+    拼接结果中每个瓦片的范围与参考的单瓦片 GeoTIFF 对比
+    """
+    max_diff = 0.
+    with rasterio.open(os.path.join(out_dir, 'mosaic.tif')) as mosaic:
+        for name in sorted(FileUtils.listdir(ref_dir, '*.tif')):
+            with rasterio.open(os.path.join(ref_dir, name)) as ref:
+                window = mosaic.window(*ref.bounds).round_offsets().round_lengths()
+                same, diff = _max_diff(ref.read(), mosaic.read(window=window), 0., 0.)
+            if not same:
+                return False, '%s %s' % (name, diff)
+            max_diff = max(max_diff, diff)
+    return True, max_diff
+
+
+def _compare_convert(ref_dir, out_dir):
+    if os.path.exists(os.path.join(out_dir, 'mosaic.tif')):
+        return _compare_mosaic(ref_dir, out_dir)
+    return _compare_tif_dirs(ref_dir, out_dir)
+
+
+def bench_batch_convert(grid):
+    n_rows, n_cols = grid
+    size_name = '%dx%d' % grid
+    tile_dir = _data('tiles_%s' % size_name, synthetic.make_tile_dir, n_rows, n_cols, seed=seed)
+
+    _run_variants('batch_convert', size_name, [
+        ('tile_reference', _convert_reference, (tile_dir, _run_dir('batch_convert', size_name, 'tile_reference'))),
+        ('batch', _batch_convert, (tile_dir, _run_dir('batch_convert', size_name, 'batch'), None, False)),
+        ('batch_dedup', _batch_convert, (tile_dir, _run_dir('batch_convert', size_name, 'batch_dedup'), None, True)),
+        ('batch_workers_%d' % workers, _batch_convert,
+         (tile_dir, _run_dir('batch_convert', size_name, 'batch_workers'), workers, True)),
+        ('mosaic', _mosaic_convert, (tile_dir, _run_dir('batch_convert', size_name, 'mosaic'), workers)),
+    ], _compare_convert, n_rows * n_cols, 'tile', RunReport.path_bytes(tile_dir))
+
+
+def _crop_reference(input_tif, out_dir):
+    # 原始做法：逐块读取、填充、写出
+    crop_width, crop_height = crop_size
+    with rasterio.open(input_tif) as src:
+        metadata = src.meta.copy()
+        metadata.update(width=crop_width, height=crop_height)
+        for i in range(int(np.ceil(src.height / crop_height))):
+            for j in range(int(np.ceil(src.width / crop_width))):
+                left, top = j * crop_width, i * crop_height
+                window = rasterio.windows.Window(left, top, min(crop_width, src.width - left),
+                                                 min(crop_height, src.height - top))
+                crop_data = src.read(window=window)
+                padded_data = np.zeros((src.count, crop_height, crop_width), dtype=src.dtypes[0])
+                padded_data[:, :crop_data.shape[1], :crop_data.shape[2]] = crop_data
+                transform = src.window_transform(rasterio.windows.Window(left, top, crop_width, crop_height))
+                with rasterio.open(os.path.join(out_dir, 'crop_%d_%d.tif' % (i, j)), 'w',
+                                   **dict(metadata, transform=transform)) as dst:
+                    dst.write(padded_data)
+    return out_dir
+
+
+def _crop(input_tif, out_dir, n_workers, archive_name, write_tifs):
+    tif_crop.crop_and_pad_tif(input_tif, out_dir, crop_size, workers=n_workers, archive_name=archive_name,
+                              write_tifs=write_tifs)
+    return out_dir
+
+
+def _iter_crops(input_tif):
+    for _ in tif_crop.iter_crops(input_tif, crop_size):
+        pass
+    return input_tif
+
+
+def _iter_result_chips(result):
+    """
+    iter_crops（result 为输入影像路径）或归档（load_chip_archive）中的各裁剪块 (i, j, 数组, 仿射变换)
+    """
+    if os.path.isfile(result):
+        for window, transform, chip in tif_crop.iter_crops(result, crop_size):
+            yield int(window.row_off) // crop_size[1], int(window.col_off) // crop_size[0], chip, transform
+    else:
+        archive, index = tif_crop.load_chip_archive(os.path.join(result, 'chips'))
+        for k, info in enumerate(index['chips']):
+            yield info['i'], info['j'], archive[k], rasterio.Affine(*info['transform'])
+
+
+def _compare_crop(ref_dir, result):
+    """
+    对比裁剪块 GeoTIFF、归档或 iter_crops 的结果与参考的裁剪块 GeoTIFF
+    """
+    if not os.path.isfile(result) and not os.path.exists(os.path.join(result, 'chips.json')):
+        return _compare_tif_dirs(ref_dir, result)
+
+    n_chips = 0
+    for i, j, chip, transform in _iter_result_chips(result):
+        with rasterio.open(os.path.join(ref_dir, 'crop_%d_%d.tif' % (i, j))) as ref:
+            if not transform.almost_equals(ref.transform) or not np.array_equal(ref.read(), chip):
+                return False, 'crop_%d_%d 不同' % (i, j)
+        n_chips += 1
+    n_ref = len(FileUtils.listdir(ref_dir, '*.tif'))
+    if n_chips != n_ref:
+        return False, '裁剪块数 %d != %d' % (n_chips, n_ref)
+    return True, 0.
+
+
+def bench_crop(size):
+    height, width = size
+    size_name = '%dx%d' % size
+    input_tif = _data('large_%s.tif' % size_name, synthetic.make_large_tif, height, width, seed=seed)
+    n_chips = int(np.ceil(height / crop_size[1]) * np.ceil(width / crop_size[0]))
+
+    _run_variants('crop', size_name, [
+        ('chip_reference', _crop_reference, (input_tif, _run_dir('crop', size_name, 'chip_reference'))),
+        ('threads_1', _crop, (input_tif, _run_dir('crop', size_name, 'threads_1'), 1, None, True)),
+        ('threads_%d' % workers, _crop, (input_tif, _run_dir('crop', size_name, 'threads'), workers, None, True)),
+        ('archive_only', _crop, (input_tif, _run_dir('crop', size_name, 'archive_only'), workers, 'chips', False)),
+        ('iter_crops', _iter_crops, (input_tif,)),
+    ], _compare_crop, n_chips, 'chip', RunReport.path_bytes(input_tif))
+
+
+def save_results(csv_path, json_path):
+    columns = [k for k in results[0] if k != 'stages'] if results else []
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in results:
+            writer.writerow([row[k] for k in columns])
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({'machine': RunReport('benchmark').to_dict()['machine'], 'results': results}, f,
+                  ensure_ascii=False, indent=2)
+
+
+def main():
+    """
+    按文件开头的配置生成数据并运行各测试项，所有版本的结果都与参考一致时返回 True
+    """
+    FileUtils.mkdirs(work_dir)
+    # 提前编译 numba 内核并缓存到磁盘，编译时间不计入第一个版本
+    _call(_warm_up)
+
+    benches = {
+        'sen_mk': (bench_sen_mk, stack_sizes),
+        'pcorr': (bench_pcorr, pcorr_sizes),
+        'miss_ratio': (bench_miss_ratio, stack_sizes),
+        'batch_convert': (bench_batch_convert, tile_grids),
+        'crop': (bench_crop, large_tif_sizes),
+    }
+    for case in cases:
+        bench, sizes = benches[case]
+        for size in sizes:
+            bench(size)
+
+    save_results(os.path.join(work_dir, 'results.csv'), os.path.join(work_dir, 'results.json'))
+    print('%-18s %-12s %-22s %10s %8s %14s %10s %8s' % ('case', 'size', 'variant', 'seconds', 'speedup',
+                                                         'items/s', 'peak MB', 'check'))
+    for row in results:
+        check = '-' if row['ok'] is None else ('ok' if row['ok'] else 'FAIL')
+        print('%-18s %-12s %-22s %10.3f %8s %14s %10s %8s' % (row['case'], row['size'], row['variant'], row['seconds'],
+                                                              row['speedup'], row['items_per_sec'], row['peak_rss_mb'],
+                                                              check))
+    print('结果已写入 %s' % work_dir)
+
+    failed = [row for row in results if row['ok'] is False]
+    if failed:
+        print('%d 个版本的结果与参考实现不一致' % len(failed))
+        return False
+    print('------------end------------')
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -1,10 +1,37 @@
 # coding=utf-8
 import fnmatch
+import hashlib
+import json
 import os
+import platform
+import queue
+import shutil
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
 import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from scipy.stats import norm
+from scipy.stats import t as t_dist
+
+try:
+    import numba
+except ImportError:
+    # 未安装 numba 时 TrendUtils 使用 NumPy 实现
+    numba = None
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource 模块，RunReport 改用 psutil 获取峰值内存
+    resource = None
 
 
 class FileUtils:
@@ -54,12 +81,8 @@ class RasterUtils:
         :param nodata_replace:
         :return:
         """
-        list = []
-        for tif in tif_path_list:
-            arr = RasterUtils.read2arr(tif, nodata_replace)
-            list.append(arr)
-
-        return np.stack(list, axis=-1)
+        with RasterStack(tif_path_list, nodata_replace) as stack:
+            return stack.read()
 
     @staticmethod
     def read2arr(tif_path, nodata_replace=np.nan):
@@ -76,6 +99,57 @@ class RasterUtils:
             ras_data = np.where(ras_data == nodata, nodata_replace, ras_data)
             return ras_data
 
+    @staticmethod
+    def iter_row_windows(dataset, max_rows):
+        """
+        按行条带切分栅格，条带高度对齐到数据内部块（block）的高度，保证每个块只被解压一次
+        :param dataset: rasterio.open() 所读取的datasets对象
+        :param max_rows: 每个条带最多包含的行数
+        :return: rasterio.windows.Window 生成器
+        """
+        block_height = dataset.block_shapes[0][0]
+        if max_rows >= block_height:
+            rows = max_rows // block_height * block_height
+        else:
+            rows = max(1, max_rows)
+
+        for row_off in range(0, dataset.height, rows):
+            yield rasterio.windows.Window(0, row_off, dataset.width, min(rows, dataset.height - row_off))
+
+    @staticmethod
+    def reduce_rasters(tif_path_list, reducers, max_rows=None, prefetch=2):
+        """
+        只读一遍 {tif_path_list}，同时计算多个逐像元统计量，每个设置了 output_path 的统计量输出为一个 tif。
+        后台线程预取后续景（窗口）的解码，与统计量的更新重叠
+
+        example:
+            reducers = [MeanReducer('mean.tif'), StdReducer('std.tif'), QuantileReducer('p90.tif', q=0.9)]
+            RasterUtils.reduce_rasters(FileUtils.list_full_dir(img_dir, '*.tif'), reducers)
+
+        :param tif_path_list: 单波段栅格路径列表
+        :param reducers: PixelReducer 列表
+        :param max_rows: 每次读取的最多行数，为 None 时一次读取整景
+        :param prefetch: 预取的景（窗口）数，0 时不预取
+        :return: reducers
+        """
+        with rasterio.open(tif_path_list[0]) as template, RasterStack(tif_path_list) as stack:
+            for reducer in reducers:
+                reducer.start(template.height, template.width)
+
+            items = [(t, window) for t in range(len(stack)) for window in stack.list_windows(max_rows=max_rows)]
+
+            def load(item):
+                return stack.read_window(item[1], time_idx=[item[0]])[0]
+
+            for (_, window), data in Prefetcher(items, load, depth=prefetch):
+                for reducer in reducers:
+                    reducer.update(data, window.toslices())
+
+            for reducer in reducers:
+                if reducer.output_path is not None:
+                    RasterUtils.write2tif(reducer.output_path, reducer.result(), template, reducer.dtype)
+        return reducers
+
     @staticmethod
     def write2tif(output_path, data, template, dtype='float32'):
         """
@@ -87,9 +161,1647 @@ class RasterUtils:
         :return:
         """
 
-        with rasterio.open(output_path, 'w', driver='GTiff', height=template.height, width=template.width, count=1,
-                           dtype=dtype, crs=template.crs, transform=template.transform) as dst:
-            dst.write(data, 1)  # 写入数据到第一个波段
+        with ResultWriter(output_path, template.height, template.width, template.crs, template.transform, [''],
+                          dtype=dtype, background=False) as writer:
+            writer.write([data])  # 写入数据到第一个波段
+
+    @staticmethod
+    def scatter(idx, values, height, width, fill=np.nan, dtype=None):
+        """
+        把按一维下标（row * W + col）排列的像元结果放回整景网格
+        :param idx: (n,) 一维下标
+        :param values: (n,) 或 (n, K) 数组
+        :param fill: 其余像元的填充值，默认 nan
+        :param dtype: 输出数据类型，默认与 values 相同
+        :return: (H, W) 数组，values 为 (n, K) 时为 (K, H, W)
+        """
+        values = np.asarray(values)
+        dtype = values.dtype if dtype is None else dtype
+        if values.ndim == 1:
+            out = np.full(height * width, fill, dtype=dtype)
+            out[idx] = values
+            return out.reshape(height, width)
+        out = np.full((values.shape[1], height * width), fill, dtype=dtype)
+        out[:, idx] = values.T
+        return out.reshape(values.shape[1], height, width)
+
+
+class ResultWriter:
+    """
+    分析结果的统一输出：内部分块（tiled）、多线程压缩（DEFLATE/ZSTD，浮点数据使用浮点预测器）、float32 + nan nodata，
+    每个波段带描述。所有统计量可以写入一个多波段文件，也可以每个统计量各写一个单波段文件。
+    结果可以逐窗口写入，默认由后台线程负责压缩和写盘，与计算重叠；close 时可选再转换为 Cloud-Optimized GeoTIFF。
+    可选生成金字塔（overviews），按行顺序写入整行窗口时在写盘线程中直接由内存中的结果逐级降采样，不需要 close 后再读回文件；
+    类别型波段（如 Trend）用众数，连续型波段用均值
+
+    example:
+        with ResultWriter(out_path, height, width, crs, transform, ['slope', 'p_value']) as writer:
+            for window, (slope, p) in results:
+                writer.write_window(window, [slope, p])
+    """
+
+    def __init__(self, output_path, height, width, crs, transform, band_names, multiband=True, file_names=None,
+                 dtype='float32', nodata=np.nan, compress='deflate', blocksize=256, num_threads='ALL_CPUS', cog=False,
+                 background=True, queue_size=4, overviews=None, overview_resampling=None):
+        """
+        :param output_path: multiband 为 True 时为输出文件路径，否则为输出目录
+        :param band_names: 各波段（统计量）的描述
+        :param multiband: 是否写入一个多波段文件
+        :param file_names: multiband 为 False 时各统计量的文件名，默认为 {band_name}.tif
+        :param dtype: 输出数据类型，默认 float32
+        :param nodata: nodata 值，默认 nan（整型数据时忽略 nan）
+        :param compress: 压缩方式，如 'deflate'、'zstd'，为 None 时不压缩
+        :param blocksize: 内部分块大小
+        :param num_threads: 压缩线程数，GDAL 的 NUM_THREADS 选项
+        :param cog: close 时是否转换为 Cloud-Optimized GeoTIFF
+        :param background: 是否由后台线程写盘
+        :param queue_size: 后台写盘队列中最多缓存的窗口数
+        :param overviews: 金字塔的降采样倍数列表，如 [2, 4, 8]；'auto' 时逐级减半直到不超过一个分块；None 时不生成
+        :param overview_resampling: 各波段的降采样方法，'average'（默认）或 'mode'。可以是一个字符串（全部波段），
+            与 band_names 对应的列表，或 {band_name: 方法} 字典（未列出的波段用 'average'）。
+            注意第二级及以后的 'mode' 为上一级众数的众数，与 GDAL 由原分辨率数据统计的众数可能不同；'average' 与 GDAL 一致
+        """
+        self.height = height
+        self.width = width
+        self.band_names = list(band_names)
+        self.multiband = multiband
+        self.dtype = np.dtype(dtype)
+        self.cog = cog
+        self.compress = compress
+        self.blocksize = blocksize
+        self.num_threads = num_threads
+        self.nodata = nodata
+        if nodata is not None and np.isnan(nodata) and not np.issubdtype(self.dtype, np.floating):
+            nodata = None
+            self.nodata = None
+        self.overviews = self._overview_factors(overviews)
+        self.overview_resampling = self._band_resampling(overview_resampling)
+
+        if multiband:
+            self.paths = [output_path]
+        else:
+            FileUtils.mkdirs(output_path)
+            file_names = file_names or [n + '.tif' for n in self.band_names]
+            self.paths = [os.path.join(output_path, n) for n in file_names]
+        parent = os.path.dirname(os.path.abspath(self.paths[0]))
+        if not os.path.exists(parent):
+            FileUtils.mkdirs(parent)
+
+        profile = {
+            'driver': 'GTiff',
+            'height': height,
+            'width': width,
+            'count': len(self.band_names) if multiband else 1,
+            'dtype': self.dtype.name,
+            'crs': crs,
+            'transform': transform,
+            'nodata': nodata,
+            'tiled': True,
+            'blockxsize': blocksize,
+            'blockysize': blocksize,
+            'BIGTIFF': 'IF_SAFER',
+        }
+        if compress is not None:
+            profile.update(compress=compress, num_threads=num_threads,
+                           predictor=3 if np.issubdtype(self.dtype, np.floating) else 2)
+
+        # 转换为 COG 时先写入临时文件
+        self._write_paths = [p + '.tmp.tif' if cog else p for p in self.paths]
+        self.datasets = [rasterio.open(p, 'w', **profile) for p in self._write_paths]
+        if multiband:
+            for b, name in enumerate(self.band_names):
+                self.datasets[0].set_band_description(b + 1, name)
+        else:
+            for ds, name in zip(self.datasets, self.band_names):
+                ds.set_band_description(1, name)
+
+        # 金字塔：创建文件时（还没有数据，几乎不耗时）先建立各级结构，close 时再写入由内存结果计算的各级数据。
+        # 第一级在写盘线程中随写入的整行结果逐步计算，之后各级由上一级计算（众数见 overview_resampling 的说明）。
+        # 各级按输出数据类型保存（整型时为能表示 nan 的最小浮点类型），不按 float64 整级占用内存
+        self._ov_first = None
+        if self.overviews:
+            for ds in self.datasets:
+                ds.build_overviews(self.overviews, Resampling.nearest)
+            f = self.overviews[0]
+            self._ov_dtype = np.result_type(self.dtype, np.float32)
+            self._ov_first = np.full((len(self.band_names), -(-height // f), -(-width // f)), np.nan,
+                                     dtype=self._ov_dtype)
+            # 待降采样的整行缓冲及其首行行号、已写入的行数、第一级已计算的行数
+            self._ov_rows = []
+            self._ov_row0 = 0
+            self._ov_next_row = 0
+            self._ov_done = 0
+            # 窗口不是按行顺序的整行时改为 close 后读回文件计算
+            self._ov_reread = False
+
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._drain, daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self._error = e
+
+    def _overview_factors(self, overviews):
+        if overviews is None:
+            return []
+        if overviews == 'auto':
+            factors = []
+            f = 2
+            while max(self.height, self.width) * 2 // f > self.blocksize:
+                factors.append(f)
+                f *= 2
+            return factors
+        return sorted(int(f) for f in overviews)
+
+    def _band_resampling(self, resampling):
+        if resampling is None or isinstance(resampling, str):
+            methods = [resampling or 'average'] * len(self.band_names)
+        elif isinstance(resampling, dict):
+            methods = [resampling.get(n, 'average') for n in self.band_names]
+        else:
+            methods = list(resampling)
+        for m in methods:
+            if m not in ('average', 'mode'):
+                raise ValueError(f'不支持的金字塔降采样方法: {m}')
+        return methods
+
+    @staticmethod
+    def _overview_index(n_src, n_dst, start, stop, offset):
+        """
+        与 GDAL 一致，第 i 个金字塔像元覆盖上一级 [i * ratio, (i + 1) * ratio) 的范围，边缘像元按覆盖比例加权。
+        返回第 start 到 stop 个金字塔像元对应的上一级下标 (n, m)（已减去 offset）及权重 (n, m)，m 为最长窗口，补齐部分权重为 0
+        """
+        ratio = n_src / n_dst
+        lo = np.arange(start, stop) * ratio
+        hi = np.minimum(lo + ratio, n_src)
+        first = np.floor(lo + 1e-8).astype(np.int64)
+        last = np.minimum(np.ceil(hi - 1e-8).astype(np.int64), n_src)
+        steps = np.arange((last - first).max())
+        index = first[:, None] + steps
+        weight = np.clip(np.minimum(index + 1, hi[:, None]) - np.maximum(index, lo[:, None]), 0, None)
+        weight[index >= last[:, None]] = 0
+        return np.minimum(index, last[:, None] - 1) - offset, weight
+
+    @staticmethod
+    def _block_mode(blocks):
+        """
+        每行的众数，nan 不参与；个数相同时与 GDAL 一样取先达到该个数的值，全为 nan 时为 nan
+        :param blocks: (n, k)
+        """
+        n, k = blocks.shape
+        if k <= 64:
+            # 窗口较小（逐级降采样时一般为 2x2 ~ 3x3），逐个位置统计到该位置为止相同值出现的次数
+            best_key = np.zeros(n, dtype=np.int64)
+            result = np.full(n, np.nan)
+            for p in range(k):
+                rank = (blocks[:, :p + 1] == blocks[:, p:p + 1]).sum(axis=1)
+                key = np.where(rank > 0, rank * (k + 1) + (k - p), 0)
+                better = key > best_key
+                best_key[better] = key[better]
+                result[better] = blocks[better, p]
+            return result
+        order = np.argsort(blocks, axis=1, kind='stable')
+        s = np.take_along_axis(blocks, order, axis=1)
+        pos = np.arange(k)
+        new_run = np.ones(s.shape, dtype=bool)
+        new_run[:, 1:] = s[:, 1:] != s[:, :-1]
+        run_start = np.maximum.accumulate(np.where(new_run, pos, 0), axis=1)
+        run_len = pos - run_start + 1
+        run_len[np.isnan(s)] = 0
+        # 稳定排序后 run_len 处的原位置 order 即该值第 run_len 次出现的位置
+        return s[np.arange(n), np.argmax(run_len * (k + 1) + (k - order), axis=1)]
+
+    def _reduce_overview(self, src, src_shape, dst_shape, start, stop, row0):
+        """
+        由上一级（或原分辨率）计算一级金字塔的第 start 到 stop 行
+        :param src: 上一级从第 row0 行开始的整行数据 (波段数, h, w)，覆盖这些金字塔行
+        :param src_shape: 上一级的 (H, W)
+        :param dst_shape: 这一级的 (H, W)
+        :return: (波段数, stop - start, W)，数据类型为 {_ov_dtype}
+        """
+        ridx, rweight = self._overview_index(src_shape[0], dst_shape[0], start, stop, row0)
+        cidx, cweight = self._overview_index(src_shape[1], dst_shape[1], 0, dst_shape[1], 0)
+        n, mh = ridx.shape
+        ow, mw = cidx.shape
+        out = np.empty((len(src), n, ow), dtype=self._ov_dtype)
+        for b, method in enumerate(self.overview_resampling):
+            # (n, mh, w)，在 float64 中计算
+            rows = src[b, ridx].astype(np.float64, copy=False)
+            if method == 'mode':
+                rows[rweight == 0] = np.nan
+                # (n, mh, ow, mw)
+                blocks = rows[:, :, cidx]
+                blocks[:, :, cweight == 0] = np.nan
+                out[b] = self._block_mode(blocks.transpose(0, 2, 1, 3).reshape(n * ow, mh * mw)).reshape(n, ow)
+            else:
+                # 加权平均可以先按行、再按列分别加权求和，nan 不参与（权重为 0）
+                valid = ~np.isnan(rows)
+                w = valid * rweight[:, :, None]
+                total = (np.where(valid, rows, 0.) * w).sum(axis=1)[:, cidx]
+                total_w = w.sum(axis=1)[:, cidx]
+                total = (total * cweight).sum(axis=2)
+                total_w = (total_w * cweight).sum(axis=2)
+                out[b] = np.divide(total, total_w, out=np.full(total_w.shape, np.nan), where=total_w > 0)
+        return out
+
+    def _feed_overviews(self, window, data):
+        if self._ov_reread:
+            return
+        if window is None:
+            window = rasterio.windows.Window(0, 0, self.width, self.height)
+        if window.col_off != 0 or window.width != self.width or window.row_off != self._ov_next_row:
+            self._ov_reread = True
+            self._ov_rows = []
+            return
+        self._ov_next_row += window.height
+        self._ov_rows.append(data)
+        # 攒够降采样倍数的行数再计算，减少小窗口时的重复拼接
+        if self._ov_next_row - self._ov_row0 < self.overviews[0] and self._ov_next_row < self.height:
+            return
+        rows = np.concatenate(self._ov_rows, axis=1) if len(self._ov_rows) > 1 else self._ov_rows[0]
+        rows = rows.astype(np.float64)
+        if self.nodata is not None and not np.isnan(self.nodata):
+            rows[rows == self.nodata] = np.nan
+        src_shape = (self.height, self.width)
+        dst_shape = self._ov_first.shape[1:]
+        ratio = self.height / dst_shape[0]
+        # 覆盖范围已全部写入的金字塔行
+        start = self._ov_done
+        stop = dst_shape[0] if self._ov_next_row == self.height else \
+            max(start, int(np.floor(self._ov_next_row / ratio + 1e-8)))
+        if stop > start:
+            self._ov_first[:, start:stop] = self._reduce_overview(rows, src_shape, dst_shape, start, stop,
+                                                                  self._ov_row0)
+            self._ov_done = stop
+        keep_from = min(int(np.floor(stop * ratio + 1e-8)), self._ov_next_row)
+        self._ov_rows = [rows[:, keep_from - self._ov_row0:]] if keep_from < self._ov_next_row else []
+        self._ov_row0 = keep_from
+
+    def _write_overviews(self):
+        if self._ov_reread or self._ov_next_row != self.height:
+            # 窗口乱序或不完整，按分块大小的整行条带读回文件计算
+            self._ov_reread = False
+            self._ov_rows, self._ov_row0, self._ov_next_row, self._ov_done = [], 0, 0, 0
+            for row_off in range(0, self.height, self.blocksize):
+                window = rasterio.windows.Window(0, row_off, self.width, min(self.blocksize, self.height - row_off))
+                data = []
+                for path in self._write_paths:
+                    with rasterio.open(path) as src:
+                        data.append(src.read(window=window))
+                self._feed_overviews(window, np.concatenate(data))
+        levels = [self._ov_first]
+        for f in self.overviews[1:]:
+            prev = levels[-1]
+            dst_shape = (-(-self.height // f), -(-self.width // f))
+            levels.append(self._reduce_overview(prev, prev.shape[1:], dst_shape, 0, dst_shape[0], 0))
+
+        fill = np.nan if self.dtype.kind == 'f' else (self.nodata if self.nodata is not None else 0)
+        for k, level in enumerate(levels):
+            level = np.where(np.isnan(level), fill, level)
+            if self.dtype.kind != 'f':
+                level = np.rint(level)
+            level = level.astype(self.dtype)
+            if self.multiband:
+                with rasterio.open(self._write_paths[0], 'r+', overview_level=k) as ov:
+                    ov.write(level)
+            else:
+                for b, path in enumerate(self._write_paths):
+                    with rasterio.open(path, 'r+', overview_level=k) as ov:
+                        ov.write(level[b:b + 1])
+
+    def _write(self, window, data):
+        if self.multiband:
+            self.datasets[0].write(data, window=window)
+        else:
+            for ds, band in zip(self.datasets, data):
+                ds.write(band, 1, window=window)
+        if self._ov_first is not None:
+            self._feed_overviews(window, data)
+
+    def write_window(self, window, arrays):
+        """
+        写入一个窗口
+        :param window: rasterio.windows.Window，为 None 时为整景
+        :param arrays: 各波段的 (h, w) 数组组成的列表，或 (波段数, h, w) 数组；会先转换（拷贝）为输出数据类型，调用后可以复用
+        """
+        if self._error is not None:
+            raise self._error
+        data = np.array(arrays, dtype=self.dtype)
+        if data.ndim == 2:
+            data = data[None]
+        if self._queue is None:
+            self._write(window, data)
+        else:
+            self._queue.put((window, data))
+
+    def write(self, arrays):
+        """
+        写入整景，arrays 同 write_window
+        """
+        self.write_window(None, arrays)
+
+    def write_pixels(self, idx, values, max_rows=None):
+        """
+        把按一维下标（row * W + col）紧凑存放的结果按行条带放回网格并写入，不需要构造整景数组
+        :param idx: (n,) 一维下标，不是递增时先排序
+        :param values: 各波段的 (n,) 数组组成的列表，或 (波段数, n) 数组
+        :param max_rows: 每次写入的行数，默认为分块大小
+        """
+        idx = np.asarray(idx)
+        values = [np.asarray(v) for v in values]
+        if np.any(idx[1:] < idx[:-1]):
+            order = np.argsort(idx, kind='stable')
+            idx = idx[order]
+            values = [v[order] for v in values]
+        max_rows = max_rows or self.blocksize
+        for row_off in range(0, self.height, max_rows):
+            rows = min(max_rows, self.height - row_off)
+            lo, hi = np.searchsorted(idx, [row_off * self.width, (row_off + rows) * self.width])
+            grid = np.full((len(values), rows * self.width), np.nan if self.dtype.kind == 'f' else 0, dtype=self.dtype)
+            for b, v in enumerate(values):
+                grid[b, idx[lo:hi] - row_off * self.width] = v[lo:hi]
+            self.write_window(rasterio.windows.Window(0, row_off, self.width, rows),
+                              grid.reshape(len(values), rows, self.width))
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for ds in self.datasets:
+            ds.close()
+        if self._error is not None:
+            raise self._error
+        if self._ov_first is not None:
+            self._write_overviews()
+            self._ov_first = None
+
+        if self.cog:
+            for tmp_path, path in zip(self._write_paths, self.paths):
+                options = {'BLOCKSIZE': self.blocksize, 'NUM_THREADS': self.num_threads, 'BIGTIFF': 'IF_SAFER'}
+                if self.compress is not None:
+                    options['COMPRESS'] = self.compress.upper()
+                rasterio.shutil.copy(tmp_path, path, driver='COG', **options)
+                rasterio.shutil.delete(tmp_path)
+
+
+class PixelReducer:
+    """
+    逐景更新的像元统计量基类。子类在 start 中分配 (H, W) 状态，在 update 中用一景（或一景中的一个窗口）的数据更新状态，
+    在 result 中返回 (H, W) 结果。nan 表示缺失值，不参与统计。多个统计量通过 RasterUtils.reduce_rasters 只读一遍数据
+    """
+    dtype = 'float32'
+
+    def __init__(self, output_path=None):
+        """
+        :param output_path: 结果 tif 的输出路径，为 None 时不输出，只通过 result() 获取
+        """
+        self.output_path = output_path
+
+    def start(self, height, width):
+        raise NotImplementedError
+
+    def update(self, data, index=(slice(None), slice(None))):
+        """
+        :param data: 二维数组
+        :param index: data 在整景中的位置，(行切片, 列切片)
+        """
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class CountReducer(PixelReducer):
+    """有效值个数"""
+    dtype = 'int32'
+
+    def start(self, height, width):
+        self.count = np.zeros((height, width), dtype=np.int32)
+
+    def update(self, data, index=(slice(None), slice(None))):
+        self.count[index] += ~np.isnan(data)
+
+    def result(self):
+        return self.count
+
+
+class MeanReducer(PixelReducer):
+    """均值，Welford 递推，数值稳定"""
+
+    def start(self, height, width):
+        self.count = np.zeros((height, width), dtype=np.int32)
+        self.mean = np.zeros((height, width), dtype=np.float64)
+
+    def update(self, data, index=(slice(None), slice(None))):
+        valid = ~np.isnan(data)
+        count = self.count[index]
+        count += valid
+        mean = self.mean[index]
+        delta = np.where(valid, data - mean, 0.)
+        mean += np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+        return valid, delta
+
+    def result(self):
+        return np.where(self.count > 0, self.mean, np.nan).astype(self.dtype)
+
+
+class VarReducer(MeanReducer):
+    """方差，Welford 递推，ddof=1 为样本方差"""
+
+    def __init__(self, output_path=None, ddof=1):
+        super().__init__(output_path)
+        self.ddof = ddof
+
+    def start(self, height, width):
+        super().start(height, width)
+        self.m2 = np.zeros((height, width), dtype=np.float64)
+
+    def update(self, data, index=(slice(None), slice(None))):
+        valid, delta = super().update(data, index)
+        # M2 += (x - mean_old) * (x - mean_new)
+        self.m2[index] += np.where(valid, delta * (np.where(valid, data, 0.) - self.mean[index]), 0.)
+        return valid, delta
+
+    def result(self):
+        dof = self.count - self.ddof
+        var = np.divide(self.m2, dof, out=np.full(self.m2.shape, np.nan), where=dof > 0)
+        return var.astype(self.dtype)
+
+
+class StdReducer(VarReducer):
+    """标准差"""
+
+    def result(self):
+        return np.sqrt(super().result())
+
+
+class MinReducer(PixelReducer):
+    """最小值"""
+
+    def start(self, height, width):
+        self.value = np.full((height, width), np.nan, dtype=np.float64)
+
+    def update(self, data, index=(slice(None), slice(None))):
+        value = self.value[index]
+        np.fmin(value, data, out=value)
+
+    def result(self):
+        return self.value.astype(self.dtype)
+
+
+class MaxReducer(MinReducer):
+    """最大值"""
+
+    def update(self, data, index=(slice(None), slice(None))):
+        value = self.value[index]
+        np.fmax(value, data, out=value)
+
+
+class QuantileReducer(PixelReducer):
+    """
+    近似分位数，逐像元的 P² 算法（Jain & Chlamtac, 1985），每个像元只保存 5 个标记点，不需要保存全部数据。
+    有效值少于 5 个的像元给出精确分位数
+    """
+
+    def __init__(self, output_path=None, q=0.5):
+        super().__init__(output_path)
+        self.q = q
+        # 标记点期望位置的初始值以及每次新增一个值时的增量
+        self.desired_init = np.array([1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5], dtype=np.float64)
+        self.desired_step = np.array([0, q / 2, q, (1 + q) / 2, 1], dtype=np.float64)
+
+    def start(self, height, width):
+        self.count = np.zeros((height, width), dtype=np.int32)
+        self.heights = np.full((5, height, width), np.nan, dtype=np.float64)
+        self.positions = np.tile(np.arange(1, 6, dtype=np.float32)[:, None, None], (1, height, width))
+
+    def update(self, data, index=(slice(None), slice(None))):
+        data = np.asarray(data, dtype=np.float64)
+        count = self.count[index]
+        heights = self.heights[(slice(None),) + tuple(index)]
+        positions = self.positions[(slice(None),) + tuple(index)]
+
+        valid = ~np.isnan(data)
+        count += valid
+
+        # 前 5 个值直接保存，满 5 个时排序作为初始标记点
+        init = valid & (count <= 5)
+        if init.any():
+            rows, cols = np.nonzero(init)
+            heights[count[rows, cols] - 1, rows, cols] = data[rows, cols]
+            full = init & (count == 5)
+            if full.any():
+                heights[:, full] = np.sort(heights[:, full], axis=0)
+
+        m = valid & (count > 5)
+        if not m.any():
+            return
+        x = data[m]
+        q = heights[:, m]
+        n = positions[:, m].astype(np.float64)
+
+        # 找到 x 所在的区间 k，并更新两端的极值
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        k = np.clip(np.sum(x[None, :] >= q[1:4], axis=0), 0, 3)
+        n += np.arange(5)[:, None] > k[None, :]
+        desired = self.desired_init[:, None] + (count[m] - 5)[None, :] * self.desired_step[:, None]
+
+        for i in range(1, 4):
+            d = desired[i] - n[i]
+            move = ((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))
+            if not move.any():
+                continue
+            d = np.sign(d)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                q_near = np.where(d > 0, q[i + 1], q[i - 1])
+                n_near = np.where(d > 0, n[i + 1], n[i - 1])
+                linear = q[i] + d * (q_near - q[i]) / (n_near - n[i])
+            new_q = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+            q[i] = np.where(move, new_q, q[i])
+            n[i] = np.where(move, n[i] + d, n[i])
+
+        heights[:, m] = q
+        positions[:, m] = n
+
+    def result(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            exact = np.nanquantile(self.heights, self.q, axis=0)
+        return np.where(self.count >= 5, self.heights[2], exact).astype(self.dtype)
+
+
+class Prefetcher:
+    """
+    后台预取流水线：在后台线程中按顺序对每个 item 调用 load（rasterio 解码时释放 GIL），读取好的数据经有界队列按原顺序交给
+    消费者，计算当前块的同时解码后面的块。分阶段计时：读取（后台 load 的耗时）、等待（消费者等数据的时间）、计算（消费者处理
+    数据的时间），等待时间多说明 I/O 受限，否则为计算受限
+
+    example:
+        with RasterStack(paths) as stack:
+            prefetcher = Prefetcher(stack.list_windows(max_rows=256), stack.read_window, depth=2)
+            for window, data in prefetcher:
+                ...
+            print(prefetcher.summary())
+    """
+
+    def __init__(self, items, load, depth=2, workers=1, name='读取'):
+        """
+        :param items: 待读取的对象（文件路径、窗口等）
+        :param load: load(item)，返回读取的数据，在后台线程中执行
+        :param depth: 最多提前读取的个数（队列长度），0 时在当前线程中按需读取，不预取
+        :param workers: 后台读取线程数，多于 1 个时 load 需要线程安全（如各线程使用各自的数据集句柄）
+        :param name: summary 中读取阶段的名称
+        """
+        self.items = items
+        self.load = load
+        self.depth = depth
+        self.workers = workers
+        self.name = name
+        self.n_items = 0
+        self.n_bytes = 0
+        self.load_seconds = 0.
+        self.wait_seconds = 0.
+        self.compute_seconds = 0.
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def _timed_load(self, item):
+        start = time.perf_counter()
+        data = self.load(item)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.load_seconds += elapsed
+            self.n_bytes += getattr(data, 'nbytes', 0)
+        return data
+
+    def __iter__(self):
+        items = iter(self.items)
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.depth > 0 else None
+        pending = deque()
+
+        def fill():
+            # 队列中保持 depth 个正在读取或已读好的块
+            while len(pending) < self.depth:
+                item = next(items, _EXHAUSTED)
+                if item is _EXHAUSTED:
+                    return
+                pending.append((item, executor.submit(self._timed_load, item)))
+
+        try:
+            if executor is not None:
+                fill()
+            while True:
+                if executor is not None:
+                    if not pending:
+                        return
+                    item, future = pending.popleft()
+                    # 消费者处理这一块时后台继续读取后面的 depth 块
+                    fill()
+                    start = time.perf_counter()
+                    data = future.result()
+                else:
+                    item = next(items, _EXHAUSTED)
+                    if item is _EXHAUSTED:
+                        return
+                    start = time.perf_counter()
+                    data = self._timed_load(item)
+                ready = time.perf_counter()
+                self.wait_seconds += ready - start
+                self.n_items += 1
+                yield item, data
+                self.compute_seconds += time.perf_counter() - ready
+        finally:
+            if executor is not None:
+                for _, future in pending:
+                    future.cancel()
+                executor.shutdown(wait=True)
+
+    @property
+    def io_bound(self):
+        return self.wait_seconds > self.compute_seconds
+
+    def summary(self):
+        """
+        各阶段耗时的一行汇总
+        """
+        rate = self.n_bytes / 1024 / 1024 / self.load_seconds if self.load_seconds > 0 else 0.
+        return '%s %d 块 %.1f MB，耗时 %.2fs（%.1f MB/s），等待 %.2fs，计算 %.2fs，%s受限' % (
+            self.name, self.n_items, self.n_bytes / 1024 / 1024, self.load_seconds, rate, self.wait_seconds,
+            self.compute_seconds, 'I/O ' if self.io_bound else '计算')
+
+
+# Prefetcher 中表示 items 已取完
+_EXHAUSTED = object()
+
+
+class RunReport:
+    """
+    运行报告：记录各阶段（discover、read、compute、write 等）耗时、读写字节数、处理的像元/瓦片数及其每秒处理量、峰值内存，
+    结束时写出 JSON，用于对比不同数据规模、不同机器上的运行情况
+
+    example:
+        with RunReport('sen_mk_test', os.path.join(out_dir, 'run_report.json'), engine='batch') as report:
+            with report.stage('read'):
+                ...
+            report.count(pixels=height * width, bytes_read=RunReport.path_bytes(paths))
+    """
+
+    def __init__(self, name, report_path=None, **params):
+        """
+        :param name: 入口名称
+        :param report_path: JSON 报告的输出路径，为 None 时不输出，可以通过 to_dict() 获取
+        :param params: 运行参数，一并写入报告
+        """
+        self.name = name
+        self.report_path = report_path
+        self.params = {k: self._jsonable(v) for k, v in params.items()}
+        self.stages = {}
+        self.counters = {}
+        self.error = None
+        self.started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._start = time.perf_counter()
+        self.wall_seconds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_val is not None:
+            self.error = repr(exc_val)
+        self.finish()
+
+    @staticmethod
+    def _jsonable(value):
+        if value is None or isinstance(value, (str, bool, int, float)):
+            return value
+        if isinstance(value, (list, tuple)):
+            return [RunReport._jsonable(v) for v in value]
+        if isinstance(value, dict):
+            return {str(k): RunReport._jsonable(v) for k, v in value.items()}
+        if isinstance(value, np.generic):
+            return value.item()
+        return str(value)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        记录一个阶段的耗时，同名阶段多次进入时累加
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        """
+        累加在别处测得的阶段耗时，如多个线程/进程中的耗时之和
+        """
+        self.stages[name] = self.stages.get(name, 0.) + float(seconds)
+
+    def count(self, **counters):
+        """
+        累加计数，如 bytes_read、bytes_written、pixels、tiles
+        """
+        for k, v in counters.items():
+            self.counters[k] = self.counters.get(k, 0) + self._jsonable(v)
+
+    def add_prefetcher(self, prefetcher, read_stage='read', compute_stage='compute'):
+        """
+        记录 Prefetcher 的读取（后台）、等待和计算耗时以及解码的字节数
+        """
+        self.add_stage(read_stage, prefetcher.load_seconds)
+        self.add_stage(read_stage + '_wait', prefetcher.wait_seconds)
+        self.add_stage(compute_stage, prefetcher.compute_seconds)
+        self.count(bytes_decoded=prefetcher.n_bytes)
+
+    @staticmethod
+    def path_bytes(paths):
+        """
+        文件（目录时为其下全部文件）的总字节数，不存在的路径忽略
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        total = 0
+        for p in paths:
+            if os.path.isdir(p):
+                for root, _, names in os.walk(p):
+                    total += sum(os.path.getsize(os.path.join(root, n)) for n in names)
+            elif os.path.exists(p):
+                total += os.path.getsize(p)
+        return total
+
+    @staticmethod
+    def peak_rss_mb(children=False):
+        """
+        当前进程（children 为 True 时为已结束的子进程中最大的）的峰值内存（MB），无法获取时为 None
+        """
+        if not children and os.path.exists('/proc/self/status'):
+            # Linux 上 exec 启动的进程的 ru_maxrss 包含启动它的父进程的峰值，改用当前地址空间的 VmHWM
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+            # macOS 上 ru_maxrss 的单位为字节，Linux 上为 KB
+            return usage.ru_maxrss / (1024 * 1024 if platform.system() == 'Darwin' else 1024)
+        if children:
+            return None
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 / 1024
+
+    def finish(self):
+        """
+        结束计时，report_path 不为 None 时写出 JSON 报告
+        """
+        if self.wall_seconds is None:
+            self.wall_seconds = time.perf_counter() - self._start
+        if self.report_path is not None:
+            self.save(self.report_path)
+        return self.to_dict()
+
+    def to_dict(self):
+        wall = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._start
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'wall_seconds': wall,
+            'stages': self.stages,
+            'counters': self.counters,
+            'throughput': {k + '_per_sec': v / wall for k, v in self.counters.items() if wall > 0},
+            'peak_rss_mb': self.peak_rss_mb(),
+            'peak_rss_children_mb': self.peak_rss_mb(children=True),
+            'params': self.params,
+            'error': self.error,
+            'machine': {
+                'node': platform.node(),
+                # platform.platform() 会启动 uname 子进程，子进程的峰值内存统计会被它占用
+                'platform': '%s-%s-%s' % (platform.system(), platform.release(), platform.machine()),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'numba': numba is not None,
+            },
+        }
+
+    def save(self, report_path):
+        parent = os.path.dirname(os.path.abspath(report_path))
+        if not os.path.exists(parent):
+            FileUtils.mkdirs(parent)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def summary(self):
+        """
+        一行汇总：总耗时、各阶段耗时和峰值内存
+        """
+        d = self.to_dict()
+        stages = '，'.join('%s %.2fs' % (k, v) for k, v in d['stages'].items())
+        peak = d['peak_rss_mb']
+        return '%s 总耗时 %.2fs（%s），峰值内存 %s MB' % (self.name, d['wall_seconds'], stages,
+                                                '%.0f' % peak if peak is not None else '-')
+
+
+class RasterStack:
+    """
+    多个单波段栅格的惰性堆叠，逻辑形状为 (H, W, T)。构造时只读取第一景的元数据，只有被访问的窗口才会解码，
+    解码结果直接写入预分配的 {dtype} 缓冲区，nodata 在缓冲区内原地替换为 {nodata_replace}
+
+    example:
+        stack = RasterStack(FileUtils.list_full_dir(img_dir, '*.tif'))
+        arr = stack[100:200, :, 3:]        # (100, W, T - 3)
+        for window, arr in stack.iter_windows(mem_budget_mb=512):
+            ...
+        stack.close()
+    """
+
+    def __init__(self, tif_path_list, nodata_replace=np.nan, dtype='float32', workers=1):
+        """
+        :param tif_path_list: 单波段栅格路径列表，顺序即时间顺序
+        :param nodata_replace: nodata值替换为某个值，默认为np.nan
+        :param dtype: 解码后的数据类型，默认 float32
+        :param workers: 读取一个窗口时同时解码不同景的线程数
+        """
+        self.paths = list(tif_path_list)
+        self.nodata_replace = nodata_replace
+        self.dtype = np.dtype(dtype)
+        self.workers = workers
+        # 一组句柄（每景一个数据集）同一时间只由一个线程使用，用完放回空闲列表给后续的窗口复用，
+        # 打开的句柄组数不超过同时读取的线程数
+        self._free = []
+        self._opened = []
+        self._lock = threading.Lock()
+        # 多线程解码各景的线程池，第一次需要时创建，close() 时关闭
+        self._executor = None
+
+        with rasterio.open(self.paths[0]) as ras:
+            self.height = ras.height
+            self.width = ras.width
+            self.crs = ras.crs
+            self.transform = ras.transform
+            self.profile = ras.profile
+            self.block_shape = ras.block_shapes[0]
+
+    @property
+    def shape(self):
+        return self.height, self.width, len(self.paths)
+
+    @contextmanager
+    def _checkout(self):
+        """
+        取出一组空闲的数据集句柄，没有空闲的时才打开新的一组，退出时放回
+        """
+        with self._lock:
+            datasets = self._free.pop() if self._free else None
+        if datasets is None:
+            datasets = [rasterio.open(p) for p in self.paths]
+            with self._lock:
+                self._opened.append(datasets)
+        try:
+            yield datasets
+        finally:
+            with self._lock:
+                self._free.append(datasets)
+
+    def _band_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def open_handles(self):
+        """
+        当前打开的数据集句柄数
+        """
+        with self._lock:
+            return sum(len(datasets) for datasets in self._opened)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            for datasets in self._opened:
+                for ds in datasets:
+                    ds.close()
+            self._opened = []
+            self._free = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read_window(self, window=None, time_idx=None, out=None):
+        """
+        读取一个窗口内若干景的数据，结果为 (t, h, w) 数组
+        :param window: rasterio.windows.Window，为 None 时读取整景
+        :param time_idx: 需要读取的景的下标列表，为 None 时读取全部
+        :param out: 可选的预分配缓冲区，形状需为 (t, h, w)，数据类型为 {dtype}
+        :return: out
+        """
+        if window is None:
+            window = rasterio.windows.Window(0, 0, self.width, self.height)
+        if time_idx is None:
+            time_idx = range(len(self.paths))
+        shape = (len(time_idx), int(window.height), int(window.width))
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype)
+
+        def read_band(k):
+            band = out[k]
+            with self._checkout() as datasets:
+                ds = datasets[time_idx[k]]
+                ds.read(1, window=window, out=band)
+                nodata = ds.nodatavals[0]
+            if nodata is None:
+                return
+            if np.isnan(nodata):
+                if not np.isnan(self.nodata_replace):
+                    band[np.isnan(band)] = self.nodata_replace
+            else:
+                band[band == self.dtype.type(nodata)] = self.nodata_replace
+
+        if self.workers > 1 and len(time_idx) > 1:
+            # 各窗口共用同一个线程池，各线程取出各自的一组句柄，解码时释放 GIL
+            for _ in self._band_executor().map(read_band, range(len(time_idx))):
+                pass
+        else:
+            for k in range(len(time_idx)):
+                read_band(k)
+        return out
+
+    def read(self):
+        """
+        读取全部数据，结果为 (H, W, T) 数组
+        """
+        return self[:, :, :]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        row_key, col_key, time_key = key
+
+        rows = range(self.height)[row_key]
+        cols = range(self.width)[col_key]
+        times = range(len(self.paths))[time_key]
+        row_range = rows if isinstance(rows, range) else range(rows, rows + 1)
+        col_range = cols if isinstance(cols, range) else range(cols, cols + 1)
+        time_idx = times if isinstance(times, range) else [times]
+
+        if len(row_range) == 0 or len(col_range) == 0:
+            data = np.empty((len(time_idx), len(row_range), len(col_range)), dtype=self.dtype)
+        else:
+            row_off, col_off = min(row_range), min(col_range)
+            window = rasterio.windows.Window(col_off, row_off, max(col_range) + 1 - col_off,
+                                             max(row_range) + 1 - row_off)
+            data = self.read_window(window, time_idx)
+            if row_range.step != 1:
+                data = data[:, np.asarray(row_range) - row_off, :]
+            if col_range.step != 1:
+                data = data[:, :, np.asarray(col_range) - col_off]
+
+        data = np.moveaxis(data, 0, -1)
+        index = tuple(0 if isinstance(k, int) else slice(None) for k in (rows, cols, times))
+        return data[index]
+
+    def list_windows(self, max_rows=None, mem_budget_mb=None):
+        """
+        按行条带（对齐第一景的内部块高度）切分窗口
+        :param max_rows: 每个窗口最多的行数
+        :param mem_budget_mb: 单个窗口全部景数据的内存预算（MB），与 max_rows 二选一，都为 None 时为整景
+        :return: rasterio.windows.Window 列表
+        """
+        if max_rows is None:
+            if mem_budget_mb is None:
+                max_rows = self.height
+            else:
+                row_bytes = self.width * len(self.paths) * self.dtype.itemsize
+                max_rows = int(max(1, mem_budget_mb * 1024 * 1024 // row_bytes))
+        with self._checkout() as datasets:
+            return list(RasterUtils.iter_row_windows(datasets[0], max_rows))
+
+    def iter_windows(self, max_rows=None, mem_budget_mb=None, prefetch=0):
+        """
+        逐窗口读取全部景，迭代得到 (window, (h, w, T) 数组)，窗口的切分见 list_windows。
+        prefetch 大于 0 时由后台线程提前解码后面的 prefetch 个窗口，与当前窗口的计算重叠，此时同时占用 prefetch + 1 个窗口的缓冲区
+
+        注意：返回的数组复用缓冲区，之后的迭代中会被覆盖，需要保留时请自行 copy
+        :param prefetch: 预取的窗口数，0 时不预取
+        :return: Prefetcher，迭代结束后可以通过 summary() 查看读取、等待和计算的耗时
+        """
+        windows = self.list_windows(max_rows, mem_budget_mb)
+        buffers = [np.empty((len(self.paths), int(windows[0].height), self.width), dtype=self.dtype)
+                   for _ in range(prefetch + 1)]
+
+        # 第 k 个窗口使用第 k % (prefetch + 1) 个缓冲区：正在读取的最多 prefetch 个，加上消费者正在使用的 1 个
+        def load(item):
+            k, window = item
+            data = self.read_window(window, out=buffers[k % len(buffers)][:, :int(window.height), :])
+            return np.moveaxis(data, 0, -1)
+
+        return _WindowPrefetcher(list(enumerate(windows)), load, depth=prefetch)
+
+
+class _WindowPrefetcher(Prefetcher):
+    """
+    RasterStack.iter_windows 的迭代器，迭代得到 (window, 数组)
+    """
+
+    def __iter__(self):
+        for (_, window), data in super().__iter__():
+            yield window, data
+
+
+class PixelMatrix:
+    """
+    有效像元的紧凑内存表示，布局与 PixelStore 的分块相同：
+        idx     (n_valid,) int64，有效像元在整景中的一维下标（row * W + col），按行优先递增
+        values  (n_valid, T) float32，每一行为一个像元的完整时间序列
+    逐像元的分析只在有效像元上计算，结果为 (n_valid,) 数组，写出时再用 scatter 放回 (H, W) 网格，
+    内存和计算量都与无数据区域的大小无关
+
+    example:
+        with RasterStack(paths) as stack:
+            pixels = PixelMatrix.from_stack(stack)
+        result = np.full(pixels.n_valid, np.nan)
+        for sl in pixels.block_slices(20000):
+            result[sl] = f(pixels.values[sl])
+        grid = pixels.scatter(result)
+    """
+
+    def __init__(self, idx, values, height, width):
+        self.idx = np.asarray(idx, dtype=np.int64)
+        self.values = values
+        self.height = height
+        self.width = width
+
+    @property
+    def n_valid(self):
+        return len(self.idx)
+
+    @staticmethod
+    def from_array(arr):
+        """
+        从 (H, W, T) 数组生成，时间序列全部为 nan 的像元视为无效
+        """
+        height, width, t = arr.shape
+        flat = arr.reshape(-1, t)
+        idx = np.flatnonzero(~np.all(np.isnan(flat), axis=1))
+        return PixelMatrix(idx, flat[idx].astype(np.float32, copy=False), height, width)
+
+    @staticmethod
+    def from_stack(stack, idx=None, max_rows=None, mem_budget_mb=256, prefetch=1):
+        """
+        逐窗口读取 RasterStack 生成，不会构造整景的 (H, W, T) 数组
+        :param stack: RasterStack
+        :param idx: 可选，指定像元的一维下标（需递增），用于与另一组变量的有效像元对齐；为 None 时取时间序列不全为 nodata 的像元
+        :param max_rows: 每个窗口最多的行数
+        :param mem_budget_mb: 单个窗口的内存预算（MB），max_rows 为 None 时生效
+        :param prefetch: 后台预取的窗口数，见 RasterStack.iter_windows
+        :return: PixelMatrix
+        """
+        t = len(stack)
+        if idx is not None:
+            idx = np.asarray(idx, dtype=np.int64)
+            values = np.full((len(idx), t), np.nan, dtype=np.float32)
+        else:
+            idx_parts, value_parts = [], []
+
+        for window, arr in stack.iter_windows(max_rows=max_rows, mem_budget_mb=mem_budget_mb, prefetch=prefetch):
+            row_off = int(window.row_off)
+            flat = arr.reshape(-1, t)
+            if idx is not None:
+                lo, hi = np.searchsorted(idx, [row_off * stack.width, (row_off + int(window.height)) * stack.width])
+                values[lo:hi] = flat[idx[lo:hi] - row_off * stack.width]
+            else:
+                local = np.flatnonzero(~np.all(np.isnan(flat), axis=1))
+                idx_parts.append(local + row_off * stack.width)
+                value_parts.append(flat[local].astype(np.float32))
+
+        if idx is None:
+            idx = np.concatenate(idx_parts) if idx_parts else np.empty(0, dtype=np.int64)
+            values = np.concatenate(value_parts) if value_parts else np.empty((0, t), dtype=np.float32)
+        return PixelMatrix(idx, values, stack.height, stack.width)
+
+    def block_slices(self, block_size):
+        """
+        按 {block_size} 个像元切分的 slice 列表
+        """
+        return [slice(start, min(start + block_size, self.n_valid)) for start in range(0, self.n_valid, block_size)]
+
+    def scatter(self, values, fill=np.nan, dtype=None):
+        """
+        把 (n_valid,) 或 (n_valid, K) 的结果放回整景网格，见 RasterUtils.scatter
+        """
+        return RasterUtils.scatter(self.idx, values, self.height, self.width, fill, dtype)
+
+
+class PixelStore:
+    """
+    像元优先（pixel-major）的长时序缓存：把一组逐年的单波段栅格一次性重排为只包含有效像元的分块数组，
+    之后的分析直接内存映射读取，不再解码 GeoTIFF。缓存目录以输入文件列表、修改时间和栅格网格的指纹命名，
+    输入发生变化时自动重建
+
+    目录结构：
+        {cache_dir}/{fingerprint}/meta.json
+        {cache_dir}/{fingerprint}/chunk_00000_idx.npy   有效像元在整景中的一维下标 (n,) int64，下标 = row * W + col
+        {cache_dir}/{fingerprint}/chunk_00000_val.npy   (n, T) float32，每一行为一个像元的完整时间序列
+
+    有效像元指时间序列中至少有一个值不为 nodata 的像元
+
+    example:
+        store = PixelStore.open_or_build(FileUtils.list_full_dir(img_dir, '*.tif'), cache_dir)
+        for idx, values in store.iter_chunks():
+            ...
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.height = self.meta['height']
+        self.width = self.meta['width']
+        self.crs = rasterio.crs.CRS.from_wkt(self.meta['crs']) if self.meta['crs'] else None
+        self.transform = rasterio.Affine(*self.meta['transform'])
+        self.nodata = self.meta['nodata']
+        self.paths = self.meta['paths']
+        self.n_valid = self.meta['n_valid']
+        self.n_chunks = self.meta['n_chunks']
+
+    @staticmethod
+    def fingerprint(tif_path_list):
+        """
+        根据输入文件列表（顺序、大小、修改时间）以及第一景的网格信息计算缓存指纹
+        """
+        items = []
+        for p in tif_path_list:
+            stat = os.stat(p)
+            items.append([os.path.abspath(p), stat.st_size, stat.st_mtime_ns])
+        with rasterio.open(tif_path_list[0]) as ras:
+            grid = [ras.height, ras.width, list(ras.transform)[:6], ras.crs.to_wkt() if ras.crs else None]
+        text = json.dumps({'files': items, 'grid': grid}, ensure_ascii=False)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def open_or_build(tif_path_list, cache_dir, mem_budget_mb=256):
+        """
+        缓存存在时直接打开，否则重排生成
+        :param tif_path_list: 单波段栅格路径列表，顺序即时间顺序
+        :param cache_dir: 缓存根目录
+        :param mem_budget_mb: 重排时每个窗口的内存预算（MB），同时决定分块大小
+        :return: PixelStore
+        """
+        store_dir = os.path.join(cache_dir, PixelStore.fingerprint(tif_path_list))
+        if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+            PixelStore.build(tif_path_list, store_dir, mem_budget_mb)
+        return PixelStore(store_dir)
+
+    @staticmethod
+    def build(tif_path_list, store_dir, mem_budget_mb=256):
+        """
+        逐窗口读取全部栅格，把有效像元的时间序列写成分块数组。先写入临时目录，完成后再改名，避免中断留下不完整的缓存
+        """
+        tmp_dir = store_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        FileUtils.mkdirs(tmp_dir)
+
+        n_valid = 0
+        n_chunks = 0
+        chunks = []
+        with RasterStack(tif_path_list) as stack:
+            # 后台预取下一个窗口，与当前窗口的筛选和写盘重叠
+            for window, arr in stack.iter_windows(mem_budget_mb=mem_budget_mb, prefetch=1):
+                valid = ~np.all(np.isnan(arr), axis=-1)
+                rows, cols = np.nonzero(valid)
+                idx = (rows + int(window.row_off)) * stack.width + cols
+                np.save(os.path.join(tmp_dir, 'chunk_%05d_idx.npy' % n_chunks), idx.astype(np.int64))
+                np.save(os.path.join(tmp_dir, 'chunk_%05d_val.npy' % n_chunks), arr[valid])
+                n_valid += len(idx)
+                n_chunks += 1
+                chunks.append([int(window.row_off), int(window.height)])
+
+            meta = {
+                'paths': [os.path.abspath(p) for p in stack.paths],
+                'height': stack.height,
+                'width': stack.width,
+                'transform': list(stack.transform)[:6],
+                'crs': stack.crs.to_wkt() if stack.crs else None,
+                'nodata': stack.profile['nodata'],
+                'dtype': stack.dtype.name,
+                'n_valid': n_valid,
+                'n_chunks': n_chunks,
+                'chunks': chunks,
+            }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+
+    def load_chunk(self, chunk_id):
+        """
+        内存映射读取一个分块
+        :return: idx (n,) 一维下标, values (n, T) 时间序列
+        """
+        idx = np.load(os.path.join(self.store_dir, 'chunk_%05d_idx.npy' % chunk_id), mmap_mode='r')
+        values = np.load(os.path.join(self.store_dir, 'chunk_%05d_val.npy' % chunk_id), mmap_mode='r')
+        return idx, values
+
+    def iter_chunks(self):
+        for chunk_id in range(self.n_chunks):
+            yield self.load_chunk(chunk_id)
+
+    def load(self):
+        """
+        把全部分块读入内存，合并为一个 PixelMatrix
+        """
+        chunks = list(self.iter_chunks())
+        idx = np.concatenate([c[0] for c in chunks]) if chunks else np.empty(0, dtype=np.int64)
+        values = np.concatenate([c[1] for c in chunks]) if chunks else np.empty((0, len(self.paths)), np.float32)
+        return PixelMatrix(idx, values, self.height, self.width)
+
+    def take(self, flat_idx):
+        """
+        按一维下标取出像元的时间序列，不在缓存中的像元（全部为 nodata）结果为 nan。
+        用于对齐网格相同、但有效像元或分块不同的多个缓存
+        :param flat_idx: (n,) 一维下标
+        :return: (n, T) float32
+        """
+        flat_idx = np.asarray(flat_idx, dtype=np.int64)
+        out = np.full((len(flat_idx), len(self.paths)), np.nan, dtype=self.meta['dtype'])
+        rows = flat_idx // self.width
+        for chunk_id, (row_off, height) in enumerate(self.meta['chunks']):
+            sel = np.nonzero((rows >= row_off) & (rows < row_off + height))[0]
+            if len(sel) == 0:
+                continue
+            idx, values = self.load_chunk(chunk_id)
+            if len(idx) == 0:
+                continue
+            # 分块内的下标按行优先顺序递增，可以直接二分查找
+            pos = np.minimum(np.searchsorted(idx, flat_idx[sel]), len(idx) - 1)
+            found = idx[pos] == flat_idx[sel]
+            out[sel[found]] = values[pos[found]]
+        return out
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _select_kth(a, k):
+        """
+        快速选择：原地部分排序，使 a[k] 为第 k 小的值，a[:k] 均不大于它，平均 O(n)
+        """
+        lo = 0
+        hi = a.shape[0] - 1
+        while lo < hi:
+            pivot = a[(lo + hi) // 2]
+            i = lo
+            j = hi
+            while i <= j:
+                while a[i] < pivot:
+                    i += 1
+                while a[j] > pivot:
+                    j -= 1
+                if i <= j:
+                    tmp = a[i]
+                    a[i] = a[j]
+                    a[j] = tmp
+                    i += 1
+                    j -= 1
+            if k <= j:
+                hi = j
+            elif k >= i:
+                lo = i
+            else:
+                break
+        return a[k]
+
+    @numba.njit(cache=True)
+    def _median_inplace(a):
+        # 偶数个时第 m/2 小的值选出后，较小的中间值为左半部分的最大值
+        m = a.shape[0]
+        upper = _select_kth(a, m // 2)
+        if m % 2 == 1:
+            return upper
+        return (a[:m // 2].max() + upper) / 2
+
+    @numba.njit(parallel=True, cache=True)
+    def _mk_score_tie_sum_numba(block):
+        n_pixel, t = block.shape
+        s = np.zeros(n_pixel)
+        tie_sum = np.zeros(n_pixel)
+        for p in numba.prange(n_pixel):
+            row = block[p]
+            acc = 0.
+            for i in range(t - 1):
+                if np.isnan(row[i]):
+                    continue
+                for j in range(i + 1, t):
+                    if row[j] > row[i]:
+                        acc += 1.
+                    elif row[j] < row[i]:
+                        acc -= 1.
+            s[p] = acc
+
+            vals = np.sort(row[~np.isnan(row)])
+            ts = 0.
+            k = 0
+            while k < vals.shape[0]:
+                e = k + 1
+                while e < vals.shape[0] and vals[e] == vals[k]:
+                    e += 1
+                tp = e - k
+                ts += tp * (tp - 1) * (2 * tp + 5)
+                k = e
+            tie_sum[p] = ts
+        return s, tie_sum
+
+    @numba.njit(parallel=True, cache=True)
+    def _sens_slope_numba(block):
+        n_pixel, t = block.shape
+        slope = np.full(n_pixel, np.nan)
+        intercept = np.full(n_pixel, np.nan)
+        for p in numba.prange(n_pixel):
+            row = block[p]
+            pair_slopes = np.empty(t * (t - 1) // 2)
+            m = 0
+            for i in range(t - 1):
+                if np.isnan(row[i]):
+                    continue
+                for j in range(i + 1, t):
+                    if not np.isnan(row[j]):
+                        pair_slopes[m] = (row[j] - row[i]) / (j - i)
+                        m += 1
+            if m == 0:
+                continue
+            slope[p] = _median_inplace(pair_slopes[:m])
+
+            valid = ~np.isnan(row)
+            time_idx = np.nonzero(valid)[0].astype(np.float64)
+            intercept[p] = _median_inplace(row[valid].copy()) - _median_inplace(time_idx) * slope[p]
+        return slope, intercept
+
+
+class TrendUtils:
+    """
+    批量化的 Theil-Sen + Mann-Kendall 计算，输入为 (N, T) 的二维数组，N 为像元数，T 为时间序列长度，
+    nan 表示缺失值。计算结果与 pymannkendall.original_test 逐像元计算的结果一致
+
+    安装了 numba 时 S、结值修正项和 Sen 斜率默认使用多核编译内核（逐像元两两比较，中位数用快速选择），
+    不需要构造 (N, T(T-1)/2) 的两两斜率数组
+    """
+
+    # NumPy 实现中两两斜率数组的内存上限，超过时按像元分块计算
+    pair_slope_budget_mb = 256
+
+    @staticmethod
+    def _resolve_numba(use_numba):
+        if use_numba is None:
+            return numba is not None
+        if use_numba and numba is None:
+            raise ImportError('use_numba=True 需要安装 numba')
+        return use_numba
+
+    @staticmethod
+    def mk_score(block):
+        """
+        计算每个像元的 Mann-Kendall S 统计量，缺失值不参与计算
+        :param block: (N, T) 数组
+        :return: (N,) 的 S 值
+        """
+        block = np.asarray(block, dtype=np.float64)
+        s = np.zeros(block.shape[0])
+        for k in range(block.shape[1] - 1):
+            diff = block[:, k + 1:] - block[:, k:k + 1]
+            # nan 的符号为 nan，用 nansum 跳过缺失值
+            s += np.nansum(np.sign(diff), axis=1)
+        return s
+
+    @staticmethod
+    def tie_sum(block):
+        """
+        计算每个像元结值（相等值）修正项 sum(tp * (tp - 1) * (2 * tp + 5))
+        :param block: (N, T) 数组
+        :return: (N,) 的修正项
+        """
+        block = np.asarray(block, dtype=np.float64)
+        n_pixel, t = block.shape
+        if n_pixel == 0 or t == 0:
+            return np.zeros(n_pixel)
+        # 排序后相等的值相邻，nan 被排到末尾且互不相等
+        sorted_block = np.sort(block, axis=1)
+        new_group = np.ones((n_pixel, t), dtype=bool)
+        new_group[:, 1:] = sorted_block[:, 1:] != sorted_block[:, :-1]
+        group_id = np.cumsum(new_group, axis=1) - 1 + np.arange(n_pixel)[:, None] * t
+        valid = ~np.isnan(sorted_block)
+        tp = np.bincount(group_id[valid], minlength=n_pixel * t).astype(np.float64)
+        tp_term = (tp * (tp - 1) * (2 * tp + 5)).reshape(n_pixel, t)
+        return tp_term.sum(axis=1)
+
+    @staticmethod
+    def mk_score_tie_sum(block, use_numba=None):
+        """
+        同时计算 S 统计量和结值修正项
+        :param block: (N, T) 数组
+        :param use_numba: 是否使用 numba 内核，为 None 时安装了 numba 就使用
+        :return: s, tie_sum
+        """
+        block = np.asarray(block, dtype=np.float64)
+        if TrendUtils._resolve_numba(use_numba):
+            return _mk_score_tie_sum_numba(np.ascontiguousarray(block))
+        return TrendUtils.mk_score(block), TrendUtils.tie_sum(block)
+
+    @staticmethod
+    def sens_slope(block, use_numba=None):
+        """
+        计算每个像元的 Theil-Sen 斜率以及 Kendall-Theil 截距，时间下标按原始位置计算（缺失值所在的位置也计入下标）
+        :param block: (N, T) 数组
+        :param use_numba: 是否使用 numba 内核，为 None 时安装了 numba 就使用
+        :return: slope, intercept
+        """
+        block = np.asarray(block, dtype=np.float64)
+        if TrendUtils._resolve_numba(use_numba):
+            return _sens_slope_numba(np.ascontiguousarray(block))
+
+        n_pixel, t = block.shape
+        i_idx, j_idx = np.triu_indices(t, 1)
+        # 两两斜率数组按像元分块，避免 T 较大时内存占用过高
+        step = max(1, int(TrendUtils.pair_slope_budget_mb * 1024 ** 2 // max(len(i_idx) * 8, 1)))
+        slope = np.full(n_pixel, np.nan)
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            if t > 1:
+                for start in range(0, n_pixel, step):
+                    sub = block[start:start + step]
+                    pair_slopes = (sub[:, j_idx] - sub[:, i_idx]) / (j_idx - i_idx)
+                    slope[start:start + step] = np.nanmedian(pair_slopes, axis=1)
+            time_idx = np.where(np.isnan(block), np.nan, np.arange(t, dtype=np.float64))
+            intercept = np.nanmedian(block, axis=1) - np.nanmedian(time_idx, axis=1) * slope
+        return slope, intercept
+
+    @staticmethod
+    def sen_mk_batch(block, alpha=0.05, s=None, tie_sum=None, use_numba=None):
+        """
+        批量计算 Theil-Sen 斜率和 Mann-Kendall 检验
+
+        example: result = TrendUtils.sen_mk_batch(array[:, valid].T)
+
+        :param block: (N, T) 数组，每一行为一个像元的时间序列，nan 为缺失值
+        :param alpha: 显著性水平，默认 0.05
+        :param s: 可选，已知的 S 统计量（如增量更新得到的），为 None 时重新计算
+        :param tie_sum: 可选，已知的结值修正项，为 None 时重新计算
+        :param use_numba: 是否使用 numba 内核，为 None 时安装了 numba 就使用
+        :return: dict，包含 trend（1 上升，-1 下降，0 无趋势）, h, p, z, Tau, s, var_s, slope, intercept 以及结值修正项
+            tie_sum，每项均为 (N,) 数组
+        """
+        block = np.asarray(block, dtype=np.float64)
+        n = np.sum(~np.isnan(block), axis=1).astype(np.float64)
+
+        if s is None and tie_sum is None:
+            s, tie_sum = TrendUtils.mk_score_tie_sum(block, use_numba)
+        elif s is None:
+            s = TrendUtils.mk_score(block)
+        elif tie_sum is None:
+            tie_sum = TrendUtils.tie_sum(block)
+        s = np.asarray(s, dtype=np.float64)
+        var_s = (n * (n - 1) * (2 * n + 5) - tie_sum) / 18
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau = s / (.5 * n * (n - 1))
+            z = np.where(s > 0, (s - 1) / np.sqrt(var_s), np.where(s < 0, (s + 1) / np.sqrt(var_s), 0.))
+
+        p = 2 * (1 - norm.cdf(np.abs(z)))
+        h = np.abs(z) > norm.ppf(1 - alpha / 2)
+        trend = np.where(h & (z < 0), -1, np.where(h & (z > 0), 1, 0))
+        slope, intercept = TrendUtils.sens_slope(block, use_numba)
+
+        return {'trend': trend, 'h': h, 'p': p, 'z': z, 'Tau': tau, 's': s, 'var_s': var_s, 'slope': slope,
+                'intercept': intercept, 'tie_sum': np.asarray(tie_sum, dtype=np.float64)}
+
+    @staticmethod
+    def mk_append(block, s, tie_sum, x_new):
+        """
+        在时间序列末尾追加一期数据时增量更新 S 统计量和结值修正项，只需要 O(T) 的计算：
+        S 加上 sum(sign(x_new - x_i))，与 x_new 相等的已有值个数为 t 时，修正项加上 f(t + 1) - f(t)，
+        其中 f(t) = t * (t - 1) * (2 * t + 5)
+        :param block: (N, T) 追加前的时间序列
+        :param s: (N,) 追加前的 S
+        :param tie_sum: (N,) 追加前的结值修正项
+        :param x_new: (N,) 新一期的值，nan 表示缺失（缺失时 S 和修正项不变）
+        :return: 追加后的 s, tie_sum
+        """
+        block = np.asarray(block, dtype=np.float64)
+        x_new = np.asarray(x_new, dtype=np.float64)[:, None]
+        s = np.asarray(s, dtype=np.float64) + np.nansum(np.sign(x_new - block), axis=1)
+
+        t = np.sum(block == x_new, axis=1).astype(np.float64)
+        tie_sum = np.asarray(tie_sum, dtype=np.float64) + (t + 1) * t * (2 * t + 7) - t * (t - 1) * (2 * t + 5)
+        return s, tie_sum
+
+
+class CorrUtils:
+    """
+    批量化的多变量偏相关计算，与 pingouin.partial_corr（pearson，双侧检验）逐像元计算的结果一致
+    """
+
+    @staticmethod
+    def partial_corr_batch(y, xs, min_rows=3):
+        """
+        计算每个像元 y 与每个因子在控制其余全部因子后的偏相关系数以及 t 检验 p 值
+
+        对每个像元的相关系数矩阵求逆，一次得到全部因子的偏相关系数。任一变量为 nan 的时间点整行剔除（等价于 dropna），
+        剔除后有效行数需大于 {min_rows} 才计算，否则结果为 nan
+
+        example: r, p = CorrUtils.partial_corr_batch(y_block, [x1_block, x2_block, x3_block])
+
+        :param y: (N, T) 数组，N 为像元数，T 为时间序列长度
+        :param xs: K 个 (N, T) 数组组成的列表，或 (N, T, K) 数组
+        :param min_rows: 最少有效行数（不含），默认 3
+        :return: r, p 两个 (N, K) 数组
+        """
+        y = np.asarray(y, dtype=np.float64)
+        if isinstance(xs, np.ndarray) and xs.ndim == 3:
+            xs = np.asarray(xs, dtype=np.float64)
+        else:
+            xs = np.stack([np.asarray(x, dtype=np.float64) for x in xs], axis=-1)
+        n_pixel, _, k = xs.shape
+        data = np.concatenate([y[:, :, None], xs], axis=-1)
+
+        r = np.full((n_pixel, k), np.nan)
+        p = np.full((n_pixel, k), np.nan)
+
+        valid = ~np.isnan(data).any(axis=-1)
+        n = valid.sum(axis=1)
+        # 有列为常数（pingouin 中 nunique < 2）的像元结果为 nan
+        col_max = np.where(valid[:, :, None], data, -np.inf).max(axis=1)
+        col_min = np.where(valid[:, :, None], data, np.inf).min(axis=1)
+        calc = (n > min_rows) & (col_max > col_min).all(axis=1)
+        if not calc.any():
+            return r, p
+
+        data = data[calc]
+        valid = valid[calc]
+        n = n[calc].astype(np.float64)
+
+        data = np.where(valid[:, :, None], data, 0.)
+        mean = data.sum(axis=1) / n[:, None]
+        centered = np.where(valid[:, :, None], data - mean[:, None, :], 0.)
+        cov = np.einsum('ntv,ntw->nvw', centered, centered) / (n - 1)[:, None, None]
+        std = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+        corr = cov / std[:, :, None] / std[:, None, :]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv = np.linalg.pinv(corr, hermitian=True)
+            d = 1 / np.sqrt(np.diagonal(inv, axis1=1, axis2=2))
+            pcor = -inv * d[:, :, None] * d[:, None, :]
+            r_calc = np.clip(pcor[:, 0, 1:], -1, 1)
+
+            # 自由度 n - 协变量个数 - 2，协变量为其余 k - 1 个因子
+            dof = (n - (k - 1) - 2)[:, None]
+            t_val = r_calc * np.sqrt(dof / (1 - r_calc ** 2))
+            p_calc = 2 * t_dist.sf(np.abs(t_val), dof)
+        p_calc = np.where(np.isclose(r_calc ** 2, 1), 0., p_calc)
+
+        r[calc] = r_calc
+        p[calc] = p_calc
+        return r, p
 
 
 class BaseUtils:
@@ -6,17 +6,71 @@ import os
 # os.environ['PROJ_LIB'] = r"D:\Users\GIS3406\miniconda3\Lib\site-packages\osgeo\data\proj"
 
 
+import csv
 import fnmatch
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import numpy as np
 import rasterio
 from PIL import Image
 from rasterio.crs import CRS
+from rasterio.windows import Window
 from tqdm import tqdm
 
+from my_utils import RunReport
+
 """
 公式原理参考：https://blog.csdn.net/snowfallxuan/article/details/122391512
 """
 
+
+# 每个进程内按内容哈希缓存解码后的瓦片，大片空白区域的瓦片字节完全相同，只需解码一次。
+# mosaic_convert 会在多个线程中读取，查找、插入和淘汰都在锁内进行
+_decoded_tiles = OrderedDict()
+_decoded_tiles_max = 256
+_decoded_tiles_lock = threading.Lock()
+
+_empty_manifest_name = 'empty_tiles.csv'
+
+
+def _convert_tile_batch(converter, tasks, dedup=True, skip_empty=False):
+    """
+    子进程中转换一批瓦片，tasks 为 (input_path, output_path, zoomLevel, col_idx, row_idx) 列表
+
+    Returns:
+        tuple: 处理的瓦片数, 跳过的纯色瓦片记录列表, 解码缓存命中数,
+            统计 {'read': 读取解码耗时, 'write': 写出耗时, 'bytes_read': 读取字节数, 'bytes_written': 写出字节数}
+    """
+    empty_records = []
+    n_hits = 0
+    stats = {'read': 0., 'write': 0., 'bytes_read': 0, 'bytes_written': 0}
+    for in_path, out_path, zoom, col_idx, row_idx in tasks:
+        start = time.perf_counter()
+        if dedup:
+            data, uniform, hit = converter.read_tile_array_dedup(in_path)
+            n_hits += hit
+        else:
+            data = converter.read_tile_array(in_path)
+            uniform = (data == data[0, 0]).all()
+        stats['read'] += time.perf_counter() - start
+        stats['bytes_read'] += os.path.getsize(in_path)
+
+        if skip_empty and uniform:
+            empty_records.append((os.path.basename(in_path), zoom, row_idx, col_idx) + tuple(int(v) for v in data[0, 0]))
+            continue
+        start = time.perf_counter()
+        converter.convert_single_image(in_path, out_path, zoom, col_idx, row_idx, data=data)
+        stats['write'] += time.perf_counter() - start
+        stats['bytes_written'] += os.path.getsize(out_path)
+    return len(tasks), empty_records, n_hits, stats
+
+
 class TiandituLonLatTile2TifConverter:
     def __init__(self, crs=CRS.from_epsg(4490), tile_size=(256, 256)):
         """
@@ -28,6 +82,12 @@ class TiandituLonLatTile2TifConverter:
         self.crs = crs
         self.tile_width, self.tile_height = tile_size
 
+    def __getstate__(self):
+        # 瓦片信息在主进程中解析，复写到实例上的 get_idx_row_col_z 可能是无法序列化的局部函数，传给子进程时去掉
+        state = self.__dict__.copy()
+        state.pop('get_idx_row_col_z', None)
+        return state
+
     @staticmethod
     def get_idx_row_col_z(tile_name):
         """
@@ -84,6 +144,115 @@ class TiandituLonLatTile2TifConverter:
 
         return lon, lat
 
+    @staticmethod
+    def calculate_row_col_idx_array(lon, lat, z):
+        """
+        calculate_row_col_idx 的数组版本，lon、lat、z 可以是标量或可广播的数组（多个缩放级别）
+
+        Returns:
+            tuple: 行索引数组, 列索引数组 (int64)
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+
+        num_row = (90 - lat) / (180 / (2 ** (z - 1))) + 1
+        num_col = (lon - (-180)) / (360 / (2 ** z)) + 1
+
+        # 与标量版本的 int() 一样向零取整
+        num_row_idx = np.trunc(num_row).astype(np.int64) - 1
+        num_col_idx = np.trunc(num_col).astype(np.int64) - 1
+        return num_row_idx, num_col_idx
+
+    @staticmethod
+    def calculate_lon_lat_array(num_row_idx, num_col_idx, z):
+        """
+        calculate_lon_lat 的数组版本，计算瓦片左上角的经纬度
+        Args:
+            num_row_idx: 行索引，标量或数组
+            num_col_idx: 列索引，标量或数组
+            z: 缩放级别，标量或可广播的数组
+
+        Returns:
+            tuple: 经度数组, 纬度数组
+        """
+        z = np.asarray(z, dtype=np.float64)
+        lat_step = 180 / (2 ** (z - 1))
+        lon_step = 360 / (2 ** z)
+
+        lat = 90 - np.asarray(num_row_idx) * lat_step
+        lon = -180 + np.asarray(num_col_idx) * lon_step
+        return lon, lat
+
+    @classmethod
+    def bbox_tile_range(cls, bounds, z):
+        """
+        计算范围在缩放级别 z 下覆盖的瓦片行列索引范围（闭区间）。范围的右、下边界不包含在内，
+        与瓦片边界重合的范围只覆盖边界内侧的瓦片，如恰好为一个瓦片范围时只返回该瓦片
+
+        Args:
+            bounds: (left, bottom, right, top)，或带 bounds 属性的几何对象（如 shapely 的多边形）
+            z: 缩放级别，标量或数组
+
+        Returns:
+            tuple: 最小行, 最大行, 最小列, 最大列
+        """
+        left, bottom, right, top = getattr(bounds, 'bounds', bounds)
+        z = np.asarray(z, dtype=np.int64)
+
+        # 以瓦片为单位的坐标，舍入掉浮点误差，避免与瓦片边界重合的坐标落到相邻瓦片
+        lat_step = 180 / (2. ** (z - 1))
+        lon_step = 360 / (2. ** z)
+        row_top = np.round((90 - np.asarray(top, dtype=np.float64)) / lat_step, 9)
+        row_bottom = np.round((90 - np.asarray(bottom, dtype=np.float64)) / lat_step, 9)
+        col_left = np.round((np.asarray(left, dtype=np.float64) + 180) / lon_step, 9)
+        col_right = np.round((np.asarray(right, dtype=np.float64) + 180) / lon_step, 9)
+
+        # 下限向下取整，上限按半开区间 ceil(x) - 1，退化为线或点的范围至少包含下限所在的瓦片
+        row_min = np.floor(row_top).astype(np.int64)
+        col_min = np.floor(col_left).astype(np.int64)
+        row_max = np.maximum(np.ceil(row_bottom).astype(np.int64) - 1, row_min)
+        col_max = np.maximum(np.ceil(col_right).astype(np.int64) - 1, col_min)
+
+        # 裁剪到该级别的有效索引范围（行数 2^(z-1)，列数 2^z）
+        n_rows = 2 ** (z - 1)
+        n_cols = 2 ** z
+        row_min = np.clip(row_min, 0, n_rows - 1)
+        row_max = np.clip(row_max, 0, n_rows - 1)
+        col_min = np.clip(col_min, 0, n_cols - 1)
+        col_max = np.clip(col_max, 0, n_cols - 1)
+        return row_min, row_max, col_min, col_max
+
+    @classmethod
+    def count_tiles_in_bbox(cls, bounds, z):
+        """
+        范围在缩放级别 z 下覆盖的瓦片数量，z 为数组时返回每个级别的数量
+        """
+        row_min, row_max, col_min, col_max = cls.bbox_tile_range(bounds, z)
+        return (row_max - row_min + 1) * (col_max - col_min + 1)
+
+    @classmethod
+    def iter_tiles_in_bbox(cls, bounds, zooms, chunk_size=1 << 20):
+        """
+        按块惰性生成范围覆盖的所有瓦片索引，每次返回最多 chunk_size 个瓦片
+
+        Args:
+            bounds: (left, bottom, right, top)，或带 bounds 属性的几何对象
+            zooms: 缩放级别，标量或列表
+            chunk_size: 每块瓦片数
+
+        Yields:
+            tuple: 行索引数组, 列索引数组, 缩放级别
+        """
+        for z in np.atleast_1d(zooms):
+            row_min, row_max, col_min, col_max = cls.bbox_tile_range(bounds, z)
+            n_cols = int(col_max - col_min + 1)
+            total = int(row_max - row_min + 1) * n_cols
+            for start in range(0, total, chunk_size):
+                flat = np.arange(start, min(start + chunk_size, total), dtype=np.int64)
+                rows, cols = np.divmod(flat, n_cols)
+                yield rows + row_min, cols + col_min, int(z)
+
     @staticmethod
     def calculate_pixel_resolution(tile_width, tile_height, zoomLevel):
         """
@@ -99,7 +268,49 @@ class TiandituLonLatTile2TifConverter:
         lon_resolution = 360 / (2 ** zoomLevel) / tile_width
         return lon_resolution, lat_resolution
 
-    def convert_single_image(self, input_path, output_path, zoomLevel, col_idx, row_idx):
+    @staticmethod
+    def read_tile_array(input_path):
+        """
+        读取瓦片图像，返回 (高, 宽, 3) 的 RGB 数组
+
+        Args:
+            input_path: 输入图像路径
+        """
+        with Image.open(input_path) as img:
+            img = img.convert('RGB')  # 确保是 RGB 模式
+            return np.array(img)
+
+    @classmethod
+    def read_tile_array_dedup(cls, input_path):
+        """
+        按文件内容哈希读取瓦片，内容相同的瓦片只解码一次，返回的数组为只读
+
+        Returns:
+            tuple: (高, 宽, 3) 数组, 是否为纯色瓦片, 是否命中缓存
+        """
+        with open(input_path, 'rb') as f:
+            payload = f.read()
+        digest = hashlib.sha1(payload).digest()
+
+        with _decoded_tiles_lock:
+            cached = _decoded_tiles.get(digest)
+            if cached is not None:
+                _decoded_tiles.move_to_end(digest)
+                return cached + (True,)
+
+        # 解码在锁外进行，多个线程同时解码相同内容时结果一样，后插入的覆盖先插入的
+        data = cls.read_tile_array(io.BytesIO(payload))
+        data.flags.writeable = False
+        cached = (data, bool((data == data[0, 0]).all()))
+        with _decoded_tiles_lock:
+            _decoded_tiles[digest] = cached
+            _decoded_tiles.move_to_end(digest)
+            # 按最近使用顺序淘汰
+            while len(_decoded_tiles) > _decoded_tiles_max:
+                _decoded_tiles.popitem(last=False)
+        return cached + (False,)
+
+    def convert_single_image(self, input_path, output_path, zoomLevel, col_idx, row_idx, data=None):
         """
         将单个图像转换为 GeoTIFF
 
@@ -109,6 +320,7 @@ class TiandituLonLatTile2TifConverter:
             zoomLevel: 缩放级别
             col_idx: 瓦片列号
             row_idx: 瓦片行号
+            data: 已解码的 (高, 宽, 3) 数组，为 None 时从 input_path 读取
         """
         # 计算每个像素的经纬度值（也就是分辨率）
         lon_resolution, lat_resolution = self.calculate_pixel_resolution(self.tile_width, self.tile_height, zoomLevel)
@@ -117,27 +329,27 @@ class TiandituLonLatTile2TifConverter:
         left, top = self.calculate_lon_lat(row_idx, col_idx, zoomLevel)
 
         # 读取PNG图像
-        with Image.open(input_path) as img:
-            img = img.convert('RGB')  # 确保是 RGB 模式
-            data = np.array(img)
-
-            # 创建GeoTIFF文件
-            profile = {
-                'driver': 'GTiff',
-                'height': self.tile_height,
-                'width': self.tile_width,
-                'count': 3,  # 3波段
-                'dtype': data.dtype,
-                'crs': self.crs,
-                'transform': rasterio.transform.from_origin(left, top, lon_resolution, lat_resolution)
-            }
+        if data is None:
+            data = self.read_tile_array(input_path)
+
+        # 创建GeoTIFF文件
+        profile = {
+            'driver': 'GTiff',
+            'height': self.tile_height,
+            'width': self.tile_width,
+            'count': 3,  # 3波段
+            'dtype': data.dtype,
+            'crs': self.crs,
+            'transform': rasterio.transform.from_origin(left, top, lon_resolution, lat_resolution)
+        }
 
         with rasterio.open(output_path, 'w', **profile) as dst:
             dst.write(data[:, :, 0], 1)  # 写入 R 通道
             dst.write(data[:, :, 1], 2)  # 写入 G 通道
             dst.write(data[:, :, 2], 3)  # 写入 B 通道
 
-    def batch_convert(self, input_dir, output_dir, extension='.png'):
+    def batch_convert(self, input_dir, output_dir, extension='.png', workers=None, chunk_size=256, index=None,
+                      dedup=True, skip_empty=False, report_name='run_report.json'):
         """
         批量转换图像为 GeoTIFF
 
@@ -145,18 +357,326 @@ class TiandituLonLatTile2TifConverter:
             input_dir: 输入图像目录
             output_dir: 输出 GeoTIFF 目录
             extension: 输入图像扩展名
+            workers: 进程数，为 None 或 1 时在当前进程中串行转换
+            chunk_size: 并行时每个任务包含的瓦片数
+            index: TileIndex，不为 None 时先增量更新索引，只转换新增或有变化的瓦片
+            dedup: 是否按内容哈希复用已解码的瓦片
+            skip_empty: 为 True 时纯色瓦片不输出 GeoTIFF，只记录到输出目录的 empty_tiles.csv 中
+            report_name: 运行报告（各阶段耗时、读写字节数、每秒瓦片数、峰值内存）在输出目录下的 JSON 文件名，
+                为 None 时不输出。read、write 为各进程读取解码、写出耗时之和
         """
 
         os.makedirs(output_dir, exist_ok=True)
+        report = RunReport('batch_convert', os.path.join(output_dir, report_name) if report_name else None,
+                           input_dir=input_dir, output_dir=output_dir, extension=extension, workers=workers,
+                           chunk_size=chunk_size, index=index is not None, dedup=dedup, skip_empty=skip_empty)
+
+        # 瓦片信息在主进程中解析，这样复写的 get_idx_row_col_z 在并行时同样生效
+        tasks = []
+        with report.stage('discover'):
+            if index is not None:
+                index.scan(input_dir, self.get_idx_row_col_z, extension)
+                for in_path, zoom, row_idx, col_idx in index.pending(input_dir):
+                    out_path = os.path.join(output_dir, os.path.basename(in_path).replace(extension, '.tif'))
+                    tasks.append((in_path, out_path, zoom, col_idx, row_idx))
+            else:
+                img_names = sorted(fnmatch.filter(os.listdir(input_dir), f'*{extension}'))
+                for img_n in img_names:
+                    in_path = os.path.join(input_dir, img_n)
+                    out_path = os.path.join(output_dir, img_n.replace(extension, '.tif'))
+
+                    # 获取瓦片信息- 这一块可能需要自定义
+                    row_idx, col_idx, zoom = self.get_idx_row_col_z(img_n)
+                    tasks.append((in_path, out_path, zoom, col_idx, row_idx))
+
+        batches = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        start_time = time.perf_counter()
+        with tqdm(total=len(tasks), unit='tile') as pbar:
+            if workers is None or workers <= 1:
+                done_batches = ((batch, _convert_tile_batch(self, batch, dedup, skip_empty)) for batch in batches)
+                empty_records, n_hits = self._drain_batches(done_batches, pbar, start_time, index, report)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(_convert_tile_batch, self, batch, dedup, skip_empty): batch
+                               for batch in batches}
+                    done_batches = ((futures[f], f.result()) for f in as_completed(futures))
+                    empty_records, n_hits = self._drain_batches(done_batches, pbar, start_time, index, report)
+
+        manifest_path = os.path.join(output_dir, _empty_manifest_name)
+        if empty_records or os.path.exists(manifest_path):
+            self._update_empty_manifest(manifest_path, empty_records, [os.path.basename(t[0]) for t in tasks])
+
+        elapsed = time.perf_counter() - start_time
+        report.add_stage('convert', elapsed)
+        report.count(tiles=len(tasks), cache_hits=n_hits, empty_tiles=len(empty_records))
+        report.finish()
+        print(f'converted {len(tasks)} tiles in {elapsed:.2f}s, {len(tasks) / max(elapsed, 1e-9):.1f} tiles/sec, '
+              f'{n_hits} decode cache hits, {len(empty_records)} empty tiles skipped')
+
+    @staticmethod
+    def _drain_batches(done_batches, pbar, start_time, index, report):
+        empty_records = []
+        n_hits = 0
+        for batch, (n, batch_empty_records, batch_hits, stats) in done_batches:
+            # 每完成一批就记录到索引中，中断后重新运行只会转换剩下的瓦片
+            if index is not None:
+                index.mark_converted([task[0] for task in batch])
+            empty_records.extend(batch_empty_records)
+            n_hits += batch_hits
+            report.add_stage('read', stats['read'])
+            report.add_stage('write', stats['write'])
+            report.count(bytes_read=stats['bytes_read'], bytes_written=stats['bytes_written'])
+            pbar.update(n)
+            pbar.set_postfix(tiles_per_sec='%.1f' % (pbar.n / (time.perf_counter() - start_time)))
+        return empty_records, n_hits
+
+    @staticmethod
+    def _update_empty_manifest(manifest_path, empty_records, processed_names):
+        """
+        更新跳过的纯色瓦片清单：文件名, z, row, col, 以及瓦片的 R, G, B 值。
+        本次处理过的瓦片以本次结果为准（不再为纯色的移除），其余保留之前的记录，按文件名去重后整体重写
+        """
+        records = {}
+        if os.path.exists(manifest_path):
+            processed = set(processed_names)
+            with open(manifest_path, newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for row in reader:
+                    if row and row[0] not in processed:
+                        records[row[0]] = tuple(row[:1]) + tuple(int(v) for v in row[1:])
+        for record in empty_records:
+            records[record[0]] = tuple(record)
+
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'z', 'row', 'col', 'r', 'g', 'b'])
+            writer.writerows(sorted(records.values()))
+        os.replace(tmp_path, manifest_path)
+
+    def mosaic_convert(self, input_dir, output_path, extension='.png', nodata=None, compress='deflate', workers=None,
+                       chunk_size=256):
+        """
+        把目录中同一缩放级别的瓦片直接拼接写入一个分块压缩的 GeoTIFF，缺失的瓦片在掩膜中为无效
+
+        Args:
+            input_dir: 输入图像目录
+            output_path: 输出 GeoTIFF 路径
+            extension: 输入图像扩展名
+            nodata: 为 None（默认）时写入内部掩膜波段，只有缺失的瓦片为无效，瓦片中的黑色像素（水体、阴影）保持有效；
+                不为 None 时改用该 nodata 值标记缺失的瓦片，注意瓦片中等于该值的像素同样会被视为 nodata
+            compress: 压缩方式
+            workers: 解码瓦片的线程数，为 None 或 1 时在当前线程中解码
+            chunk_size: 每次并行解码的瓦片数，限制内存中同时存在的瓦片数量
+        """
         img_names = fnmatch.filter(os.listdir(input_dir), f'*{extension}')
-        for img_n in tqdm(img_names):
-            in_path = os.path.join(input_dir, img_n)
-            out_path = os.path.join(output_dir, img_n.replace(extension, '.tif'))
+        if not img_names:
+            raise ValueError(f'{input_dir} 中没有 {extension} 瓦片')
 
-            # 获取瓦片信息- 这一块可能需要自定义
+        tiles = []
+        for img_n in img_names:
             row_idx, col_idx, zoom = self.get_idx_row_col_z(img_n)
+            tiles.append((row_idx, col_idx, zoom, os.path.join(input_dir, img_n)))
+
+        zooms = {t[2] for t in tiles}
+        if len(zooms) > 1:
+            raise ValueError(f'瓦片包含多个缩放级别 {sorted(zooms)}，只能拼接同一缩放级别的瓦片')
+        zoom = zooms.pop()
+
+        # 按行列排序，输出文件按块顺序写入
+        tiles.sort()
+        min_row = min(t[0] for t in tiles)
+        max_row = max(t[0] for t in tiles)
+        min_col = min(t[1] for t in tiles)
+        max_col = max(t[1] for t in tiles)
+
+        lon_resolution, lat_resolution = self.calculate_pixel_resolution(self.tile_width, self.tile_height, zoom)
+        left, top = self.calculate_lon_lat(min_row, min_col, zoom)
+        profile = {
+            'driver': 'GTiff',
+            'height': (max_row - min_row + 1) * self.tile_height,
+            'width': (max_col - min_col + 1) * self.tile_width,
+            'count': 3,
+            'dtype': 'uint8',
+            'crs': self.crs,
+            'transform': rasterio.transform.from_origin(left, top, lon_resolution, lat_resolution),
+            'tiled': True,
+            'blockxsize': self.tile_width,
+            'blockysize': self.tile_height,
+            'compress': compress,
+            # 缺失的瓦片不写入，读取时为 0，掩膜中同样不写入，为无效
+            'sparse_ok': True,
+            'BIGTIFF': 'IF_SAFER',
+        }
+
+        if nodata is not None:
+            profile['nodata'] = nodata
+        valid_mask = np.full((self.tile_height, self.tile_width), 255, dtype=np.uint8)
+
+        start_time = time.perf_counter()
+        with rasterio.Env(GDAL_TIFF_INTERNAL_MASK=True), rasterio.open(output_path, 'w', **profile) as dst, \
+                ThreadPoolExecutor(max_workers=workers or 1) as executor, \
+                tqdm(total=len(tiles), unit='tile') as pbar:
+            for i in range(0, len(tiles), chunk_size):
+                chunk = tiles[i:i + chunk_size]
+                arrays = executor.map(self.read_tile_array_dedup, [t[3] for t in chunk])
+                for (row_idx, col_idx, _, _), (data, _, _) in zip(chunk, arrays):
+                    window = Window((col_idx - min_col) * self.tile_width, (row_idx - min_row) * self.tile_height,
+                                    self.tile_width, self.tile_height)
+                    dst.write(data.transpose(2, 0, 1), window=window)
+                    if nodata is None:
+                        dst.write_mask(valid_mask, window=window)
+                    pbar.update(1)
+
+        elapsed = time.perf_counter() - start_time
+        print(f'mosaicked {len(tiles)} tiles in {elapsed:.2f}s, {len(tiles) / max(elapsed, 1e-9):.1f} tiles/sec')
+
+
+class TileIndex:
+    def __init__(self, db_path):
+        """
+        瓦片目录的持久化索引（SQLite），以 (目录, 文件名) 为键记录每个瓦片文件的 (z, row, col)、大小和修改时间，
+        重新扫描时只解析新增或有变化的文件。不同目录或不同时间前缀的同一位置瓦片各自一条记录
+        Args:
+            db_path: 索引数据库文件路径
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        with self.conn:
+            old_schema = self.conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tiles'").fetchone()
+            if old_schema is not None and 'PRIMARY KEY (z, row, col)' in old_schema[0]:
+                # 旧版索引以 (z, row, col) 为主键，迁移到新表，已有记录和转换状态保留
+                self.conn.execute('ALTER TABLE tiles RENAME TO tiles_old')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS tiles ('
+                'dir TEXT NOT NULL, name TEXT NOT NULL, z INTEGER NOT NULL, row INTEGER NOT NULL, '
+                'col INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, converted_mtime_ns INTEGER, '
+                'PRIMARY KEY (dir, name))'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS tiles_zrc ON tiles (z, row, col)')
+            if old_schema is not None and 'PRIMARY KEY (z, row, col)' in old_schema[0]:
+                self.conn.execute('INSERT INTO tiles SELECT dir, name, z, row, col, size, mtime_ns, '
+                                  'converted_mtime_ns FROM tiles_old')
+                self.conn.execute('DROP TABLE tiles_old')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+
+    def scan(self, input_dir, get_idx_row_col_z, extension='.png'):
+        """
+        增量扫描瓦片目录，新增和大小/修改时间有变化的文件重新解析入库，已删除的文件从索引中移除
 
-            self.convert_single_image(in_path, out_path, zoom, col_idx, row_idx)
+        Args:
+            input_dir: 瓦片目录
+            get_idx_row_col_z: 文件名解析函数，一般传入转换器的 get_idx_row_col_z
+            extension: 瓦片扩展名
+
+        Returns:
+            tuple: 新增数, 变化数, 删除数
+        """
+        input_dir = os.path.abspath(input_dir)
+        existing = {name: (size, mtime_ns) for name, size, mtime_ns in
+                    self.conn.execute('SELECT name, size, mtime_ns FROM tiles WHERE dir = ?', (input_dir,))}
+
+        pattern = f'*{extension}'
+        rows = []
+        n_new = n_changed = 0
+        seen = set()
+        with os.scandir(input_dir) as it:
+            for entry in it:
+                if not entry.is_file() or not fnmatch.fnmatch(entry.name, pattern):
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                old = existing.get(entry.name)
+                if old == (st.st_size, st.st_mtime_ns):
+                    continue
+                if old is None:
+                    n_new += 1
+                else:
+                    n_changed += 1
+                row_idx, col_idx, zoom = get_idx_row_col_z(entry.name)
+                rows.append((input_dir, entry.name, zoom, row_idx, col_idx, st.st_size, st.st_mtime_ns))
+
+        removed = [(input_dir, name) for name in existing.keys() - seen]
+        with self.conn:
+            self.conn.executemany('DELETE FROM tiles WHERE dir = ? AND name = ?', removed)
+            # 有变化的文件只更新元数据，保留 converted_mtime_ns，与新的 mtime_ns 不同即为待转换
+            self.conn.executemany(
+                'INSERT INTO tiles (dir, name, z, row, col, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (dir, name) DO UPDATE SET z = excluded.z, row = excluded.row, col = excluded.col, '
+                'size = excluded.size, mtime_ns = excluded.mtime_ns',
+                rows)
+        return n_new, n_changed, len(removed)
+
+    def pending(self, input_dir=None):
+        """
+        还未转换或转换后有变化的瓦片
+
+        Returns:
+            list: (路径, z, row, col) 列表，按 z、row、col 排序
+        """
+        sql = 'SELECT dir, name, z, row, col FROM tiles WHERE converted_mtime_ns IS NOT mtime_ns'
+        params = ()
+        if input_dir is not None:
+            sql += ' AND dir = ?'
+            params = (os.path.abspath(input_dir),)
+        sql += ' ORDER BY z, row, col'
+        return [(os.path.join(d, name), z, row, col) for d, name, z, row, col in self.conn.execute(sql, params)]
+
+    def mark_converted(self, paths):
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE tiles SET converted_mtime_ns = mtime_ns WHERE dir = ? AND name = ?',
+                [(os.path.dirname(os.path.abspath(p)), os.path.basename(p)) for p in paths])
+
+    def query(self, bounds, z, input_dir=None):
+        """
+        范围内已有的瓦片，同一位置在多个目录中都有时每个文件各返回一条
+
+        Args:
+            bounds: (left, bottom, right, top)，或带 bounds 属性的几何对象
+            z: 缩放级别
+            input_dir: 不为 None 时只查询该目录中的瓦片
+
+        Returns:
+            tuple: 行索引数组, 列索引数组, 路径列表
+        """
+        row_min, row_max, col_min, col_max = TiandituLonLatTile2TifConverter.bbox_tile_range(bounds, z)
+        sql = 'SELECT row, col, dir, name FROM tiles WHERE z = ? AND row BETWEEN ? AND ? AND col BETWEEN ? AND ?'
+        params = (int(z), int(row_min), int(row_max), int(col_min), int(col_max))
+        if input_dir is not None:
+            sql += ' AND dir = ?'
+            params += (os.path.abspath(input_dir),)
+        records = self.conn.execute(sql, params).fetchall()
+        rows = np.array([r[0] for r in records], dtype=np.int64)
+        cols = np.array([r[1] for r in records], dtype=np.int64)
+        return rows, cols, [os.path.join(r[2], r[3]) for r in records]
+
+    def missing(self, bounds, z, input_dir=None):
+        """
+        范围内缺失的瓦片
+
+        Returns:
+            tuple: 行索引数组, 列索引数组
+        """
+        row_min, row_max, col_min, col_max = TiandituLonLatTile2TifConverter.bbox_tile_range(bounds, z)
+        rows, cols, _ = self.query(bounds, z, input_dir)
+        present = np.zeros((int(row_max - row_min + 1), int(col_max - col_min + 1)), dtype=bool)
+        present[rows - row_min, cols - col_min] = True
+        miss_rows, miss_cols = np.nonzero(~present)
+        return miss_rows + row_min, miss_cols + col_min
 
 
 if __name__ == '__main__':
@@ -196,4 +716,21 @@ if __name__ == '__main__':
         input_dir=r'F:\test\新建文件夹\source',
         output_dir=r'F:\test\新建文件夹\target-1',
         extension='.png',
+        workers=os.cpu_count(),
     )
+
+    # 或者直接拼接成一个 GeoTIFF
+    # converter.mosaic_convert(
+    #     input_dir=r'F:\test\新建文件夹\source',
+    #     output_path=r'F:\test\新建文件夹\mosaic.tif',
+    #     workers=os.cpu_count(),
+    # )
+
+    # 反复处理同一个目录时，可以用持久化索引只转换新增或有变化的瓦片
+    # with TileIndex(r'F:\test\新建文件夹\tiles.db') as tile_index:
+    #     converter.batch_convert(
+    #         input_dir=r'F:\test\新建文件夹\source',
+    #         output_dir=r'F:\test\新建文件夹\target-1',
+    #         workers=os.cpu_count(),
+    #         index=tile_index,
+    #     )
@@ -1,89 +1,365 @@
+import csv
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import rasterio
 import numpy as np
 import os
 from tqdm import tqdm
 
-def crop_and_pad_tif(input_tif, output_dir, crop_size):
+from my_utils import RunReport
+
+
+def _block_aligned_group(block_size, crop_size, total, min_pixels=1024, max_pixels=4096):
+    """
+    计算每个任务在一个方向上包含的裁剪块数，使任务边界尽量落在源数据的内部块边界上，
+    同一个压缩块只会被一个任务解压
+
+    Args:
+        block_size: 源数据内部块在该方向上的大小
+        crop_size: 裁剪尺寸
+        total: 源数据在该方向上的大小
+        min_pixels: 任务在该方向上的最小像素数，避免任务过碎，为 0 时不放大
+        max_pixels: 块大小与裁剪尺寸的最小公倍数超过该值时不再对齐
+    """
+    if block_size >= total:
+        # 条带存储时整行为一个块，按列拆分会重复解压
+        return int(np.ceil(total / crop_size))
+
+    # 块大小与裁剪尺寸最小公倍数对应的裁剪块数
+    n = block_size // math.gcd(block_size, crop_size)
+    if n * crop_size > max_pixels:
+        n = 1
+    return n * max(1, int(np.ceil(min_pixels / (n * crop_size))))
+
+
+def _valid_fraction(crop_data, nodata, n_pixels):
+    """
+    裁剪块中有效像素（任一波段不为 nodata，未设置 nodata 时不为 0）占整个裁剪块（含填充部分）的比例
+    """
+    if nodata is None:
+        valid = (crop_data != 0).any(axis=0)
+    elif np.isnan(nodata):
+        valid = (~np.isnan(crop_data)).any(axis=0)
+    else:
+        valid = (crop_data != nodata).any(axis=0)
+    return np.count_nonzero(valid) / n_pixels
+
+
+def _crop_grid(src, crop_size, stride):
+    """
+    计算裁剪块的行列数，以及按源数据内部块对齐分组后的任务列表 [(i0, i1, j0, j1), ...]
+    """
+    crop_width, crop_height = crop_size
+    stride_x, stride_y = stride if stride is not None else crop_size
+
+    n_cols = int(np.ceil(max(src.width - crop_width, 0) / stride_x)) + 1
+    n_rows = int(np.ceil(max(src.height - crop_height, 0) / stride_y)) + 1
+
+    block_height, block_width = src.block_shapes[0]
+    cols_per_task = _block_aligned_group(block_width, stride_x, src.width)
+    # 条带存储时一个任务已包含整行，一行裁剪块已覆盖完整的条带，行方向不再按 min_pixels 放大，
+    # 否则每个任务要缓冲上千个整行（5 万列 3 波段时约 150 MB），多线程时内存成倍增加
+    min_rows = 0 if cols_per_task >= n_cols else 1024
+    rows_per_task = _block_aligned_group(block_height, stride_y, src.height, min_pixels=min_rows)
+
+    groups = [(i0, min(i0 + rows_per_task, n_rows), j0, min(j0 + cols_per_task, n_cols))
+              for i0 in range(0, n_rows, rows_per_task) for j0 in range(0, n_cols, cols_per_task)]
+    return n_rows, n_cols, groups
+
+
+def _iter_group_chips(src, group, crop_size, stride, read_buffers=None, pad_buffer=None):
+    """
+    读取一组裁剪块覆盖的区域，依次返回 (i, j, 窗口, 填充后的数组, 未填充的数组)。
+    read_buffers（按形状缓存的字典）和 pad_buffer 不为 None 时复用缓冲区，返回的数组在后续迭代中可能被覆盖
+    """
+    i0, i1, j0, j1 = group
+    crop_width, crop_height = crop_size
+    stride_x, stride_y = stride if stride is not None else crop_size
+
+    top = i0 * stride_y
+    left = j0 * stride_x
+    window = rasterio.windows.Window(left, top, min((j1 - 1) * stride_x + crop_width, src.width) - left,
+                                     min((i1 - 1) * stride_y + crop_height, src.height) - top)
+
+    if read_buffers is None:
+        group_data = src.read(window=window)
+    else:
+        # 相同形状的读取缓冲区复用
+        shape = (src.count, window.height, window.width)
+        group_data = read_buffers.get(shape)
+        if group_data is None:
+            group_data = read_buffers[shape] = np.empty(shape, dtype=src.dtypes[0])
+        src.read(window=window, out=group_data)
+
+    for i in range(i0, i1):
+        for j in range(j0, j1):
+            row_off = (i - i0) * stride_y
+            col_off = (j - j0) * stride_x
+            crop_data = group_data[:, row_off:row_off + crop_height, col_off:col_off + crop_width]
+            data_height, data_width = crop_data.shape[1:]
+            if (data_height, data_width) == (crop_height, crop_width):
+                padded_data = crop_data
+            else:
+                # 边缘的裁剪块复制到填充缓冲区中
+                if pad_buffer is None:
+                    padded_data = np.zeros((src.count, crop_height, crop_width), dtype=src.dtypes[0])
+                else:
+                    padded_data = pad_buffer
+                    padded_data.fill(0)
+                padded_data[:, :data_height, :data_width] = crop_data
+
+            chip_window = rasterio.windows.Window(left + col_off, top + row_off, crop_width, crop_height)
+            yield i, j, chip_window, padded_data, crop_data
+
+
+def iter_crops(input_tif, crop_size, stride=None):
+    """
+    按源数据的内部块分组读取，惰性生成每个裁剪块，不写出任何文件，供下游直接在内存中使用
+
+    Args:
+        input_tif (str): 输入 TIFF 文件路径。
+        crop_size (tuple): 裁剪尺寸 (width, height)。
+        stride (tuple): 步长 (x, y)，为 None 时等于裁剪尺寸，即不重叠。
+
+    Yields:
+        tuple: 裁剪窗口（超出源数据范围的部分已用 0 填充）, 裁剪块的仿射变换, (波段数, 高, 宽) 数组
+    """
+    with rasterio.open(input_tif) as src:
+        _, _, groups = _crop_grid(src, crop_size, stride)
+        for group in groups:
+            for _, _, window, padded_data, _ in _iter_group_chips(src, group, crop_size, stride):
+                yield window, src.window_transform(window), padded_data
+
+
+def load_chip_archive(archive_path):
+    """
+    以内存映射方式打开 crop_and_pad_tif 生成的裁剪块归档，不需要打开任何 GeoTIFF
+
+    Args:
+        archive_path (str): 归档路径（不含扩展名），对应 {archive_path}.bin 和 {archive_path}.json
+
+    Returns:
+        tuple: 只读的 (N, 波段数, 高, 宽) 数组, 索引信息（dtype、shape、crs、nodata 以及各裁剪块的 i、j、transform、valid_fraction）
+    """
+    with open(archive_path + '.json', 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    shape = tuple(index['shape'])
+    if shape[0] == 0:
+        return np.empty(shape, dtype=index['dtype']), index
+    return np.memmap(archive_path + '.bin', dtype=index['dtype'], mode='r', shape=shape), index
+
+
+def crop_and_pad_tif(input_tif, output_dir, crop_size, workers=None, stride=None, min_valid_fraction=None,
+                     manifest_name='manifest.csv', archive_name=None, write_tifs=True, report_name='run_report.json'):
     """
     裁剪并填充 TIFF 文件，并显示进度条。
+    按源数据的内部块把裁剪块分组，多线程读取和写出，每个线程使用各自的数据集句柄并复用填充缓冲区。
+    步长小于裁剪尺寸时相邻裁剪块重叠，同一组内的裁剪块共用一次读取的数据。
 
     Args:
         input_tif (str): 输入 TIFF 文件路径。
         output_dir (str): 输出 TIFF 文件目录。
         crop_size (tuple): 裁剪尺寸 (width, height)。
+        workers (int): 线程数，为 None 时使用 ThreadPoolExecutor 的默认值。
+        stride (tuple): 步长 (x, y)，为 None 时等于裁剪尺寸，即不重叠。
+        min_valid_fraction (float): 有效像素比例低于该值的裁剪块不输出，为 None 时全部输出。
+        manifest_name (str): 输出目录中记录各裁剪块范围和有效像素比例的清单文件名，为 None 时不输出。读取失败的裁剪块
+            written 为 0，error 列记录错误信息。
+        archive_name (str): 不为 None 时同时把裁剪块写入输出目录中的打包归档 {archive_name}.bin（(N, 波段数, 高, 宽) 的
+            原始数组）和 {archive_name}.json（索引），用 load_chip_archive 读取。
+        write_tifs (bool): 是否输出每个裁剪块的 GeoTIFF，只需要归档时可以设为 False。
+        report_name (str): 运行报告（各阶段耗时、读写字节数、每秒裁剪块数、峰值内存）在输出目录中的 JSON 文件名，
+            为 None 时不输出。read、write 为各线程读取（含填充）、写出耗时之和。
     """
+    report = RunReport('crop_and_pad_tif', os.path.join(output_dir, report_name) if report_name else None,
+                       input_tif=input_tif, crop_size=crop_size, workers=workers, stride=stride,
+                       min_valid_fraction=min_valid_fraction, archive_name=archive_name, write_tifs=write_tifs)
 
-    with rasterio.open(input_tif) as src:
+    with report.stage('discover'), rasterio.open(input_tif) as src:
         # 读取元数据
         metadata = src.meta.copy()
 
         # 计算裁剪块的数量
-        width = src.width
-        height = src.height
         crop_width, crop_height = crop_size
+        stride_x, stride_y = stride if stride is not None else crop_size
+        n_rows, n_cols, groups = _crop_grid(src, crop_size, stride)
+
+        src_transform = src.transform
+        count = src.count
+        dtype = src.dtypes[0]
+        nodata = src.nodata
+        crs_wkt = src.crs.to_wkt() if src.crs else None
+
+    # 元数据只构建一次，各裁剪块只替换 transform
+    metadata.update({
+        'width': crop_width,
+        'height': crop_height,
+        'count': count
+    })
 
-        n_cols = int(np.ceil(width / crop_width))
-        n_rows = int(np.ceil(height / crop_height))
+    total_crops = n_rows * n_cols  # 计算总的裁剪块数量
 
-        total_crops = n_rows * n_cols  # 计算总的裁剪块数量
+    archive = None
+    archive_chips = []
+    archive_lock = threading.Lock()
+    if archive_name is not None:
+        # 按最大数量预分配，跳过的裁剪块不占位置，结束后截断
+        archive_path = os.path.join(output_dir, archive_name)
+        archive = np.memmap(archive_path + '.bin', dtype=dtype, mode='w+',
+                            shape=(total_crops, count, crop_height, crop_width))
 
-        with tqdm(total=total_crops, desc="裁剪进度", unit="块") as pbar:  # 使用 tqdm 创建进度条
-            for i in range(n_rows):
-                for j in range(n_cols):
-                    # 计算裁剪窗口的边界
-                    left = j * crop_width
-                    top = i * crop_height
-                    right = min((j + 1) * crop_width, width)
-                    bottom = min((i + 1) * crop_height, height)
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+    report_lock = threading.Lock()
 
-                    window = rasterio.windows.Window(left, top, right - left, bottom - top)
+    def _thread_state():
+        if not hasattr(local, 'src'):
+            local.src = rasterio.open(input_tif)
+            local.read_buffers = {}
+            local.pad_buffer = np.zeros((count, crop_height, crop_width), dtype=dtype)
+            with handles_lock:
+                handles.append(local.src)
+        return local
 
-                    # 读取裁剪区域的数据
+    def _crop_group(i0, i1, j0, j1):
+        """
+        处理第 i0~i1 行、j0~j1 列的裁剪块，返回各裁剪块的清单记录
+        """
+        state = _thread_state()
+        records = []
+        read_seconds = write_seconds = 0.
+
+        def _crop_chips(group):
+            nonlocal read_seconds, write_seconds
+            start = time.perf_counter()
+            for i, j, window, padded_data, crop_data in _iter_group_chips(
+                    state.src, group, crop_size, stride, state.read_buffers, state.pad_buffer):
+                read_done = time.perf_counter()
+                read_seconds += read_done - start
+                records.append(_write_chip(i, j, window, padded_data, crop_data))
+                start = time.perf_counter()
+                write_seconds += start - read_done
+
+        try:
+            _crop_chips((i0, i1, j0, j1))
+        except ValueError:
+            # 整组读取失败时逐块重新读取，只跳过读取失败的裁剪块
+            done = {(record[1], record[2]) for record in records}
+            for i in range(i0, i1):
+                for j in range(j0, j1):
+                    if (i, j) in done:
+                        continue
                     try:
-                        crop_data = src.read(window=window)
+                        _crop_chips((i, i + 1, j, j + 1))
                     except ValueError as e:
                         print(f"Error reading window: {e}")
-                        pbar.update(1) #即使出错也要更新进度条
-                        continue
+                        records.append(_failed_chip(i, j, e))
+        with report_lock:
+            report.add_stage('read', read_seconds)
+            report.add_stage('write', write_seconds)
+        return records
 
-                    # 创建填充后的数据
-                    padded_data = np.zeros((src.count, crop_height, crop_width), dtype=src.dtypes[0])
+    def _failed_chip(i, j, error):
+        """
+        读取失败的裁剪块的清单记录
+        """
+        window = rasterio.windows.Window(j * stride_x, i * stride_y, crop_width, crop_height)
+        chip_left, chip_bottom, chip_right, chip_top = rasterio.windows.bounds(window, src_transform)
+        return (f"crop_{i}_{j}.tif", i, j, window.col_off, window.row_off, chip_left, chip_bottom, chip_right, chip_top,
+                0., 0, -1, str(error))
+
+    def _write_chip(i, j, window, padded_data, crop_data):
+        """
+        按有效像素比例输出一个裁剪块，返回清单记录
+        """
+        # 由窗口计算仿射变换，旋转的栅格同样正确
+        chip_transform = rasterio.windows.transform(window, src_transform)
+        valid_fraction = _valid_fraction(crop_data, nodata, crop_width * crop_height)
+        written = min_valid_fraction is None or valid_fraction >= min_valid_fraction
+
+        # 构建输出文件名
+        output_name = f"crop_{i}_{j}.tif"
+
+        archive_index = -1
+        if written and archive is not None:
+            with archive_lock:
+                archive_index = len(archive_chips)
+                archive_chips.append({'i': i, 'j': j, 'transform': list(chip_transform)[:6],
+                                      'valid_fraction': round(valid_fraction, 6)})
+            archive[archive_index] = padded_data
 
-                    # 将裁剪的数据复制到填充后的数据中
-                    pad_left = 0
-                    pad_top = 0
-                    data_width = crop_data.shape[2]
-                    data_height = crop_data.shape[1]
+        if written and write_tifs:
+            # 写入输出 TIFF 文件
+            with rasterio.open(os.path.join(output_dir, output_name), 'w',
+                               **dict(metadata, transform=chip_transform)) as dst:
+                dst.write(padded_data)
 
-                    padded_data[:, pad_top:pad_top+data_height, pad_left:pad_left+data_width] = crop_data
+        chip_left, chip_bottom, chip_right, chip_top = rasterio.windows.bounds(window, src_transform)
+        return (output_name, i, j, window.col_off, window.row_off, chip_left, chip_bottom, chip_right, chip_top,
+                round(valid_fraction, 6), int(written), archive_index, '')
 
+    manifest = []
+    try:
+        with report.stage('crop'), tqdm(total=total_crops, desc="裁剪进度", unit="块") as pbar, \
+                ThreadPoolExecutor(max_workers=workers) as executor:  # 使用 tqdm 创建进度条
+            futures = {executor.submit(_crop_group, *group): group for group in groups}
+            for future in as_completed(futures):
+                i0, i1, j0, j1 = futures[future]
+                manifest.extend(future.result())
+                pbar.update((i1 - i0) * (j1 - j0))  # 即使出错也要更新进度条
+    finally:
+        for handle in handles:
+            handle.close()
+        if archive is not None:
+            archive.flush()
+            del archive
+    finalize_start = time.perf_counter()
 
-                    # 更新元数据
-                    metadata.update({
-                        'width': crop_width,
-                        'height': crop_height,
-                        'transform': rasterio.transform.from_origin(src.bounds.left + j * crop_width * src.res[0],
-                                                                     src.bounds.top - i * crop_height * src.res[1],
-                                                                     src.res[0], src.res[1]),
-                        'count': src.count
-                    })
+    if archive_name is not None:
+        chip_bytes = count * crop_height * crop_width * np.dtype(dtype).itemsize
+        os.truncate(archive_path + '.bin', len(archive_chips) * chip_bytes)
+        with open(archive_path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'dtype': np.dtype(dtype).name, 'shape': [len(archive_chips), count, crop_height, crop_width],
+                       'crs': crs_wkt, 'nodata': nodata, 'chips': archive_chips}, f)
 
-                    # 构建输出文件名
-                    output_filename = os.path.join(output_dir, f"crop_{i}_{j}.tif")
+    if manifest_name is not None:
+        manifest.sort(key=lambda record: (record[1], record[2]))
+        with open(os.path.join(output_dir, manifest_name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'i', 'j', 'col_off', 'row_off', 'left', 'bottom', 'right', 'top',
+                             'valid_fraction', 'written', 'archive_index', 'error'])
+            writer.writerows(manifest)
+    report.add_stage('finalize', time.perf_counter() - finalize_start)
 
-                    # 写入输出 TIFF 文件
-                    with rasterio.open(output_filename, 'w', **metadata) as dst:
-                        dst.write(padded_data)
+    # 写出的字节数：各裁剪块 GeoTIFF、归档和清单
+    output_files = [os.path.join(output_dir, record[0]) for record in manifest if record[10] and write_tifs]
+    if archive_name is not None:
+        output_files += [archive_path + '.bin', archive_path + '.json']
+    if manifest_name is not None:
+        output_files.append(os.path.join(output_dir, manifest_name))
+    report.count(tiles=total_crops, tiles_written=sum(record[10] for record in manifest),
+                 tiles_failed=sum(bool(record[12]) for record in manifest),
+                 pixels=total_crops * crop_width * crop_height, bytes_read=RunReport.path_bytes(input_tif),
+                 bytes_written=RunReport.path_bytes(output_files))
+    report.finish()
 
-                    pbar.update(1)  # 更新进度条
 
 if __name__ == "__main__":
     # 示例用法
     input_tif = "input.tif"  #TIFF 文件路径
     output_dir = "output_crops"  # 输出目录
     crop_size = (256, 256)  # 裁剪尺寸
-    
+
     os.makedirs(output_dir, exist_ok=True)
-    
+
     crop_and_pad_tif(input_tif, output_dir, crop_size)
     print("裁剪完成！")
+
+    # 不写出文件，直接在内存中逐块使用
+    # for window, transform, chip in iter_crops(input_tif, crop_size):
+    #     ...
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pingouin as pg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from my_utils import CorrUtils  # noqa: E402
+
+x_names = ['x1', 'x2', 'x3']
+
+
+def _data(n_pixel=40, n_time=12, seed=0):
+    """y 与因子线性相关，混入缺失值、有效行数不足和常数列的像元"""
+    rng = np.random.default_rng(seed)
+    xs = [rng.normal(size=(n_pixel, n_time)) for _ in x_names]
+    y = 0.8 * xs[0] - 0.5 * xs[1] + rng.normal(size=(n_pixel, n_time))
+    for arr in [y] + xs:
+        arr[rng.random(arr.shape) < 0.08] = np.nan
+    y[0, 4:] = np.nan
+    xs[1][1] = 3.
+    return y, xs
+
+
+def _reference(y, xs):
+    r = np.full(len(x_names), np.nan)
+    p = np.full(len(x_names), np.nan)
+    df = pd.DataFrame(dict(zip(['y'] + x_names, [y] + xs))).dropna()
+    if df.shape[0] <= 3 or (df.nunique() < 2).any():
+        return r, p
+    for k, name in enumerate(x_names):
+        result = pg.partial_corr(data=df, x=name, y='y', covar=x_names[:k] + x_names[k + 1:])
+        # 与 analysis/02_pcorr_pval_calculate.py 一样按列位置取 r 和 p 值
+        r[k] = result.iloc[:, 1].values[0]
+        p[k] = result.iloc[:, 3].values[0]
+    return r, p
+
+
+def test_partial_corr_batch_matches_pingouin():
+    y, xs = _data()
+    r, p = CorrUtils.partial_corr_batch(y, xs)
+    assert r.shape == p.shape == (len(y), len(x_names))
+    for i in range(len(y)):
+        ref_r, ref_p = _reference(y[i], [x[i] for x in xs])
+        np.testing.assert_allclose(r[i], ref_r, rtol=1e-7, atol=1e-9, equal_nan=True, err_msg='r pixel %d' % i)
+        np.testing.assert_allclose(p[i], ref_p, rtol=1e-6, atol=1e-9, equal_nan=True, err_msg='p pixel %d' % i)
+    assert np.isnan(r[0]).all() and np.isnan(r[1]).all()
+
+
+def test_partial_corr_batch_accepts_stacked_factors():
+    y, xs = _data(seed=1)
+    r_list, p_list = CorrUtils.partial_corr_batch(y, xs)
+    r_arr, p_arr = CorrUtils.partial_corr_batch(y, np.stack(xs, axis=-1))
+    np.testing.assert_array_equal(r_list, r_arr)
+    np.testing.assert_array_equal(p_list, p_arr)
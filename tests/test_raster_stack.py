@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from my_utils import RasterStack  # noqa: E402
+
+
+def _write_stack(tmp_path, height=300, width=40, n_scenes=15):
+    rng = np.random.default_rng(0)
+    profile = dict(driver='GTiff', height=height, width=width, count=1, dtype='float32', nodata=-9999,
+                   crs='EPSG:4326', transform=from_origin(103.5, 29.3, 0.01, 0.01))
+    paths = []
+    expected = np.empty((n_scenes, height, width), dtype='float32')
+    for t in range(n_scenes):
+        data = rng.random((height, width), dtype='float32')
+        data[rng.random((height, width)) < 0.1] = -9999
+        path = str(tmp_path / ('%d.tif' % (2000 + t)))
+        with rasterio.open(path, 'w', **profile) as ds:
+            ds.write(data, 1)
+        expected[t] = np.where(data == -9999, np.nan, data)
+        paths.append(path)
+    return paths, expected
+
+
+def test_open_handles_bounded_over_windows(tmp_path):
+    paths, expected = _write_stack(tmp_path)
+    workers = 4
+    with RasterStack(paths, workers=workers) as stack:
+        windows = stack.list_windows(max_rows=16)
+        assert len(windows) > 10
+        for window in windows:
+            data = stack.read_window(window)
+            rows = slice(int(window.row_off), int(window.row_off + window.height))
+            np.testing.assert_array_equal(data, expected[:, rows, :])
+            # 每个解码线程最多一组句柄，不随窗口数增长
+            assert stack.open_handles() <= workers * len(paths)
+
+        for _, data in stack.iter_windows(max_rows=16, prefetch=2):
+            pass
+        assert stack.open_handles() <= (workers + 1) * len(paths)
+    assert stack.open_handles() == 0
+
+
+def test_close_shuts_down_decoder_threads(tmp_path):
+    paths, expected = _write_stack(tmp_path, height=64, n_scenes=4)
+    stack = RasterStack(paths, workers=2)
+    np.testing.assert_array_equal(np.moveaxis(stack.read(), -1, 0), expected)
+    stack.close()
+    assert stack._executor is None
+    # 关闭后再次读取会重新打开句柄
+    np.testing.assert_array_equal(np.moveaxis(stack.read(), -1, 0), expected)
+    stack.close()
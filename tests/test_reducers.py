@@ -0,0 +1,107 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from my_utils import (  # noqa: E402
+    CountReducer, MaxReducer, MeanReducer, MinReducer, QuantileReducer, StdReducer, VarReducer)
+
+
+def _stack(n_time=40, height=6, width=7, seed=0):
+    """(T, H, W)，值带较大的偏移以检验数值稳定性，混入缺失值、全为 nan 和有效值少于 5 个的像元"""
+    rng = np.random.default_rng(seed)
+    stack = 1e4 + rng.normal(size=(n_time, height, width))
+    stack[rng.random(stack.shape) < 0.15] = np.nan
+    stack[:, 0, 0] = np.nan
+    stack[3:, 0, 1] = np.nan
+    return stack
+
+
+def _reduce(reducer, stack):
+    # 按两个窗口逐景更新，与 reduce_rasters 分窗口读取时一样
+    reducer.start(*stack.shape[1:])
+    half = stack.shape[1] // 2
+    for data in stack:
+        reducer.update(data[:half], (slice(0, half), slice(None)))
+        reducer.update(data[half:], (slice(half, None), slice(None)))
+    return reducer.result()
+
+
+def _p2_reference(values, q):
+    """逐个值的 P² 算法（Jain & Chlamtac, 1985），有效值少于 5 个时为精确分位数"""
+    values = values[~np.isnan(values)]
+    if len(values) < 5:
+        return np.nanquantile(values, q) if len(values) else np.nan
+    h = sorted(values[:5])
+    n = [1., 2., 3., 4., 5.]
+    init = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+    step = [0, q / 2, q, (1 + q) / 2, 1]
+    for count, x in enumerate(values[5:], start=6):
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = max(i for i in range(4) if h[i] <= x)
+        for i in range(k + 1, 5):
+            n[i] += 1
+        # 期望位置按 init + (count - 5) * step 直接计算，逐次累加的浮点误差会改变 |d| = 1 时是否移动标记点
+        desired = [i0 + (count - 5) * s for i0, s in zip(init, step)]
+        for i in range(1, 4):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = np.sign(d)
+                parabolic = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if h[i - 1] < parabolic < h[i + 1]:
+                    h[i] = parabolic
+                else:
+                    j = i + int(d)
+                    h[i] = h[i] + d * (h[j] - h[i]) / (n[j] - n[i])
+                n[i] += d
+    return h[2]
+
+
+def test_welford_reducers_match_numpy():
+    stack = _stack()
+    with np.errstate(all='ignore'), pytest.warns(RuntimeWarning):
+        expected_mean = np.nanmean(stack, axis=0)
+        expected_var = np.nanvar(stack, axis=0, ddof=1)
+    np.testing.assert_array_equal(_reduce(CountReducer(), stack), np.sum(~np.isnan(stack), axis=0))
+    np.testing.assert_allclose(_reduce(MeanReducer(), stack), expected_mean, rtol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(_reduce(VarReducer(), stack), expected_var, rtol=1e-4, equal_nan=True)
+    np.testing.assert_allclose(_reduce(StdReducer(), stack), np.sqrt(expected_var), rtol=1e-4, equal_nan=True)
+    with np.errstate(all='ignore'), pytest.warns(RuntimeWarning):
+        expected_var0 = np.nanvar(stack, axis=0)
+    np.testing.assert_allclose(_reduce(VarReducer(ddof=0), stack), expected_var0, rtol=1e-4, equal_nan=True)
+
+
+def test_min_max_reducers_match_numpy():
+    stack = _stack(seed=1)
+    with np.errstate(all='ignore'), pytest.warns(RuntimeWarning):
+        expected_min = np.nanmin(stack, axis=0)
+        expected_max = np.nanmax(stack, axis=0)
+    np.testing.assert_allclose(_reduce(MinReducer(), stack), expected_min, rtol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(_reduce(MaxReducer(), stack), expected_max, rtol=1e-6, equal_nan=True)
+
+
+@pytest.mark.parametrize('q', [0.1, 0.5, 0.9])
+def test_quantile_reducer_matches_scalar_p2(q):
+    stack = _stack(seed=2) - 1e4
+    result = _reduce(QuantileReducer(q=q), stack)
+    expected = np.array([[_p2_reference(stack[:, r, c], q) for c in range(stack.shape[2])]
+                         for r in range(stack.shape[1])])
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6, equal_nan=True)
+
+
+def test_quantile_reducer_approximates_exact_quantile():
+    rng = np.random.default_rng(3)
+    stack = rng.normal(size=(2000, 3, 4))
+    result = _reduce(QuantileReducer(q=0.9), stack)
+    np.testing.assert_allclose(result, np.quantile(stack, 0.9, axis=0), atol=0.1)
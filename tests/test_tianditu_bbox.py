@@ -0,0 +1,62 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [_root, os.path.join(_root, 'process')]
+
+tianditu = importlib.import_module('01_TiandituUtils')
+Converter = tianditu.TiandituLonLatTile2TifConverter
+
+
+def _tile_bounds(row, col, z):
+    left, top = Converter.calculate_lon_lat(row, col, z)
+    right, bottom = Converter.calculate_lon_lat(row + 1, col + 1, z)
+    return left, bottom, right, top
+
+
+def test_exact_single_tile_bbox():
+    bounds = _tile_bounds(500, 1000, 12)
+    assert tuple(int(v) for v in Converter.bbox_tile_range(bounds, 12)) == (500, 500, 1000, 1000)
+    assert int(Converter.count_tiles_in_bbox(bounds, 12)) == 1
+    tiles = list(Converter.iter_tiles_in_bbox(bounds, 12))
+    assert len(tiles) == 1
+    rows, cols, z = tiles[0]
+    assert rows.tolist() == [500] and cols.tolist() == [1000] and z == 12
+
+
+def test_exact_multi_tile_and_partial_bbox():
+    left, _, _, top = _tile_bounds(500, 1000, 12)
+    _, bottom, right, _ = _tile_bounds(502, 1003, 12)
+    assert tuple(int(v) for v in Converter.bbox_tile_range((left, bottom, right, top), 12)) == (500, 502, 1000, 1003)
+
+    # 范围在瓦片内部时只覆盖所在的瓦片，越过边界一点时包含相邻的瓦片
+    l0, b0, r0, t0 = _tile_bounds(500, 1000, 12)
+    eps = (r0 - l0) * 1e-3
+    inside = (l0 + eps, b0 + eps, r0 - eps, t0 - eps)
+    assert tuple(int(v) for v in Converter.bbox_tile_range(inside, 12)) == (500, 500, 1000, 1000)
+    crossing = (l0, b0 - eps, r0 + eps, t0)
+    assert tuple(int(v) for v in Converter.bbox_tile_range(crossing, 12)) == (500, 501, 1000, 1001)
+
+
+def test_zoom_array_matches_scalar():
+    bounds = _tile_bounds(500, 1000, 12)
+    zooms = np.array([10, 12, 14])
+    counts = Converter.count_tiles_in_bbox(bounds, zooms)
+    assert counts.tolist() == [int(Converter.count_tiles_in_bbox(bounds, z)) for z in zooms]
+    assert counts.tolist() == [1, 1, 16]
+
+
+def test_tile_index_missing_exact_bbox(tmp_path):
+    tile_dir = tmp_path / 'tiles'
+    tile_dir.mkdir()
+    (tile_dir / '201812-1000-500-12.png').write_bytes(b'')
+    with tianditu.TileIndex(str(tmp_path / 'tiles.db')) as index:
+        index.scan(str(tile_dir), Converter.get_idx_row_col_z)
+        bounds = _tile_bounds(500, 1000, 12)
+        rows, cols, paths = index.query(bounds, 12)
+        assert rows.tolist() == [500] and cols.tolist() == [1000] and len(paths) == 1
+        miss_rows, miss_cols = index.missing(bounds, 12)
+        assert len(miss_rows) == 0 and len(miss_cols) == 0
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pymannkendall as mk
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import my_utils  # noqa: E402
+from my_utils import TrendUtils  # noqa: E402
+
+numba_options = [False] + ([True] if my_utils.numba is not None else [])
+
+
+def _block(n_pixel=60, n_time=15, seed=0):
+    """保留 1 位小数制造结值，并混入缺失值、全为 nan 和常数序列"""
+    rng = np.random.default_rng(seed)
+    trend = rng.normal(0, 0.3, (n_pixel, 1)) * np.arange(n_time)
+    block = np.round(trend + rng.normal(0, 1, (n_pixel, n_time)), 1)
+    block[rng.random(block.shape) < 0.1] = np.nan
+    block[0] = np.nan
+    block[1] = 2.5
+    block[2, :-3] = np.nan
+    return block
+
+
+def _reference(series):
+    result = mk.original_test(series)
+    trend = {'increasing': 1, 'decreasing': -1}.get(result.trend, 0)
+    return {'trend': trend, 'p': result.p, 'z': result.z, 'Tau': result.Tau, 's': result.s,
+            'var_s': result.var_s, 'slope': result.slope}
+
+
+@pytest.mark.parametrize('use_numba', numba_options)
+def test_sen_mk_batch_matches_pymannkendall(use_numba):
+    block = _block()
+    result = TrendUtils.sen_mk_batch(block, use_numba=use_numba)
+    # 有效值不足 2 个的序列 pymannkendall 无法计算，跳过
+    for i in range(3, len(block)):
+        expected = _reference(block[i])
+        for key, value in expected.items():
+            np.testing.assert_allclose(result[key][i], value, rtol=1e-5, atol=1e-6, err_msg='%s pixel %d' % (key, i))
+
+
+@pytest.mark.parametrize('use_numba', numba_options)
+def test_mk_score_tie_sum_matches_numpy(use_numba):
+    block = _block(seed=1)
+    s, tie_sum = TrendUtils.mk_score_tie_sum(block, use_numba=use_numba)
+    np.testing.assert_array_equal(s, TrendUtils.mk_score(block))
+    np.testing.assert_array_equal(tie_sum, TrendUtils.tie_sum(block))
+    slope, _ = TrendUtils.sens_slope(block, use_numba=use_numba)
+    ref_slope, _ = TrendUtils.sens_slope(block, use_numba=False)
+    np.testing.assert_allclose(slope, ref_slope, rtol=1e-12, equal_nan=True)
+
+
+def test_mk_append_matches_full_recompute():
+    block = _block(seed=2)
+    s, tie_sum = TrendUtils.mk_score_tie_sum(block[:, :-1], use_numba=False)
+    s, tie_sum = TrendUtils.mk_append(block[:, :-1], s, tie_sum, block[:, -1])
+    full_s, full_tie_sum = TrendUtils.mk_score_tie_sum(block, use_numba=False)
+    np.testing.assert_array_equal(s, full_s)
+    np.testing.assert_array_equal(tie_sum, full_tie_sum)
+    result = TrendUtils.sen_mk_batch(block, s=s, tie_sum=tie_sum)
+    np.testing.assert_array_equal(result['tie_sum'], full_tie_sum)